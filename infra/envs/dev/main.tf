@@ -65,6 +65,7 @@ module "agent_api" {
   vectors_prefix    = "knowledge/vectors/dev/chroma_v2/"   # ✅ ADD THIS LINE
   chroma_collection = var.chroma_collection
   embed_model       = var.embed_model
+  embed_dimensions  = var.embed_dimensions
 
   agents_key = "agents.json"
 
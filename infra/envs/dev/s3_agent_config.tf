@@ -54,4 +54,12 @@ resource "aws_s3_object" "allowlists_json" {
   source       = "${local.agent_config_dir}/allowlists.json"
   content_type = "application/json"
   etag         = filemd5("${local.agent_config_dir}/allowlists.json")
-}
\ No newline at end of file
+}
+
+resource "aws_s3_object" "questions_json" {
+  bucket       = aws_s3_bucket.agent_config.id
+  key          = "${local.agent_config_prefix}/questions.json"
+  source       = "${local.agent_config_dir}/questions.json"
+  content_type = "application/json"
+  etag         = filemd5("${local.agent_config_dir}/questions.json")
+}
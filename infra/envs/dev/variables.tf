@@ -76,6 +76,12 @@ variable "embed_model" {
   default     = "text-embedding-3-small"
 }
 
+variable "embed_dimensions" {
+  type        = number
+  description = "Embedding size for indexing/query (build_chroma.py EMBED_DIMENSIONS; 0 = model default)"
+  default     = 0
+}
+
 variable "vectors_prefix" {
   type        = string
   description = "Prefix under agent_config_bucket where Chroma store files are uploaded"
@@ -66,6 +66,7 @@ module "agent_api" {
   vectors_prefix    = var.vectors_prefix
   chroma_collection = var.chroma_collection
   embed_model       = var.embed_model
+  embed_dimensions  = var.embed_dimensions
 
   agents_key = "agents.json"
 
@@ -97,6 +97,12 @@ variable "embed_model" {
   default     = "text-embedding-3-small"
 }
 
+variable "embed_dimensions" {
+  type        = number
+  description = "Embedding size for indexing/query (build_chroma.py EMBED_DIMENSIONS; 0 = model default)"
+  default     = 0
+}
+
 # ------------------------------------
 # Lambda image
 # ------------------------------------
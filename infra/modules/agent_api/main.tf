@@ -66,6 +66,72 @@ data "aws_iam_policy_document" "lambda_s3_read" {
   }
 }
 
+# Idempotency records (short TTL, see core/idempotency.py): the only prefix the Lambda writes
+data "aws_iam_policy_document" "lambda_s3_idempotency" {
+  statement {
+    sid       = "IdempotencyRecords"
+    actions   = ["s3:GetObject", "s3:PutObject", "s3:DeleteObject"]
+    resources = ["arn:aws:s3:::${var.agent_config_bucket}/${var.idempotency_prefix}/*"]
+  }
+}
+
+resource "aws_iam_role_policy" "lambda_s3_idempotency_inline" {
+  name   = "${local.lambda_name}-s3-idempotency"
+  role   = aws_iam_role.lambda_role.id
+  policy = data.aws_iam_policy_document.lambda_s3_idempotency.json
+}
+
+# Expired records are ignored by the API but never deleted by it; let S3 clean them up.
+# Note: this resource owns the whole lifecycle configuration of the bucket.
+resource "aws_s3_bucket_lifecycle_configuration" "idempotency" {
+  bucket = var.agent_config_bucket
+
+  rule {
+    id     = "expire-idempotency-records"
+    status = "Enabled"
+
+    filter {
+      prefix = "${var.idempotency_prefix}/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
+}
+
+# ---------------- Rate limiting (shared token buckets) ----------------
+
+resource "aws_dynamodb_table" "rate_limits" {
+  name         = "${local.lambda_name}-rate-limits"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+data "aws_iam_policy_document" "lambda_rate_limits" {
+  statement {
+    sid       = "RateLimitBuckets"
+    actions   = ["dynamodb:GetItem", "dynamodb:PutItem"]
+    resources = [aws_dynamodb_table.rate_limits.arn]
+  }
+}
+
+resource "aws_iam_role_policy" "lambda_rate_limits_inline" {
+  name   = "${local.lambda_name}-rate-limits"
+  role   = aws_iam_role.lambda_role.id
+  policy = data.aws_iam_policy_document.lambda_rate_limits.json
+}
+
 resource "aws_iam_role_policy" "lambda_s3_read_inline" {
   name   = "${local.lambda_name}-s3-read"
   role   = aws_iam_role.lambda_role.id
@@ -144,6 +210,19 @@ resource "aws_lambda_function" "agent_api" {
       VECTORS_PREFIX    = local.vectors_prefix_effective
       CHROMA_COLLECTION = local.chroma_collection_effective
       EMBED_MODEL       = var.embed_model
+      EMBED_DIMENSIONS  = tostring(var.embed_dimensions)
+
+      # Idempotency-Key replay store
+      IDEMPOTENCY_BACKEND = "s3"
+      IDEMPOTENCY_PREFIX  = var.idempotency_prefix
+
+      # Per-client token buckets (RATE_LIMITS JSON overrides the per-route defaults)
+      RATE_LIMIT_BACKEND = "dynamodb"
+      RATE_LIMIT_TABLE   = aws_dynamodb_table.rate_limits.name
+      RATE_LIMITS        = var.rate_limits_json
+      # Client IP = the X-Forwarded-For hop CloudFront appends; X-Api-Key only if listed (SHA-256 hex)
+      RATE_LIMIT_TRUSTED_HOPS = "1"
+      RATE_LIMIT_API_KEYS     = var.rate_limit_api_key_hashes
     }
   }
 
@@ -175,7 +254,9 @@ resource "aws_apigatewayv2_api" "http_api" {
       "X-Requested-With",
       "X-Amz-Date",
       "X-Api-Key",
-      "X-Amz-Security-Token"
+      "X-Amz-Security-Token",
+      "Idempotency-Key",
+      "X-Include-Usage"
     ]
     max_age = 3600
   }
@@ -66,6 +66,30 @@ variable "embed_model" {
   default = "text-embedding-3-small"
 }
 
+variable "embed_dimensions" {
+  type        = number
+  description = "Query embedding size; must match the store's EMBED_DIMENSIONS (0 = model default)"
+  default     = 0
+}
+
+variable "idempotency_prefix" {
+  type        = string
+  description = "S3 prefix (no trailing slash) for Idempotency-Key records; the Lambda may write here"
+  default     = "idempotency"
+}
+
+variable "rate_limits_json" {
+  type        = string
+  description = "Optional per-route limits, e.g. {\"/runbooks/ask\": {\"per_min\": 30, \"burst\": 10}}; empty = app defaults"
+  default     = ""
+}
+
+variable "rate_limit_api_key_hashes" {
+  type        = string
+  description = "Comma-separated SHA-256 hex digests of X-Api-Key values rate-limited per key; other keys are limited per IP"
+  default     = ""
+}
+
 variable "agents_key" {
   type    = string
   default = "agents.json"
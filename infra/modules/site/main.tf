@@ -160,7 +160,7 @@ resource "aws_cloudfront_distribution" "cdn" {
 
       forwarded_values {
         query_string = true
-        headers      = ["Authorization", "Content-Type", "Origin"]
+        headers      = ["Authorization", "Content-Type", "Origin", "Idempotency-Key", "X-Include-Usage"]
         cookies {
           forward = "none"
         }
@@ -403,6 +403,13 @@ def _ensure_chroma():
         raise RuntimeError("VECTORS_PREFIX env var missing")
 
     vectors_prefix = _s3_key(VECTORS_PREFIX)
+    # Versioned stores (scripts/build_chroma.py): load only the version current.json points at
+    try:
+        pointer = _get_object_json(S3_BUCKET, f"{vectors_prefix.rstrip('/')}/current.json")
+        vectors_prefix = f"{vectors_prefix.rstrip('/')}/versions/{pointer['version']}/"
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+            raise
     _download_prefix(S3_BUCKET, vectors_prefix, CHROMA_LOCAL_DIR)
 
     try:
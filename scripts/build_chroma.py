@@ -9,10 +9,14 @@ What it does:
    - NEW PDFs -> index
    - CHANGED PDFs -> delete prior vectors for that pdf, re-index
    - REMOVED PDFs -> delete vectors for that pdf
-4) Downloads existing Chroma store from S3 (VECTORS_PREFIX) unless --rebuild
-5) Updates local Chroma store
-6) Uploads updated Chroma store back to S3 (VECTORS_PREFIX) unless --dry-run
-7) Writes updated manifest back to S3 unless --dry-run
+4) Downloads the live Chroma store from S3 (the version current.json points at) unless --rebuild
+5) Updates local Chroma store (+ per-runbook centroid table used for coarse routing)
+6) Writes a new immutable version unless --dry-run (VECTORS_PREFIX/versions/<version>/, see rag_versions.py):
+   changed store files are uploaded, unchanged ones copied server-side (ETag compare, see rag_s3_sync.py)
+7) Writes the updated manifest into the new version
+8) Writes runbook titles + section headings for typeahead (<version>/suggest.json, see rag_suggest.py)
+9) Writes the related-runbooks graph from the per-runbook centroids (<version>/related.json)
+10) Points VECTORS_PREFIX/current.json at the new version (one atomic PUT), then prunes old versions
 
 Dry run:
   python scripts/build_chroma_index.py --dry-run
@@ -20,6 +24,16 @@ Dry run:
 Rebuild:
   python scripts/build_chroma_index.py --rebuild
 
+Delta publish (upload only a small segment with the changed vectors + tombstones, see rag_segments.py):
+  python scripts/build_chroma_index.py --delta
+
+Compact (fold all delta segments back into the base store):
+  python scripts/build_chroma_index.py --compact
+
+Roll back (point current.json at the version the live one replaced, or at a given version):
+  python scripts/build_chroma_index.py --rollback
+  python scripts/build_chroma_index.py --rollback v000041-20261017T101500Z
+
 Create the following environment variables before running:
 export S3_BUCKET="llm-sre-agent-config-dev-830330555687"
 export S3_PREFIX="knowledge"
@@ -29,6 +43,58 @@ export CHROMA_COLLECTION="runbooks_dev"
 export EMBED_MODEL="text-embedding-3-small"
 export OPENAI_API_KEY="sk-...."   # not required for dry-run but ok
 
+Optional (two-level parent/child index, see rag_chunking.py):
+export CHUNK_MODE="hierarchical"
+export PARENT_CHUNK_SIZE="3000" CHILD_CHUNK_SIZE="400" CHILD_CHUNK_OVERLAP="80"
+
+Optional structure-aware chunks (page headers/footers stripped, split on headings / paragraphs / code
+under a token budget, page range + heading in metadata, see rag_chunking.py):
+export CHUNK_MODE="structured" CHUNK_MAX_TOKENS="350"
+
+Optional chunk text storage (external = chunks.bin + chunks.idx.json, see rag_text_store.py):
+export CHUNK_TEXT_STORE="external" CHUNK_TEXT_CODEC="zlib"   # default "inline"; codec "zstd" needs zstandard
+(switching an existing inline store to external needs --rebuild)
+
+Optional smaller vectors (dimensions is passed to the embeddings API and needs --rebuild to change;
+the API's EMBED_DIMENSIONS must match. VECTOR_QUANT adds vectors.q.npy, see rag_quant.py):
+export EMBED_DIMENSIONS="512" VECTOR_QUANT="int8"   # or "binary" / "none"
+
+Optional HNSW build/search params (M + construction_ef only apply when the collection is created,
+i.e. on --rebuild; unset values fall back to the manifest's "hnsw_recommended" from hnsw_sweep.py):
+export HNSW_M="16" HNSW_CONSTRUCTION_EF="100" HNSW_SEARCH_EF="64"
+
+Optional related-runbooks graph (neighbours per runbook, min centroid cosine similarity):
+export RELATED_K="5" RELATED_MIN_SCORE="0.3"
+
+Optional embedding quota (defaults are the tier-1 limits of text-embedding-3-small; 0 = rely on 429s):
+export EMBED_RPM="3000" EMBED_TPM="1000000" EMBED_MAX_CONCURRENCY="8"
+
+Optional embedding cache (vectors keyed by model + dimensions + chunk text, see rag_embed_cache.py;
+"off" disables it; the S3 key, in S3_BUCKET, shares it between machines and CI runs):
+export EMBED_CACHE_PATH="./.embed_cache/embeddings.sqlite" EMBED_CACHE_S3_KEY="knowledge/cache/embeddings.sqlite"
+
+Optional ingestion concurrency (download threads / PDF parse processes / embedding threads, queue size):
+export INGEST_DOWNLOAD_WORKERS="4" INGEST_PARSE_WORKERS="3" INGEST_EMBED_WORKERS="4" INGEST_QUEUE_SIZE="8"
+
+Optional PDF spooling (downloads stay in memory up to this size, larger ones go to LOCAL_TMP_RUNBOOK_DIR;
+pages are then extracted and chunked one at a time, see rag_pdf_stream.py):
+export PDF_SPOOL_MAX_MB="16"
+
+Optional (--delta compacts instead once this many segments are pending):
+export DELTA_COMPACT_AFTER="8"
+
+Optional sharded manifest (the "files" map split into N objects next to manifest.json; only the
+shards that changed are rewritten, see rag_manifest.py) and S3 threads for HEAD fallbacks / shards:
+export MANIFEST_FILE_SHARDS="64" S3_WORKERS="16"
+
+Optional multipart part size for store uploads (also the threshold; changing it re-uploads large files once):
+export S3_MULTIPART_CHUNK_MB="8"
+
+Optional publishing (versioned: immutable versions behind current.json, the newest VERSIONS_KEEP kept for
+rollback; inplace: the pre-versioning layout, store files overwritten under VECTORS_PREFIX, MANIFEST_KEY honoured).
+Deploy the API before the first versioned publish: older API builds only read the in-place layout.
+export PUBLISH_MODE="versioned" VERSIONS_KEEP="5"
+
 python scripts/build_chroma_index.py --dry-run
 """
 
@@ -40,14 +106,15 @@ import json
 import os
 import shutil
 import sys
+import threading
 import time
-import uuid
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import boto3
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
-from pypdf import PdfReader
 
 # --- sqlite shim (only needed in Lambda; safe locally) ---
 try:
@@ -58,7 +125,33 @@ except Exception:
 
 import chromadb
 from chromadb.config import Settings
-from openai import OpenAI
+
+from rag_chunking import ParentStore, iter_structured_chunks, split_parent_child
+from rag_embed_cache import DEFAULT_CACHE_PATH, CachedEmbedder, open_cache
+from rag_embed_scheduler import EmbeddingScheduler
+from rag_doc_table import CENTROIDS_FILENAME, DOCUMENTS_FILENAME, RELATED_FILENAME, CentroidAccumulator, DocumentTable, related_graph
+from rag_manifest import FILES_DIRNAME, files_index, plan_file_shards, read_files, shard_key, stale_shards
+from rag_pdf_stream import DEFAULT_SPOOL_MAX_MB, SpooledPdf, iter_pdf_pages, spool_s3_object
+from rag_pipeline import IngestPipeline, default_parse_workers
+from rag_suggest import SUGGEST_FILENAME, HeadingCollector, SuggestTable
+from rag_s3_sync import MB, SyncPlan, copy_prefix, delete_orphans, plan_sync, upload_planned
+from rag_quant import QUANT_FILENAME, QUANT_INDEX_FILENAME, QUANT_KINDS, export_quantized, remove_quantized
+from rag_text_store import ChunkTextStore, resolve_codec
+from rag_segments import SEGMENTS_DIRNAME, DeltaSegmentWriter, fold_segment_into, segment_id_for
+from rag_versions import (
+    POINTER_FILENAME,
+    VERSIONS_DIRNAME,
+    Pointer,
+    PointerConflict,
+    delete_version,
+    list_versions,
+    pointer_key,
+    prune_versions,
+    read_pointer,
+    version_id,
+    version_prefix,
+    write_pointer,
+)
 
 
 # ---------------------------
@@ -71,6 +164,7 @@ VECTORS_PREFIX = os.environ.get("VECTORS_PREFIX", "knowledge/vectors/dev/chroma_
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "").strip()
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-3-small").strip()
+EMBED_DIMENSIONS = int(os.environ.get("EMBED_DIMENSIONS", "0"))  # 0 = model default (1536 for -3-small)
 CHROMA_COLLECTION = os.environ.get("CHROMA_COLLECTION", "runbooks_dev").strip()
 
 LOCAL_CHROMA_DIR = os.environ.get("LOCAL_CHROMA_DIR", "./chroma_store").strip()
@@ -79,15 +173,81 @@ LOCAL_TMP_RUNBOOK_DIR = os.environ.get("LOCAL_TMP_RUNBOOK_DIR", "./.tmp_runbooks
 CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "1200"))
 CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "200"))
 EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
-
-# Manifest location (recommended to keep INSIDE vectors prefix)
-# Default: s3://bucket/<VECTORS_PREFIX>/manifest.json
-MANIFEST_KEY = os.environ.get("MANIFEST_KEY", f"{VECTORS_PREFIX.rstrip('/')}/manifest.json").lstrip("/").strip()
+# Embedding quota (rag_embed_scheduler.py): account requests/min and tokens/min (0 = rely on 429s),
+# and the most batches in flight (lowered automatically on 429s)
+EMBED_RPM = int(os.environ.get("EMBED_RPM", "3000"))
+EMBED_TPM = int(os.environ.get("EMBED_TPM", "1000000"))
+EMBED_MAX_CONCURRENCY = int(os.environ.get("EMBED_MAX_CONCURRENCY", "8"))
+
+# Content-addressed embedding cache (rag_embed_cache.py); EMBED_CACHE_S3_KEY="" keeps it local
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", DEFAULT_CACHE_PATH).strip()
+EMBED_CACHE_S3_KEY = os.environ.get("EMBED_CACHE_S3_KEY", "").lstrip("/").strip()
+
+# Chunk layout:
+#   flat         -> CHUNK_SIZE/CHUNK_OVERLAP chunks, each embedded and stored with its text
+#   hierarchical -> small CHILD_* chunks are embedded; PARENT_CHUNK_SIZE sections go to parents.json
+#   structured   -> whole headings / paragraphs / code blocks packed up to CHUNK_MAX_TOKENS (estimated)
+CHUNK_MODE = os.environ.get("CHUNK_MODE", "flat").strip().lower()
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "350"))
+PARENT_CHUNK_SIZE = int(os.environ.get("PARENT_CHUNK_SIZE", "3000"))
+CHILD_CHUNK_SIZE = int(os.environ.get("CHILD_CHUNK_SIZE", "400"))
+CHILD_CHUNK_OVERLAP = int(os.environ.get("CHILD_CHUNK_OVERLAP", "80"))
+
+# HNSW index params (0 = manifest recommendation, else Chroma default)
+HNSW_M = int(os.environ.get("HNSW_M", "0"))
+HNSW_CONSTRUCTION_EF = int(os.environ.get("HNSW_CONSTRUCTION_EF", "0"))
+HNSW_SEARCH_EF = int(os.environ.get("HNSW_SEARCH_EF", "0"))
+
+# Chunk texts: inline | external (compressed side store, Chroma keeps ids/metadata/vectors).
+# Switching an existing inline store to external needs --rebuild (see main).
+CHUNK_TEXT_STORE = os.environ.get("CHUNK_TEXT_STORE", "inline").strip().lower()
+CHUNK_TEXT_CODEC = os.environ.get("CHUNK_TEXT_CODEC", "zlib").strip().lower()
+
+# Quantized copy of the base vectors for the API's first-pass scan: none | int8 | binary
+VECTOR_QUANT = os.environ.get("VECTOR_QUANT", "none").strip().lower()
+
+# --delta publishes a full (compacting) build instead once this many segments are pending
+DELTA_COMPACT_AFTER = int(os.environ.get("DELTA_COMPACT_AFTER", "8"))
+
+# Staged ingestion (rag_pipeline.py): S3 download threads, PDF parse processes, embedding threads,
+# bounded hand-off queues and a progress line every INGEST_REPORT_SEC (0 = summary only)
+INGEST_DOWNLOAD_WORKERS = int(os.environ.get("INGEST_DOWNLOAD_WORKERS", "4"))
+INGEST_PARSE_WORKERS = int(os.environ.get("INGEST_PARSE_WORKERS", str(default_parse_workers())))
+INGEST_EMBED_WORKERS = int(os.environ.get("INGEST_EMBED_WORKERS", "4"))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "8"))
+INGEST_REPORT_SEC = float(os.environ.get("INGEST_REPORT_SEC", "10"))
+# Downloads up to this size are parsed from memory; larger ones are spooled to LOCAL_TMP_RUNBOOK_DIR
+PDF_SPOOL_MAX_MB = float(os.environ.get("PDF_SPOOL_MAX_MB", str(DEFAULT_SPOOL_MAX_MB)))
+
+# Related-runbooks graph: neighbours kept per runbook and the minimum centroid cosine similarity
+RELATED_K = int(os.environ.get("RELATED_K", "5"))
+RELATED_MIN_SCORE = float(os.environ.get("RELATED_MIN_SCORE", "0.3"))
+
+# Manifest location for PUBLISH_MODE=inplace (recommended to keep INSIDE vectors prefix)
+# Default: s3://bucket/<VECTORS_PREFIX>/manifest.json; a versioned store keeps it in each version
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_KEY = os.environ.get("MANIFEST_KEY", f"{VECTORS_PREFIX.rstrip('/')}/{MANIFEST_FILENAME}").lstrip("/").strip()
+
+# versioned: each build is a new immutable prefix behind current.json (rag_versions.py) | inplace
+PUBLISH_MODE = os.environ.get("PUBLISH_MODE", "versioned").strip().lower()
+VERSIONS_KEEP = int(os.environ.get("VERSIONS_KEEP", "5"))
+
+# Split the manifest's "files" map into this many objects under files/ (rag_manifest.py); 0 = inline
+MANIFEST_FILE_SHARDS = int(os.environ.get("MANIFEST_FILE_SHARDS", "0"))
+
+# Threads for HEAD fallbacks, manifest shards and store uploads (all on the one shared S3 client)
+S3_WORKERS = int(os.environ.get("S3_WORKERS", "16"))
+# Multipart threshold / part size for store uploads; changing it re-uploads every large file once
+S3_MULTIPART_CHUNK_MB = int(os.environ.get("S3_MULTIPART_CHUNK_MB", "8"))
 
 
 # ---------------------------
 # Data structures
 # ---------------------------
+# Either embeds every chunk, or only the chunks the cache has not seen (same embed() contract)
+Embedder = Union[EmbeddingScheduler, CachedEmbedder]
+
+
 @dataclass(frozen=True)
 class S3PdfMeta:
     key: str
@@ -96,10 +256,16 @@ class S3PdfMeta:
     last_modified: str  # isoformat
 
     @staticmethod
-    def from_head_or_list_obj(obj: Dict[str, Any]) -> "S3PdfMeta":
-        # list_objects_v2 "Contents" has ETag only via head_object, but many people want to avoid head calls.
-        # We'll do HEAD to get stable etag for diffing.
-        raise NotImplementedError
+    def from_head_or_list_obj(key: str, obj: Dict[str, Any]) -> "S3PdfMeta":
+        # list_objects_v2 "Contents" entries carry the same ETag / LastModified as head_object
+        # (Size vs ContentLength), so the listing alone is enough to diff.
+        lm = obj.get("LastModified")
+        return S3PdfMeta(
+            key=key,
+            etag=(obj.get("ETag") or "").replace('"', ""),
+            size=int(obj.get("Size", obj.get("ContentLength")) or 0),
+            last_modified=lm.isoformat() if lm else "",
+        )
 
 
 # ---------------------------
@@ -121,6 +287,15 @@ def runbooks_prefix_full() -> str:
     return p.rstrip("/") + "/"
 
 
+def related_key(store_prefix: str) -> str:
+    return f"{store_prefix}{RELATED_FILENAME}"
+
+
+def suggest_key(store_prefix: str) -> str:
+    # Next to the store, but not inside it: the API reads it without downloading the store
+    return f"{store_prefix}{SUGGEST_FILENAME}"
+
+
 def vectors_prefix_full() -> str:
     return VECTORS_PREFIX.rstrip("/") + "/"
 
@@ -128,25 +303,33 @@ def vectors_prefix_full() -> str:
 # ---------------------------
 # Helpers: PDF parsing + chunking
 # ---------------------------
-def pdf_to_text(path: str) -> str:
-    reader = PdfReader(path)
-    parts: List[str] = []
-    for page in reader.pages:
-        parts.append(page.extract_text() or "")
-    return "\n".join(parts).strip()
+def joined_pages(pages: Iterable[str]) -> Iterator[str]:
+    """The pieces of "\n".join(pages), one page at a time."""
+    for i, page in enumerate(pages):
+        yield page if i == 0 else "\n" + page
 
 
-def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
-    text = (text or "").strip()
-    if not text:
-        return []
-    chunks: List[str] = []
-    i = 0
+def iter_chunk_text(pieces: Iterable[str], chunk_size: int, overlap: int) -> Iterator[str]:
+    """
+    chunk_size windows every chunk_size - overlap chars over the stripped text, which arrives
+    in pieces (e.g. joined_pages). A window is yielded once the text is known to extend past
+    it, so about one chunk plus one piece is held.
+    """
     step = max(1, chunk_size - overlap)
-    while i < len(text):
-        chunks.append(text[i : i + chunk_size])
-        i += step
-    return chunks
+    buf = ""
+    started = False  # leading whitespace of the whole text is stripped
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            started = bool(piece)
+        buf += piece
+        # Trailing whitespace may turn out to be the end of the text, which is stripped too
+        while len(buf.rstrip()) >= chunk_size:
+            yield buf[:chunk_size]
+            buf = buf[step:]
+    buf = buf.rstrip()
+    for i in range(0, len(buf), step):
+        yield buf[i : i + chunk_size]
 
 
 def stable_chunk_id(s3_key: str, chunk_index: int) -> str:
@@ -159,38 +342,38 @@ def stable_chunk_id(s3_key: str, chunk_index: int) -> str:
 # ---------------------------
 # Helpers: S3 operations
 # ---------------------------
+_s3 = None
+_s3_lock = threading.Lock()
+
+
 def s3_client():
-    return boto3.client("s3")
+    """One client per run: boto3 clients are thread-safe, and building one costs more than most calls."""
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            _s3 = boto3.client("s3", config=BotoConfig(max_pool_connections=max(10, S3_WORKERS)))
+        return _s3
 
 
-def s3_list_pdfs(bucket: str, prefix: str) -> List[str]:
+def s3_list_pdf_objects(bucket: str, prefix: str) -> Dict[str, Dict[str, Any]]:
+    """PDF key -> its list_objects_v2 entry (ETag, Size, LastModified)."""
     s3 = s3_client()
-    keys: List[str] = []
-    token = None
-    while True:
-        kwargs = {"Bucket": bucket, "Prefix": prefix}
-        if token:
-            kwargs["ContinuationToken"] = token
-        resp = s3.list_objects_v2(**kwargs)
-        for obj in resp.get("Contents", []) or []:
+    objects: Dict[str, Dict[str, Any]] = {}
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []) or []:
             k = obj.get("Key") or ""
             if k.lower().endswith(".pdf"):
-                keys.append(k)
-        if resp.get("IsTruncated"):
-            token = resp.get("NextContinuationToken")
-        else:
-            break
-    return sorted(keys)
+                objects[k] = obj
+    return objects
+
+
+def s3_list_pdfs(bucket: str, prefix: str) -> List[str]:
+    return sorted(s3_list_pdf_objects(bucket, prefix))
 
 
 def s3_head_pdf_meta(bucket: str, key: str) -> Dict[str, Any]:
-    s3 = s3_client()
-    resp = s3.head_object(Bucket=bucket, Key=key)
-    etag = (resp.get("ETag") or "").replace('"', "")
-    size = int(resp.get("ContentLength") or 0)
-    lm = resp.get("LastModified")
-    lm_iso = lm.isoformat() if lm else ""
-    return {"key": key, "etag": etag, "size": size, "last_modified": lm_iso}
+    resp = s3_client().head_object(Bucket=bucket, Key=key)
+    return asdict(S3PdfMeta.from_head_or_list_obj(key, resp))
 
 
 def s3_get_json(bucket: str, key: str) -> Dict[str, Any]:
@@ -215,9 +398,11 @@ def s3_put_json(bucket: str, key: str, data: Dict[str, Any]) -> None:
     )
 
 
-def s3_download_prefix(bucket: str, prefix: str, local_dir: str) -> int:
+def s3_list_keys(bucket: str, prefix: str, exclude: Tuple[str, ...] = ()) -> List[str]:
+    """All object keys under prefix; keys under prefix+<exclude> are skipped."""
     s3 = s3_client()
     prefix = prefix.rstrip("/") + "/"
+    skip = tuple(prefix + e for e in exclude)
     token = None
     keys: List[str] = []
     while True:
@@ -227,13 +412,20 @@ def s3_download_prefix(bucket: str, prefix: str, local_dir: str) -> int:
         resp = s3.list_objects_v2(**kwargs)
         for obj in resp.get("Contents", []) or []:
             k = obj.get("Key") or ""
-            if k.endswith("/"):
+            if k.endswith("/") or (skip and k.startswith(skip)):
                 continue
             keys.append(k)
         if resp.get("IsTruncated"):
             token = resp.get("NextContinuationToken")
         else:
             break
+    return keys
+
+
+def s3_download_prefix(bucket: str, prefix: str, local_dir: str, exclude: Tuple[str, ...] = ()) -> int:
+    s3 = s3_client()
+    prefix = prefix.rstrip("/") + "/"
+    keys = s3_list_keys(bucket, prefix, exclude=exclude)
 
     if not keys:
         return 0
@@ -252,28 +444,170 @@ def s3_download_prefix(bucket: str, prefix: str, local_dir: str) -> int:
     return count
 
 
-def s3_upload_dir(bucket: str, prefix: str, local_dir: str) -> int:
+def s3_delete_keys(bucket: str, keys: List[str]) -> int:
     s3 = s3_client()
-    prefix = prefix.rstrip("/") + "/"
-    count = 0
-    for root, _, files in os.walk(local_dir):
-        for fn in files:
-            full = os.path.join(root, fn)
-            rel = os.path.relpath(full, local_dir).replace("\\", "/")
-            key = prefix + rel
-            s3.upload_file(full, bucket, key)
-            count += 1
-    return count
+    for start in range(0, len(keys), 1000):
+        batch = keys[start : start + 1000]
+        s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True})
+    return len(keys)
+
+
+def s3_sync_dir(
+    bucket: str,
+    prefix: str,
+    local_dir: str,
+    keep: Tuple[str, ...] = (),
+    base_prefix: Optional[str] = None,
+) -> SyncPlan:
+    """
+    Upload new / changed files of local_dir (rag_s3_sync.py); the returned plan lists orphans to delete
+    later. With base_prefix, files unchanged there are copied from it instead (a new version).
+    """
+    s3 = s3_client()
+    t0 = time.time()
+    plan = plan_sync(
+        s3, bucket, prefix, local_dir,
+        keep=keep, base_prefix=base_prefix, chunk_size=S3_MULTIPART_CHUNK_MB * MB, workers=S3_WORKERS,
+    )
+    upload_planned(s3, bucket, plan, local_dir, workers=S3_WORKERS)
+    print(f"Synced s3://{bucket}/{plan.prefix}: {plan.summary()} ({time.time() - t0:.1f}s)")
+    return plan
+
+
+def published_side_files(prefix: str, manifest_key: str) -> Tuple[str, ...]:
+    """Paths under a store prefix written by this script itself, not synced from the local store."""
+    side = [SUGGEST_FILENAME, RELATED_FILENAME, f"{SEGMENTS_DIRNAME}/", f"{FILES_DIRNAME}/", f"{VERSIONS_DIRNAME}/", POINTER_FILENAME]
+    if manifest_key.startswith(prefix):
+        side.append(manifest_key[len(prefix) :])
+    return tuple(side)
+
+
+# ---------------------------
+# Publishing: immutable versions behind current.json (rag_versions.py)
+# ---------------------------
+@dataclass
+class Publish:
+    """Where this run reads the live store from and where it writes the new one."""
+
+    root: str                  # vectors_prefix_full(): holds current.json + versions/
+    pointer: Optional[Pointer]  # current.json as read at the start; None while published in place
+    live_prefix: str
+    live_manifest_key: str
+    target_prefix: str
+    target_manifest_key: str
+    version: Optional[str] = None  # the new version (PUBLISH_MODE=versioned)
+    seq: int = 0
+
+    @property
+    def versioned(self) -> bool:
+        return self.version is not None
+
+
+def resolve_publish(versioned: bool) -> Publish:
+    """
+    Resolve current.json. The first versioned build reads the in-place layout (VECTORS_PREFIX,
+    MANIFEST_KEY) and publishes version 1 next to it; the in-place objects are left for API
+    containers that predate the pointer and can be deleted once none are left.
+    """
+    root = vectors_prefix_full()
+    pointer = read_pointer(s3_client(), S3_BUCKET, root)
+    if pointer is not None:
+        live_prefix = root + pointer.prefix
+        live_manifest_key = live_prefix + MANIFEST_FILENAME
+    else:
+        live_prefix, live_manifest_key = root, MANIFEST_KEY
+    if not versioned:
+        return Publish(root, pointer, live_prefix, live_manifest_key, live_prefix, live_manifest_key)
+
+    seq = (pointer.seq if pointer is not None else 0) + 1
+    version = version_id(seq)
+    target_prefix = root + version_prefix(version)
+    return Publish(root, pointer, live_prefix, live_manifest_key, target_prefix, target_prefix + MANIFEST_FILENAME, version, seq)
+
+
+def publish_version(pub: Publish) -> None:
+    """Point current.json at the version this run wrote (if nobody else published meanwhile), then prune."""
+    assert pub.version is not None
+    s3 = s3_client()
+    pointer = Pointer(
+        version=pub.version,
+        seq=pub.seq,
+        published_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        previous=pub.pointer.version if pub.pointer is not None else None,
+    )
+    try:
+        write_pointer(s3, S3_BUCKET, pub.root, pointer, expected=pub.pointer)
+    except PointerConflict as e:
+        deleted = delete_version(s3, S3_BUCKET, pub.root, pub.version)
+        raise SystemExit(f"Not published: {e}. Deleted unpublished version {pub.version} ({deleted} objects); re-run the build.")
+    print(f"Published version {pub.version}: s3://{S3_BUCKET}/{pointer_key(pub.root)} -> {pointer.prefix} (previous {pointer.previous})")
+
+    pruned = prune_versions(s3, S3_BUCKET, pub.root, VERSIONS_KEEP, protect=(pointer.version, pointer.previous))
+    if pruned:
+        print(f"Pruned {len(pruned)} old versions (VERSIONS_KEEP={VERSIONS_KEEP}): {', '.join(pruned)}")
+
+
+def rollback(target: str, dry_run: bool) -> None:
+    """Point current.json at an older, still-kept version ("previous": the one the live version replaced)."""
+    s3 = s3_client()
+    root = vectors_prefix_full()
+    pointer = read_pointer(s3, S3_BUCKET, root)
+    if pointer is None:
+        raise SystemExit(f"No s3://{S3_BUCKET}/{pointer_key(root)}: the store is published in place, nothing to roll back to")
+    version = pointer.previous if target == "previous" else target
+    if not version:
+        raise SystemExit(f"Live version {pointer.version} has no previous version; pass one of: {', '.join(list_versions(s3, S3_BUCKET, root))}")
+    if version == pointer.version:
+        print(f"{version} is already live.")
+        return
+    manifest_key = root + version_prefix(version) + MANIFEST_FILENAME
+    if not s3_get_json(S3_BUCKET, manifest_key):
+        raise SystemExit(f"Version {version} has no manifest (pruned or incomplete); kept: {', '.join(list_versions(s3, S3_BUCKET, root))}")
+
+    # seq stays the highest issued, so the next build still gets a new, later version id
+    new = Pointer(
+        version=version,
+        seq=pointer.seq,
+        published_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        previous=pointer.version,
+    )
+    if dry_run:
+        print(f"DRY-RUN: would point s3://{S3_BUCKET}/{pointer_key(root)} at {version} (live: {pointer.version})")
+        return
+    try:
+        write_pointer(s3, S3_BUCKET, root, new, expected=pointer)
+    except PointerConflict as e:
+        raise SystemExit(f"Not rolled back: {e}; re-run to roll back from the new live version.")
+    print(f"Rolled back: s3://{S3_BUCKET}/{pointer_key(root)} -> {new.prefix} (was {pointer.version})")
 
 
 # ---------------------------
 # Diff logic
 # ---------------------------
-def build_current_state(bucket: str, pdf_keys: List[str]) -> Dict[str, Dict[str, Any]]:
+def build_current_state(
+    bucket: str,
+    pdf_keys: List[str],
+    listed: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Metadata for pdf_keys from their listing entries; HEAD (in parallel, shared client)
+    only for keys the listing did not describe, e.g. S3-compatible stores without ETags.
+    """
+    listed = listed or {}
     current: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
     for k in pdf_keys:
-        meta = s3_head_pdf_meta(bucket, k)
-        current[k] = meta
+        obj = listed.get(k)
+        if obj and obj.get("ETag") and obj.get("LastModified"):
+            current[k] = asdict(S3PdfMeta.from_head_or_list_obj(k, obj))
+        else:
+            missing.append(k)
+
+    if missing:
+        print(f"HEAD fallback for {len(missing)} PDFs ({S3_WORKERS} threads)")
+        with ThreadPoolExecutor(max_workers=S3_WORKERS) as pool:
+            for k, meta in zip(missing, pool.map(lambda key: s3_head_pdf_meta(bucket, key), missing)):
+                current[k] = meta
     return current
 
 
@@ -304,16 +638,58 @@ def compute_diff(
 # ---------------------------
 # Chroma operations
 # ---------------------------
-def open_chroma(local_dir: str):
+def resolve_hnsw_params(manifest: Dict[str, Any]) -> Dict[str, int]:
+    """Env HNSW_* wins; otherwise use the sweep recommendation stored in the manifest."""
+    rec = manifest.get("hnsw_recommended") if isinstance(manifest.get("hnsw_recommended"), dict) else {}
+    params = {
+        "M": HNSW_M or int(rec.get("M") or 0),
+        "construction_ef": HNSW_CONSTRUCTION_EF or int(rec.get("construction_ef") or 0),
+        "search_ef": HNSW_SEARCH_EF or int(rec.get("search_ef") or 0),
+    }
+    return {k: v for k, v in params.items() if v > 0}
+
+
+def hnsw_collection_metadata(params: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    if not params:
+        return None
+    return {f"hnsw:{k}": v for k, v in params.items()}
+
+
+def open_chroma(local_dir: str, hnsw_params: Optional[Dict[str, int]] = None):
     os.makedirs(local_dir, exist_ok=True)
     client = chromadb.PersistentClient(
         path=local_dir,
         settings=Settings(anonymized_telemetry=False),
     )
-    col = client.get_or_create_collection(CHROMA_COLLECTION)
+    # Chroma only applies collection metadata at creation; an existing collection keeps its HNSW params
+    col = client.get_or_create_collection(CHROMA_COLLECTION, metadata=hnsw_collection_metadata(hnsw_params or {}))
+    current = col.metadata or {}
+    for k, v in (hnsw_params or {}).items():
+        if current.get(f"hnsw:{k}") != v:
+            print(f"NOTE: existing collection has hnsw:{k}={current.get(f'hnsw:{k}', 'default')} (wanted {v}); use --rebuild to apply")
     return client, col
 
 
+def backfill_centroids(collection, doc_table: DocumentTable, keys: List[str]) -> int:
+    """
+    Compute centroids from already-stored vectors for runbooks that have none yet
+    (e.g. the first incremental run after the document table was introduced).
+    """
+    filled = 0
+    for k in doc_table.missing(keys):
+        got = collection.get(where={"s3_key": k}, include=["embeddings", "metadatas"])
+        vectors = got.get("embeddings")
+        if vectors is None or len(vectors) == 0:
+            continue
+        acc = CentroidAccumulator()
+        acc.add(vectors)
+        metas = got.get("metadatas") or [{}]
+        filename = (metas[0] or {}).get("file") or k.split("/")[-1]
+        doc_table.put(k, filename, acc.centroid(), len(vectors))
+        filled += 1
+    return filled
+
+
 def chroma_delete_pdf(collection, s3_key: str, dry_run: bool) -> None:
     if dry_run:
         print(f"DRY-RUN: would delete vectors where s3_key == {s3_key}")
@@ -322,68 +698,516 @@ def chroma_delete_pdf(collection, s3_key: str, dry_run: bool) -> None:
     collection.delete(where={"s3_key": s3_key})
 
 
-def chroma_index_pdf(
-    collection,
-    openai_client: OpenAI,
-    bucket: str,
-    s3_key: str,
-    dry_run: bool,
-) -> Tuple[int, int]:
+@dataclass
+class ParsedPdf:
+    s3_key: str
+    filename: str
+    headings: List[str]                # for suggest.json
+    chunks: List[str]
+    parents: List[Any]                 # rag_chunking.ParentChunk (hierarchical mode)
+    parent_ids: List[Optional[str]]
+    parent_indexes: List[Optional[int]]
+    chunk_meta: List[Dict[str, Any]] = field(default_factory=list)  # per chunk (structured mode): pages, heading
+
+
+def download_pdf(s3, s3_key: str) -> Tuple[str, SpooledPdf]:
+    """Pipeline download stage: (s3_key, spooled PDF). s3 is one client shared by the download threads."""
+    pdf = spool_s3_object(s3, S3_BUCKET, s3_key, tmp_dir=LOCAL_TMP_RUNBOOK_DIR, max_memory=int(PDF_SPOOL_MAX_MB * MB))
+    return s3_key, pdf
+
+
+def parse_pdf(job: Tuple[str, SpooledPdf]) -> ParsedPdf:
     """
-    Returns (chunks_added, embed_calls_batches)
+    Pipeline parse stage (runs in a worker process): headings + chunks, extracted and chunked
+    a page at a time; a spooled temp file is removed afterwards.
     """
-    filename = s3_key.split("/")[-1]
-    os.makedirs(LOCAL_TMP_RUNBOOK_DIR, exist_ok=True)
-    local_pdf = os.path.join(LOCAL_TMP_RUNBOOK_DIR, f"{uuid.uuid4()}__{filename}")
-
-    # Download
-    if dry_run:
-        print(f"DRY-RUN: would download s3://{bucket}/{s3_key} -> {local_pdf}")
+    s3_key, pdf = job
+    headings = HeadingCollector()
+    pages = headings.observe(iter_pdf_pages(pdf))
+
+    parents: List[Any] = []
+    parent_ids: List[Optional[str]] = []
+    parent_indexes: List[Optional[int]] = []
+    chunk_meta: List[Dict[str, Any]] = []
+    chunks: List[str] = []
+    if CHUNK_MODE == "structured":
+        for c in iter_structured_chunks(pages, max_tokens=CHUNK_MAX_TOKENS):
+            chunks.append(c.text)
+            chunk_meta.append({"page_start": c.page_start, "page_end": c.page_end, "heading": c.heading})
+    elif CHUNK_MODE == "hierarchical":
+        # Parent sections span pages, so this mode still works on the whole text
+        parents, children = split_parent_child(
+            s3_key,
+            "\n".join(pages).strip(),
+            parent_size=PARENT_CHUNK_SIZE,
+            child_size=CHILD_CHUNK_SIZE,
+            child_overlap=CHILD_CHUNK_OVERLAP,
+        )
+        chunks = [c.text for c in children]
+        parent_ids = [c.parent_id for c in children]
+        parent_indexes = [c.parent_index for c in children]
     else:
-        s3_client().download_file(bucket, s3_key, local_pdf)
+        chunks = list(iter_chunk_text(joined_pages(pages), CHUNK_SIZE, CHUNK_OVERLAP))
+    return ParsedPdf(s3_key, s3_key.split("/")[-1], headings.headings, chunks, parents, parent_ids, parent_indexes, chunk_meta)
+
+
+def new_embedder() -> Embedder:
+    """Rate-limited scheduler, behind the embedding cache unless EMBED_CACHE_PATH=off."""
+    scheduler = EmbeddingScheduler(
+        OPENAI_API_KEY,
+        EMBED_MODEL,
+        dimensions=EMBED_DIMENSIONS,
+        rpm=EMBED_RPM,
+        tpm=EMBED_TPM,
+        max_concurrency=EMBED_MAX_CONCURRENCY,
+    )
+    cache_uri = f"s3://{S3_BUCKET}/{EMBED_CACHE_S3_KEY}" if EMBED_CACHE_S3_KEY else ""
+    cache = open_cache(EMBED_CACHE_PATH, s3_client() if cache_uri else None, cache_uri)
+    return CachedEmbedder(scheduler, cache) if cache is not None else scheduler
 
-    # Parse + chunk
-    text = "" if dry_run else pdf_to_text(local_pdf)
-    chunks = [] if dry_run else chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
 
-    if not chunks and not dry_run:
-        print(f"Skip (no text extracted): {s3_key}")
-        return 0, 0
+def push_embed_cache(embedder: Embedder) -> None:
+    if isinstance(embedder, CachedEmbedder) and EMBED_CACHE_S3_KEY:
+        embedder.cache.push(s3_client(), S3_BUCKET, EMBED_CACHE_S3_KEY)
+        print(f"Embedding cache: uploaded {len(embedder.cache)} entries -> s3://{S3_BUCKET}/{EMBED_CACHE_S3_KEY}")
 
-    if dry_run:
-        # Estimate chunk count without reading PDF (we can’t safely estimate); print intent only.
-        print(f"DRY-RUN: would extract text + chunk + embed + add to Chroma for: {s3_key}")
-        return 0, 0
 
-    # Embed + upsert (after delete, add is fine too; upsert is safer)
-    total_added = 0
-    batches = 0
+def embed_chunks(embedder: Embedder, parsed: ParsedPdf) -> Tuple[ParsedPdf, List[List[float]], int]:
+    """Pipeline embed stage: (parsed, vectors, embedding calls); the runbook's batches are in flight together."""
+    vectors, batches = embedder.embed(parsed.chunks, EMBED_BATCH_SIZE)
+    return parsed, vectors, batches
+
+
+def store_pdf(
+    collection,
+    parsed: ParsedPdf,
+    vectors: List[List[float]],
+    parent_store: Optional[ParentStore] = None,
+    doc_table: Optional[DocumentTable] = None,
+    suggest: Optional[SuggestTable] = None,
+    text_store: Optional[ChunkTextStore] = None,
+) -> int:
+    """
+    Pipeline write stage (single thread): upsert one runbook's chunks; returns chunks added.
+
+    When parent_store is given (CHUNK_MODE=hierarchical), the parent sections are recorded in the side table.
+    When doc_table is given, the runbook's centroid (mean chunk vector) is recorded.
+    When suggest is given, the runbook's title + section headings are recorded for typeahead.
+    When text_store is given, chunk texts go there instead of Chroma's documents.
+    """
+    s3_key, filename = parsed.s3_key, parsed.filename
+    if suggest is not None and parsed.chunks:
+        suggest.put(s3_key, filename, parsed.headings)
+    if parent_store is not None:
+        parent_store.put(s3_key, filename, parsed.parents)
+    if not parsed.chunks:
+        print(f"Skip (no text extracted): {s3_key}")
+        return 0
 
-    for start in range(0, len(chunks), EMBED_BATCH_SIZE):
-        batch = chunks[start : start + EMBED_BATCH_SIZE]
-        emb = openai_client.embeddings.create(model=EMBED_MODEL, input=batch)
-        vectors = [d.embedding for d in emb.data]
-        batches += 1
+    centroid = CentroidAccumulator()
+    for start in range(0, len(parsed.chunks), EMBED_BATCH_SIZE):
+        batch = parsed.chunks[start : start + EMBED_BATCH_SIZE]
+        batch_vectors = vectors[start : start + EMBED_BATCH_SIZE]
+        centroid.add(batch_vectors)
 
         ids = [stable_chunk_id(s3_key, start + i) for i in range(len(batch))]
         metas = [{"s3_key": s3_key, "file": filename, "chunk": start + i} for i in range(len(batch))]
+        if parsed.parent_ids:
+            for i, m in enumerate(metas):
+                m["parent_id"] = parsed.parent_ids[start + i]
+                m["parent_index"] = parsed.parent_indexes[start + i]
+        if parsed.chunk_meta:
+            for i, m in enumerate(metas):
+                m.update(parsed.chunk_meta[start + i])
 
         # In chromadb, upsert exists in newer versions; add may fail if IDs exist.
         # Since we delete first for changed files, add should be OK. Upsert is extra-safe.
+        docs: Dict[str, Any] = {"documents": batch}
+        if text_store is not None:
+            text_store.put(s3_key, ids, batch)
+            docs = {}
         if hasattr(collection, "upsert"):
-            collection.upsert(ids=ids, documents=batch, metadatas=metas, embeddings=vectors)
+            collection.upsert(ids=ids, metadatas=metas, embeddings=batch_vectors, **docs)
         else:
-            collection.add(ids=ids, documents=batch, metadatas=metas, embeddings=vectors)
+            collection.add(ids=ids, metadatas=metas, embeddings=batch_vectors, **docs)
+
+    if doc_table is not None:
+        doc_table.put(s3_key, filename, centroid.centroid(), len(parsed.chunks))
+    return len(parsed.chunks)
 
-        total_added += len(batch)
 
-    # Cleanup PDF
+def index_pdfs(
+    collection,
+    embedder: Embedder,
+    s3_keys: List[str],
+    *,
+    label: str = "Indexed",
+    parent_store: Optional[ParentStore] = None,
+    doc_table: Optional[DocumentTable] = None,
+    suggest: Optional[SuggestTable] = None,
+    text_store: Optional[ChunkTextStore] = None,
+) -> Tuple[int, int]:
+    """
+    Download, parse, embed and store s3_keys through the staged pipeline (rag_pipeline.py).
+    Returns (chunks_added, embed_calls_batches).
+    """
+    totals = [0, 0]
+    s3 = s3_client()
+
+    def write(s3_key: str, embedded: Tuple[ParsedPdf, List[List[float]], int]) -> None:
+        parsed, vectors, batches = embedded
+        added = store_pdf(
+            collection, parsed, vectors,
+            parent_store=parent_store, doc_table=doc_table, suggest=suggest, text_store=text_store,
+        )
+        totals[0] += added
+        totals[1] += batches
+        print(f"{label}: {s3_key}  chunks={added}  embed_batches={batches}")
+
+    pipeline = IngestPipeline(
+        download=lambda s3_key: download_pdf(s3, s3_key),
+        parse=parse_pdf,
+        embed=lambda parsed: embed_chunks(embedder, parsed),
+        write=write,
+        download_workers=INGEST_DOWNLOAD_WORKERS,
+        parse_workers=INGEST_PARSE_WORKERS,
+        embed_workers=INGEST_EMBED_WORKERS,
+        queue_size=INGEST_QUEUE_SIZE,
+        report_every=INGEST_REPORT_SEC,
+    )
     try:
-        os.remove(local_pdf)
-    except Exception:
-        pass
+        pipeline.run(s3_keys)
+    finally:
+        # Keep what was embedded even if the run fails: the retry then only pays for the rest
+        push_embed_cache(embedder)
+    if s3_keys:
+        pipeline.print_summary()
+        embedder.print_summary()
+    return totals[0], totals[1]
+
+
+# ---------------------------
+# Manifest + delta segments
+# ---------------------------
+def manifest_segments(manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+    segs = manifest.get("segments")
+    if not isinstance(segs, list):
+        return []
+    return sorted([s for s in segs if isinstance(s, dict) and s.get("id")], key=lambda s: int(s.get("seq") or 0))
+
+
+def build_manifest(
+    previous: Dict[str, Any],
+    current_files: Dict[str, Dict[str, Any]],
+    *,
+    hnsw: Dict[str, Any],
+    parent_store: Optional[ParentStore],
+    segments: List[Dict[str, Any]],
+    pub: Publish,
+) -> Dict[str, Any]:
+    manifest = {
+        "schema": 1,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "bucket": S3_BUCKET,
+        "runbooks_prefix": runbooks_prefix_full(),
+        "vectors_prefix": pub.target_prefix,
+        "version": pub.version,
+        "collection": CHROMA_COLLECTION,
+        "embed_model": EMBED_MODEL,
+        "embed_dimensions": EMBED_DIMENSIONS or None,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunk_mode": CHUNK_MODE,
+        "chunk_max_tokens": CHUNK_MAX_TOKENS if CHUNK_MODE == "structured" else None,
+        "parent_chunk_size": PARENT_CHUNK_SIZE if parent_store is not None else None,
+        "child_chunk_size": CHILD_CHUNK_SIZE if parent_store is not None else None,
+        "child_chunk_overlap": CHILD_CHUNK_OVERLAP if parent_store is not None else None,
+        "hnsw": hnsw,
+        "segments": segments,
+        "files": current_files,  # only current PDFs
+    }
+    # Keep the last sweep result (scripts/hnsw_sweep.py) across incremental builds
+    if isinstance(previous.get("hnsw_recommended"), dict):
+        manifest["hnsw_recommended"] = previous["hnsw_recommended"]
+    # Delta publishes leave the base text store untouched
+    if isinstance(previous.get("chunk_text"), dict):
+        manifest["chunk_text"] = previous["chunk_text"]
+    if isinstance(previous.get("quantization"), dict):
+        manifest["quantization"] = previous["quantization"]
+    return manifest
+
+
+def load_manifest(manifest_key: str) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """(published manifest, its files map) whether "files" is inline or sharded."""
+    manifest = s3_get_json(S3_BUCKET, manifest_key)
+    files = read_files(manifest, manifest_key, lambda key: s3_get_json(S3_BUCKET, key), workers=S3_WORKERS)
+    return manifest, files
+
+
+def write_manifest(previous: Dict[str, Any], new_manifest: Dict[str, Any], pub: Publish) -> None:
+    """
+    Upload changed "files" shards (MANIFEST_FILE_SHARDS > 0), then the manifest, then drop unused
+    shards. A new version starts empty, so all of its shards are written.
+    """
+    manifest_key = pub.target_manifest_key
+    body = dict(new_manifest)
+    files = body.pop("files", None) or {}
+    body.pop("files_index", None)
+    if MANIFEST_FILE_SHARDS > 0:
+        index, uploads = plan_file_shards({} if pub.versioned else previous, files, MANIFEST_FILE_SHARDS)
+        s3 = s3_client()
+
+        def put(name: str) -> None:
+            s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=shard_key(manifest_key, index["prefix"], name),
+                Body=uploads[name],
+                ContentType="application/json",
+            )
+
+        with ThreadPoolExecutor(max_workers=S3_WORKERS) as pool:
+            list(pool.map(put, sorted(uploads)))
+        body["files_index"] = index
+        print(f"Manifest files: {len(files)} runbooks in {MANIFEST_FILE_SHARDS} shards ({len(uploads)} rewritten)")
+    else:
+        body["files"] = files
+
+    s3_put_json(S3_BUCKET, manifest_key, body)
+
+    prev_index = files_index(previous)
+    stale = stale_shards(previous, MANIFEST_FILE_SHARDS) if not pub.versioned else []
+    if stale:
+        keys = [shard_key(manifest_key, str(prev_index.get("prefix") or f"{FILES_DIRNAME}/"), n) for n in stale]
+        print(f"Deleted {s3_delete_keys(S3_BUCKET, keys)} unused manifest shards")
+
+
+def dir_size_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            total += os.path.getsize(os.path.join(root, fn))
+    return total
+
+
+def with_chunk_counts(
+    current_files: Dict[str, Dict[str, Any]],
+    previous_files: Dict[str, Dict[str, Any]],
+    doc_table: DocumentTable,
+    reindexed: List[str],
+) -> Dict[str, Dict[str, Any]]:
+    """Manifest "files" plus per-file chunk counts (this run's table, else the previous manifest)."""
+    redone = set(reindexed)
+    out: Dict[str, Dict[str, Any]] = {}
+    for k, meta in current_files.items():
+        m = dict(meta)
+        doc = doc_table.docs.get(k)
+        if doc is not None:
+            m["chunks"] = int(doc.get("chunks") or 0)
+        elif k in redone:
+            m["chunks"] = 0
+        elif isinstance((previous_files.get(k) or {}).get("chunks"), int):
+            m["chunks"] = previous_files[k]["chunks"]
+        out[k] = m
+    return out
+
+
+def index_stats(
+    previous: Dict[str, Any],
+    *,
+    vectors: Optional[int],
+    dim: int,
+    base_bytes: int,
+    segment_bytes: int,
+    started: float,
+) -> Dict[str, Any]:
+    """Summary served by GET /runbooks/index/stats without loading the store."""
+    prev = previous.get("stats") if isinstance(previous.get("stats"), dict) else {}
+    return {
+        "version": int(prev.get("version") or 0) + 1,
+        "vectors": vectors,
+        "dim": dim or prev.get("dim"),
+        "bytes": base_bytes + segment_bytes,
+        "base_bytes": base_bytes,
+        "build_seconds": round(time.time() - started, 1),
+    }
+
 
-    return total_added, batches
+def fold_segments(
+    collection,
+    parent_store: Optional[ParentStore],
+    doc_table: DocumentTable,
+    segments: List[Dict[str, Any]],
+    store_prefix: str,
+    text_store: Optional[ChunkTextStore] = None,
+) -> int:
+    """Download every pending segment of the store at store_prefix and apply it (in seq order) to the local base store."""
+    seg_root = f"{LOCAL_CHROMA_DIR.rstrip('/')}.segments"
+    folded = 0
+    for seg in segments:
+        local_dir = os.path.join(seg_root, seg["id"])
+        s3_download_prefix(S3_BUCKET, store_prefix + seg["prefix"], local_dir)
+        tombstones = [str(k) for k in seg.get("tombstones") or []]
+
+        for k in tombstones:
+            if text_store is not None:
+                text_store.remove_source(k)
+        folded += fold_segment_into(collection, local_dir, tombstones, text_store=text_store)
+        for k in tombstones:
+            doc_table.remove(k)
+            if parent_store is not None:
+                parent_store.remove_source(k)
+
+        seg_docs = DocumentTable(local_dir).load()
+        for k, d in seg_docs.docs.items():
+            doc_table.put(k, d.get("file") or k.split("/")[-1], seg_docs.centroids.get(k), d.get("chunks") or 0)
+        if parent_store is not None:
+            parent_store.parents.update(ParentStore(local_dir).load().parents)
+
+    shutil.rmtree(seg_root, ignore_errors=True)
+    return folded
+
+
+def load_remote_document_table(prefix: str) -> DocumentTable:
+    """Fetch only documents.json + centroids.npy of a published store or segment."""
+    local_dir = os.path.join(f"{LOCAL_CHROMA_DIR.rstrip('/')}.tables", hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16])
+    shutil.rmtree(local_dir, ignore_errors=True)
+    os.makedirs(local_dir, exist_ok=True)
+    s3 = s3_client()
+    for name in (DOCUMENTS_FILENAME, CENTROIDS_FILENAME):
+        try:
+            s3.download_file(S3_BUCKET, f"{prefix.rstrip('/')}/{name}", os.path.join(local_dir, name))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                continue
+            raise
+    table = DocumentTable(local_dir, key_field="s3_key").load()
+    shutil.rmtree(local_dir, ignore_errors=True)
+    return table
+
+
+def write_related_graph(table: DocumentTable, store_prefix: str) -> None:
+    graph = related_graph(table, k=RELATED_K, min_score=RELATED_MIN_SCORE)
+    graph["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    s3_put_json(S3_BUCKET, related_key(store_prefix), graph)
+    print(f"Wrote related graph: s3://{S3_BUCKET}/{related_key(store_prefix)} ({len(graph['docs'])} runbooks, k={RELATED_K})")
+
+
+def publish_delta(
+    manifest: Dict[str, Any],
+    previous_files: Dict[str, Dict[str, Any]],
+    current_files: Dict[str, Dict[str, Any]],
+    added: List[str],
+    changed: List[str],
+    removed: List[str],
+    embedder: Optional[Embedder],
+    dry_run: bool,
+    started: float,
+    pub: Publish,
+) -> None:
+    """
+    Index only added/changed PDFs into a new immutable segment and append it to the manifest.
+    A versioned publish first copies the live version (base store + pending segments) server-side.
+    """
+    segments = manifest_segments(manifest)
+    seq = max([int(s.get("seq") or 0) for s in segments] + [int(manifest.get("base_seq") or 0)]) + 1
+    created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    seg_id = segment_id_for(seq, created_at)
+    seg_prefix = f"{SEGMENTS_DIRNAME}/{seg_id}/"
+    local_dir = os.path.join(f"{LOCAL_CHROMA_DIR.rstrip('/')}.segments", seg_id)
+
+    tombstones = sorted(set(changed) | set(removed))
+    print(f"Delta segment {seg_id}: index={len(added) + len(changed)} tombstones={len(tombstones)}")
+    if dry_run:
+        print(f"DRY-RUN: would upload segment -> s3://{S3_BUCKET}/{pub.target_prefix}{seg_prefix}")
+        print(f"DRY-RUN: would append segment to manifest -> s3://{S3_BUCKET}/{pub.target_manifest_key}")
+        if pub.versioned:
+            print(f"DRY-RUN: would publish version {pub.version} (copy of {pub.live_prefix} + segment) via current.json")
+        return
+
+    writer = DeltaSegmentWriter(local_dir)
+    parent_store = ParentStore(local_dir) if CHUNK_MODE == "hierarchical" else None
+    doc_table = DocumentTable(local_dir, key_field="s3_key")
+    suggest = SuggestTable(s3_get_json(S3_BUCKET, suggest_key(pub.live_prefix)))
+    for k in removed:
+        suggest.remove(k)
+
+    assert embedder is not None
+    _, total_batches = index_pdfs(
+        writer, embedder, changed + added,
+        label="Indexed (delta)", parent_store=parent_store, doc_table=doc_table, suggest=suggest,
+    )
+
+    vectors = writer.save()
+    doc_table.save()
+    if parent_store is not None:
+        parent_store.save()
+
+    if pub.versioned:
+        # Pending segments are part of the live store; the side files are rewritten below
+        rewritten = tuple(p for p in published_side_files(pub.live_prefix, pub.live_manifest_key) if p != f"{SEGMENTS_DIRNAME}/")
+        t0 = time.time()
+        copied = copy_prefix(
+            s3_client(), S3_BUCKET, pub.live_prefix, pub.target_prefix,
+            exclude=rewritten, chunk_size=S3_MULTIPART_CHUNK_MB * MB, workers=S3_WORKERS,
+        )
+        print(f"Copied {copied} objects of the live store -> s3://{S3_BUCKET}/{pub.target_prefix} ({time.time() - t0:.1f}s)")
+
+    synced = s3_sync_dir(S3_BUCKET, pub.target_prefix + seg_prefix, local_dir)
+    size = sum(os.path.getsize(os.path.join(local_dir, f)) for f in os.listdir(local_dir))
+    print(f"Uploaded {len(synced.uploads)} objects ({size} bytes) to s3://{S3_BUCKET}/{pub.target_prefix}{seg_prefix}")
+
+    entry = {
+        "id": seg_id,
+        "seq": seq,
+        "prefix": seg_prefix,
+        "created_at": created_at,
+        "tombstones": tombstones,
+        "vectors": vectors,
+        "bytes": size,
+    }
+    new_manifest = build_manifest(
+        manifest,
+        current_files,
+        hnsw=manifest.get("hnsw") if isinstance(manifest.get("hnsw"), dict) else {},
+        parent_store=parent_store,
+        segments=segments + [entry],
+        pub=pub,
+    )
+    if manifest.get("base_seq"):
+        new_manifest["base_seq"] = manifest["base_seq"]
+    new_manifest["files"] = with_chunk_counts(current_files, previous_files, doc_table, changed + added)
+    chunk_counts = [m.get("chunks") for m in new_manifest["files"].values()]
+    base_stats = manifest.get("stats") if isinstance(manifest.get("stats"), dict) else {}
+    new_manifest["stats"] = index_stats(
+        manifest,
+        vectors=sum(chunk_counts) if all(isinstance(c, int) for c in chunk_counts) else None,
+        dim=doc_table.dim(),
+        base_bytes=int(base_stats.get("base_bytes") or 0),
+        segment_bytes=sum(int(s.get("bytes") or 0) for s in segments + [entry]),
+        started=started,
+    )
+    write_manifest(manifest, new_manifest, pub)
+    print(f"Wrote manifest: s3://{S3_BUCKET}/{pub.target_manifest_key} (segments={len(segments) + 1})")
+
+    for k in current_files:
+        suggest.ensure(k, k.split("/")[-1])
+    s3_put_json(S3_BUCKET, suggest_key(pub.target_prefix), suggest.to_json())
+    print(f"Wrote suggest data: s3://{S3_BUCKET}/{suggest_key(pub.target_prefix)} ({len(suggest.docs)} runbooks)")
+
+    # The graph spans all runbooks: base table + pending segments (in order) + this one
+    full_table = load_remote_document_table(pub.target_prefix)
+    for seg in segments + [entry]:
+        for k in seg.get("tombstones") or []:
+            full_table.remove(str(k))
+        seg_table = doc_table if seg is entry else load_remote_document_table(pub.target_prefix + seg["prefix"])
+        full_table.update(seg_table)
+    write_related_graph(full_table, pub.target_prefix)
+
+    if pub.versioned:
+        publish_version(pub)
+
+    shutil.rmtree(local_dir, ignore_errors=True)
+    print(f"Done. Embedded chunks: {vectors} across {total_batches} embedding batch calls")
 
 
 # ---------------------------
@@ -394,41 +1218,64 @@ def main():
     ap.add_argument("--dry-run", action="store_true", help="Print actions only; do not modify Chroma or S3")
     ap.add_argument("--rebuild", action="store_true", help="Ignore existing Chroma store; rebuild local store from scratch")
     ap.add_argument("--max-pdfs", type=int, default=0, help="Limit number of PDFs processed (0 = no limit)")
+    ap.add_argument("--delta", action="store_true", help="Publish changes as an append-only delta segment")
+    ap.add_argument("--compact", action="store_true", help="Fold all delta segments into the base store")
+    ap.add_argument(
+        "--rollback", nargs="?", const="previous", metavar="VERSION",
+        help="Point current.json at VERSION (default: the version the live one replaced) and exit",
+    )
     args = ap.parse_args()
+    started = time.time()
 
     if not S3_BUCKET:
         raise SystemExit("S3_BUCKET env var is required")
+    if PUBLISH_MODE not in ("versioned", "inplace"):
+        raise SystemExit("PUBLISH_MODE must be one of versioned, inplace")
+    if args.rollback:
+        rollback(args.rollback, args.dry_run)
+        return
     if not OPENAI_API_KEY and not args.dry_run:
         raise SystemExit("OPENAI_API_KEY env var is required (or use --dry-run)")
     if not VECTORS_PREFIX:
         raise SystemExit("VECTORS_PREFIX env var is required")
+    if VECTOR_QUANT not in QUANT_KINDS + ("none",):
+        raise SystemExit(f"VECTOR_QUANT must be one of none, {', '.join(QUANT_KINDS)}")
+    if CHUNK_MODE not in ("flat", "hierarchical", "structured"):
+        raise SystemExit("CHUNK_MODE must be one of flat, hierarchical, structured")
 
     run_prefix = runbooks_prefix_full()
     vec_prefix = vectors_prefix_full()
+    pub = resolve_publish(PUBLISH_MODE == "versioned")
+    if pub.pointer is not None and not pub.versioned:
+        # An in-place write would go next to versions/, where no reader looks
+        raise SystemExit(f"PUBLISH_MODE=inplace, but s3://{S3_BUCKET}/{pointer_key(vec_prefix)} exists; use versioned")
 
     print(f"Runbooks prefix : s3://{S3_BUCKET}/{run_prefix}")
     print(f"Vectors prefix  : s3://{S3_BUCKET}/{vec_prefix}")
-    print(f"Manifest key    : s3://{S3_BUCKET}/{MANIFEST_KEY}")
+    print(f"Live store      : s3://{S3_BUCKET}/{pub.live_prefix} ({pub.pointer.version if pub.pointer else 'in place'})")
+    print(f"Publish to      : s3://{S3_BUCKET}/{pub.target_prefix}")
+    print(f"Manifest key    : s3://{S3_BUCKET}/{pub.live_manifest_key}")
     print(f"Local Chroma dir: {LOCAL_CHROMA_DIR}")
     print(f"Dry run         : {args.dry_run}")
     print(f"Rebuild         : {args.rebuild}")
+    print(f"Delta / compact : {args.delta} / {args.compact}")
     print("----")
 
     # Load manifest (previous state)
-    manifest = s3_get_json(S3_BUCKET, MANIFEST_KEY)
-    previous_files = manifest.get("files", {}) if isinstance(manifest.get("files"), dict) else {}
+    t0 = time.time()
+    manifest, previous_files = load_manifest(pub.live_manifest_key)
 
-    # Current runbooks list
-    pdf_keys = s3_list_pdfs(S3_BUCKET, run_prefix)
+    # Current runbooks + their ETag / size / last-modified, straight from the listing pages
+    listed = s3_list_pdf_objects(S3_BUCKET, run_prefix)
+    pdf_keys = sorted(listed)
     if args.max_pdfs and args.max_pdfs > 0:
         pdf_keys = pdf_keys[: args.max_pdfs]
 
     if not pdf_keys:
         raise SystemExit(f"No PDFs found under s3://{S3_BUCKET}/{run_prefix}")
 
-    # Build current metadata state (HEAD calls)
-    print(f"Listing {len(pdf_keys)} PDFs and fetching HEAD metadata...")
-    current_files = build_current_state(S3_BUCKET, pdf_keys)
+    current_files = build_current_state(S3_BUCKET, pdf_keys, listed)
+    print(f"Listed {len(pdf_keys)} PDFs against {len(previous_files)} in the manifest ({time.time() - t0:.1f}s)")
 
     added, changed, removed = compute_diff(previous_files, current_files)
 
@@ -452,11 +1299,45 @@ def main():
         if len(removed) > 20:
             print(f"    ... +{len(removed)-20} more")
 
+    segments = manifest_segments(manifest)
+    if segments:
+        print(f"Pending delta segments: {len(segments)}")
+
+    # Vectors of different sizes cannot share a collection
+    built_dims = int(manifest.get("embed_dimensions") or 0) if previous_files else EMBED_DIMENSIONS
+    if built_dims != EMBED_DIMENSIONS and not args.rebuild:
+        raise SystemExit(
+            f"EMBED_DIMENSIONS={EMBED_DIMENSIONS or 'default'} but the store was built with "
+            f"{built_dims or 'default'}; run with --rebuild"
+        )
+
+    # An incremental build would only put new/changed chunks in the side store
+    if CHUNK_TEXT_STORE == "external" and previous_files and not isinstance(manifest.get("chunk_text"), dict) and not args.rebuild:
+        raise SystemExit("CHUNK_TEXT_STORE=external but the store keeps its chunk texts inline; run with --rebuild")
+
+    # A changed VECTOR_QUANT re-exports the quantized vectors even without runbook changes
+    prev_quant = (manifest.get("quantization") or {}).get("kind") if isinstance(manifest.get("quantization"), dict) else None
+    quant_changed = (prev_quant or "none") != VECTOR_QUANT
+    if quant_changed:
+        print(f"VECTOR_QUANT: {prev_quant or 'none'} -> {VECTOR_QUANT}")
+
     # If nothing changed, exit early (still can validate store exists)
-    if not (added or changed or removed):
+    if not (added or changed or removed) and not (args.compact and segments) and not quant_changed:
         print("No changes detected. Nothing to index.")
         return
 
+    # Embedding scheduler (unless dry-run)
+    embedder = new_embedder() if not args.dry_run else None
+
+    use_delta = args.delta and not args.rebuild and not args.compact and not quant_changed
+    if use_delta and len(segments) >= DELTA_COMPACT_AFTER:
+        print(f"{len(segments)} segments pending (DELTA_COMPACT_AFTER={DELTA_COMPACT_AFTER}): compacting instead of a new delta.")
+        use_delta = False
+
+    if use_delta:
+        publish_delta(manifest, previous_files, current_files, added, changed, removed, embedder, args.dry_run, started, pub)
+        return
+
     # Prepare local chroma store
     if args.rebuild:
         if os.path.isdir(LOCAL_CHROMA_DIR):
@@ -464,22 +1345,52 @@ def main():
         os.makedirs(LOCAL_CHROMA_DIR, exist_ok=True)
         print("Rebuild requested: local Chroma store cleared.")
     else:
-        # Download existing store from S3 if present
+        # Download existing store from S3 if present (base only; delta segments are folded below)
         if args.dry_run:
-            print(f"DRY-RUN: would download existing Chroma store from s3://{S3_BUCKET}/{vec_prefix} -> {LOCAL_CHROMA_DIR}")
+            print(f"DRY-RUN: would download existing Chroma store from s3://{S3_BUCKET}/{pub.live_prefix} -> {LOCAL_CHROMA_DIR}")
         else:
-            downloaded = s3_download_prefix(S3_BUCKET, vec_prefix, LOCAL_CHROMA_DIR)
+            downloaded = s3_download_prefix(
+                S3_BUCKET, pub.live_prefix, LOCAL_CHROMA_DIR,
+                exclude=(f"{SEGMENTS_DIRNAME}/", f"{FILES_DIRNAME}/", f"{VERSIONS_DIRNAME}/"),
+            )
             print(f"Downloaded {downloaded} objects from existing Chroma store (0 means new store).")
 
     # Open chroma
-    _, collection = open_chroma(LOCAL_CHROMA_DIR)
+    hnsw_params = resolve_hnsw_params(manifest)
+    _, collection = open_chroma(LOCAL_CHROMA_DIR, hnsw_params)
+
+    # Parent side table (hierarchical mode only); lives inside the local Chroma dir
+    parent_store: Optional[ParentStore] = None
+    if CHUNK_MODE == "hierarchical":
+        parent_store = ParentStore(LOCAL_CHROMA_DIR).load()
+        print(f"Hierarchical chunks: parents={PARENT_CHUNK_SIZE} children={CHILD_CHUNK_SIZE}/{CHILD_CHUNK_OVERLAP}")
+
+    # Per-runbook centroid table (coarse routing); lives inside the local Chroma dir
+    doc_table = DocumentTable(LOCAL_CHROMA_DIR, key_field="s3_key").load()
+
+    # Chunk texts (external mode); an existing side store is kept up to date in either mode
+    text_store = ChunkTextStore(LOCAL_CHROMA_DIR, resolve_codec(CHUNK_TEXT_CODEC)).load()
+    index_text_store = text_store if CHUNK_TEXT_STORE == "external" else None
+
+    # Titles + headings for /runbooks/suggest (a rebuild re-extracts everything)
+    suggest = SuggestTable({} if args.rebuild or args.dry_run else s3_get_json(S3_BUCKET, suggest_key(pub.live_prefix)))
 
-    # OpenAI client (unless dry-run)
-    openai_client = OpenAI(api_key=OPENAI_API_KEY) if not args.dry_run else None
+    # Fold pending delta segments into the base first (a rebuild re-indexes everything anyway)
+    if segments and not args.rebuild:
+        if args.dry_run:
+            print(f"DRY-RUN: would fold {len(segments)} delta segments into the base store")
+        else:
+            folded = fold_segments(collection, parent_store, doc_table, segments, pub.live_prefix, text_store=index_text_store)
+            print(f"Folded {len(segments)} delta segments ({folded} vectors) into the base store")
 
     # Apply removals
     for k in removed:
         chroma_delete_pdf(collection, k, args.dry_run)
+        doc_table.remove(k)
+        text_store.remove_source(k)
+        suggest.remove(k)
+        if parent_store is not None:
+            parent_store.remove_source(k)
 
     # Apply changes + additions
     to_process = changed + added
@@ -489,42 +1400,113 @@ def main():
     for k in to_process:
         # delete old chunks first (safe for both added/changed)
         chroma_delete_pdf(collection, k, args.dry_run)
+        doc_table.remove(k)
+        text_store.remove_source(k)
+        if parent_store is not None:
+            parent_store.remove_source(k)
 
-        chunks_added, batches = (0, 0)
-        if not args.dry_run:
-            assert openai_client is not None
-            chunks_added, batches = chroma_index_pdf(collection, openai_client, S3_BUCKET, k, args.dry_run)
-
-        total_chunks += chunks_added
-        total_batches += batches
-        print(f"Indexed: {k}  chunks={chunks_added}  embed_batches={batches}")
+    if args.dry_run:
+        for k in to_process:
+            print(f"DRY-RUN: would download + extract + chunk + embed + add to Chroma for: {k}")
+    elif to_process:
+        assert embedder is not None
+        total_chunks, total_batches = index_pdfs(
+            collection,
+            embedder,
+            to_process,
+            parent_store=parent_store,
+            doc_table=doc_table,
+            suggest=suggest,
+            text_store=index_text_store,
+        )
 
     # Save updated manifest
-    new_manifest = {
-        "schema": 1,
-        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-        "bucket": S3_BUCKET,
-        "runbooks_prefix": run_prefix,
-        "vectors_prefix": vec_prefix,
-        "collection": CHROMA_COLLECTION,
-        "embed_model": EMBED_MODEL,
-        "chunk_size": CHUNK_SIZE,
-        "chunk_overlap": CHUNK_OVERLAP,
-        "files": current_files,  # only current PDFs
-    }
+    new_manifest = build_manifest(
+        manifest,
+        current_files,
+        hnsw={k.replace("hnsw:", ""): v for k, v in (collection.metadata or {}).items() if k.startswith("hnsw:")},
+        parent_store=parent_store,
+        segments=[],
+        pub=pub,
+    )
 
     # Upload store + manifest
     if args.dry_run:
-        print(f"DRY-RUN: would upload local Chroma store -> s3://{S3_BUCKET}/{vec_prefix}")
-        print(f"DRY-RUN: would write manifest -> s3://{S3_BUCKET}/{MANIFEST_KEY}")
+        print(f"DRY-RUN: would upload local Chroma store -> s3://{S3_BUCKET}/{pub.target_prefix}")
+        print(f"DRY-RUN: would write manifest -> s3://{S3_BUCKET}/{pub.target_manifest_key}")
+        if pub.versioned:
+            print(f"DRY-RUN: would point s3://{S3_BUCKET}/{pointer_key(vec_prefix)} at {pub.version}")
     else:
-        # Upload store
-        uploaded = s3_upload_dir(S3_BUCKET, vec_prefix, LOCAL_CHROMA_DIR)
-        print(f"Uploaded {uploaded} objects to s3://{S3_BUCKET}/{vec_prefix}")
+        if parent_store is not None:
+            parent_store.save()
+            print(f"Parent sections stored: {len(parent_store.parents)}")
+
+        if index_text_store is not None or text_store.frames:
+            text_bytes = text_store.save()
+            new_manifest["chunk_text"] = {"mode": CHUNK_TEXT_STORE, "codec": text_store.codec, "bytes": text_bytes}
+            print(f"Chunk text store: {len(text_store.frames)} chunks, {text_bytes} bytes ({text_store.codec})")
+
+        new_manifest.pop("quantization", None)
+        if VECTOR_QUANT in QUANT_KINDS:
+            quant = export_quantized(collection, LOCAL_CHROMA_DIR, VECTOR_QUANT)
+            if quant:
+                new_manifest["quantization"] = quant
+                print(f"Quantized vectors: {quant['vectors']} x {quant['dim']} {VECTOR_QUANT} = {quant['bytes']} bytes "
+                      f"(float32 {quant['float_bytes']})")
+        else:
+            remove_quantized(LOCAL_CHROMA_DIR)
+
+        filled = backfill_centroids(collection, doc_table, sorted(current_files.keys()))
+        doc_table.save()
+        print(f"Document table: {len(doc_table.docs)} runbooks ({filled} centroids backfilled)")
+
+        new_manifest["files"] = with_chunk_counts(current_files, previous_files, doc_table, to_process)
+        new_manifest["stats"] = index_stats(
+            manifest,
+            vectors=collection.count(),
+            dim=doc_table.dim(),
+            base_bytes=dir_size_bytes(LOCAL_CHROMA_DIR),
+            segment_bytes=0,
+            started=started,
+        )
+
+        # Upload what changed (a new version copies the rest from the live one); keys an
+        # in-place store no longer has are removed once the manifest is live
+        keep = published_side_files(pub.target_prefix, pub.target_manifest_key)
+        if text_store.previous_object and not pub.versioned:
+            # Warm API containers still range-read the chunk text data file of the index they loaded
+            keep += (text_store.previous_object,)
+        synced = s3_sync_dir(
+            S3_BUCKET, pub.target_prefix, LOCAL_CHROMA_DIR,
+            keep=keep,
+            base_prefix=pub.live_prefix if pub.versioned else None,
+        )
+        if prev_quant and "quantization" not in new_manifest and not pub.versioned:
+            # The API loads vectors.q.* whenever they exist, so stale ones must go
+            stale_quant = [f"{vec_prefix}{QUANT_FILENAME}", f"{vec_prefix}{QUANT_INDEX_FILENAME}"]
+            print(f"Deleted {s3_delete_keys(S3_BUCKET, stale_quant)} stale quantized vector objects")
 
         # Write manifest
-        s3_put_json(S3_BUCKET, MANIFEST_KEY, new_manifest)
-        print(f"Wrote manifest: s3://{S3_BUCKET}/{MANIFEST_KEY}")
+        write_manifest(manifest, new_manifest, pub)
+        print(f"Wrote manifest: s3://{S3_BUCKET}/{pub.target_manifest_key}")
+
+        for k in current_files:
+            suggest.ensure(k, k.split("/")[-1])
+        s3_put_json(S3_BUCKET, suggest_key(pub.target_prefix), suggest.to_json())
+        print(f"Wrote suggest data: s3://{S3_BUCKET}/{suggest_key(pub.target_prefix)} ({len(suggest.docs)} runbooks)")
+
+        write_related_graph(doc_table, pub.target_prefix)
+
+        if pub.versioned:
+            publish_version(pub)
+
+        if synced.orphans:
+            print(f"Deleted {delete_orphans(s3_client(), S3_BUCKET, synced)} orphaned store objects")
+
+        # Segments are no longer referenced by the manifest; remove them only now (a new version has none)
+        if segments and not pub.versioned:
+            stale = s3_list_keys(S3_BUCKET, f"{vec_prefix}{SEGMENTS_DIRNAME}/")
+            print(f"Deleted {s3_delete_keys(S3_BUCKET, stale)} delta segment objects")
 
     try:
         print(f"Collection count now: {collection.count()}")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Offline A/B report for /runbooks/ask experiments.
+
+Reads the structured "EXPERIMENT {...}" lines the agent API logs per request
+(see services/agent_api/features/rag/experiments.py) and compares variants:
+request count, latency p50/p95 (total / retrieve / answer), mean input/output
+tokens, mean best and mean retrieval distance. Every variant is compared
+against the first variant seen for that experiment (or --control).
+
+Sources:
+  python scripts/experiment_report.py lambda-logs.txt [more.txt ...]     # exported logs
+  aws logs tail /aws/lambda/<fn> --since 24h | python scripts/experiment_report.py -
+  python scripts/experiment_report.py --log-group /aws/lambda/<fn> --since-hours 24
+
+Options:
+  --experiment NAME   only this experiment
+  --control NAME      baseline variant name (default: "control" if present, else first seen)
+  --json              print the table as JSON
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+LOG_PREFIX = "EXPERIMENT "
+
+
+# ---------------------------
+# Log sources
+# ---------------------------
+def lines_from_files(paths: List[str]) -> Iterator[str]:
+    for p in paths:
+        f = sys.stdin if p == "-" else open(p, "r", encoding="utf-8", errors="replace")
+        try:
+            for line in f:
+                yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def lines_from_cloudwatch(log_group: str, since_hours: float) -> Iterator[str]:
+    import boto3
+
+    logs = boto3.client("logs")
+    kwargs: Dict[str, Any] = {
+        "logGroupName": log_group,
+        "startTime": int((time.time() - since_hours * 3600) * 1000),
+        "filterPattern": '"EXPERIMENT"',
+    }
+    while True:
+        resp = logs.filter_log_events(**kwargs)
+        for ev in resp.get("events", []) or []:
+            yield ev.get("message") or ""
+        token = resp.get("nextToken")
+        if not token:
+            break
+        kwargs["nextToken"] = token
+
+
+def parse_records(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for line in lines:
+        i = line.find(LOG_PREFIX)
+        if i < 0:
+            continue
+        try:
+            rec = json.loads(line[i + len(LOG_PREFIX) :].strip())
+        except ValueError:
+            continue
+        if isinstance(rec, dict) and isinstance(rec.get("variants"), dict):
+            yield rec
+
+
+# ---------------------------
+# Aggregation
+# ---------------------------
+def _pct(values: List[float], q: float) -> Optional[float]:
+    return round(float(np.percentile(values, q)), 1) if values else None
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return round(float(np.mean(values)), 4) if values else None
+
+
+def summarize(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """{experiment: {variant: stats}}"""
+    buckets: Dict[str, Dict[str, List[Dict[str, Any]]]] = defaultdict(lambda: defaultdict(list))
+    for rec in records:
+        for exp, variant in rec["variants"].items():
+            buckets[exp][variant].append(rec)
+
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for exp, variants in buckets.items():
+        out[exp] = {}
+        for variant, recs in variants.items():
+            def col(name: str) -> List[float]:
+                return [float(r[name]) for r in recs if isinstance(r.get(name), (int, float))]
+
+            dists = [[float(d) for d in (r.get("distances") or []) if d is not None] for r in recs]
+            out[exp][variant] = {
+                "n": len(recs),
+                "total_p50_ms": _pct(col("total_ms"), 50),
+                "total_p95_ms": _pct(col("total_ms"), 95),
+                "retrieve_p50_ms": _pct(col("retrieve_ms"), 50),
+                "answer_p50_ms": _pct(col("answer_ms"), 50),
+                "input_tokens": _mean(col("input_tokens")),
+                "output_tokens": _mean(col("output_tokens")),
+                "best_distance": _mean([d[0] for d in dists if d]),
+                "mean_distance": _mean([float(np.mean(d)) for d in dists if d]),
+            }
+    return out
+
+
+def _delta(value: Any, base: Any) -> str:
+    if not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or not base:
+        return ""
+    return f" ({(value - base) / base * 100:+.1f}%)"
+
+
+def print_table(summary: Dict[str, Dict[str, Dict[str, Any]]], control: Optional[str]) -> None:
+    metrics = [
+        "total_p50_ms",
+        "total_p95_ms",
+        "retrieve_p50_ms",
+        "answer_p50_ms",
+        "input_tokens",
+        "output_tokens",
+        "best_distance",
+        "mean_distance",
+    ]
+    for exp, variants in sorted(summary.items()):
+        names = list(variants.keys())
+        base_name = control if control in variants else ("control" if "control" in variants else names[0])
+        base = variants[base_name]
+        print(f"== {exp} (baseline: {base_name})")
+        for name in [base_name] + [n for n in names if n != base_name]:
+            st = variants[name]
+            print(f"  {name:<20} n={st['n']}")
+            for m in metrics:
+                delta = "" if name == base_name else _delta(st[m], base[m])
+                print(f"    {m:<16} {st[m]}{delta}")
+        print()
+
+
+# ---------------------------
+# Main
+# ---------------------------
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("files", nargs="*", help="Log files ('-' = stdin)")
+    ap.add_argument("--log-group", help="Read from CloudWatch Logs instead of files")
+    ap.add_argument("--since-hours", type=float, default=24.0)
+    ap.add_argument("--experiment", help="Only report this experiment")
+    ap.add_argument("--control", help="Baseline variant name")
+    ap.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    args = ap.parse_args()
+
+    if args.log_group:
+        lines = lines_from_cloudwatch(args.log_group, args.since_hours)
+    elif args.files:
+        lines = lines_from_files(args.files)
+    else:
+        raise SystemExit("Pass log files, '-' for stdin, or --log-group")
+
+    records = list(parse_records(lines))
+    if args.experiment:
+        records = [r for r in records if args.experiment in r["variants"]]
+    if not records:
+        raise SystemExit("No EXPERIMENT records found")
+
+    summary = summarize(records)
+    if args.experiment:
+        summary = {args.experiment: summary.get(args.experiment, {})}
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"Records: {len(records)}")
+        print()
+        print_table(summary, args.control)
+
+
+if __name__ == "__main__":
+    main()
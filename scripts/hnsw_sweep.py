@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+HNSW recall-vs-latency sweep for a runbook Chroma store.
+
+What it does:
+1) Reads every vector from a local Chroma collection (e.g. the store built by build_chroma.py)
+2) Builds a fixed query set:
+     --queries FILE   one question per line, embedded with --embed-model (needs OPENAI_API_KEY)
+     otherwise        --sample N stored vectors, held out of the index (fixed --seed)
+3) Computes exact top-k neighbours with NumPy (ground truth, same distance space as the collection)
+4) For every (M, construction_ef) builds an HNSW index (hnswlib, as used by Chroma),
+   then for every search_ef measures recall@k and single-query latency p50/p95/p99
+5) Picks the fastest (p95) config that reaches --target-recall (or the best recall if none does)
+6) Writes it to the manifest as "hnsw_recommended" (+ the full table as "hnsw_sweep")
+
+build_chroma.py uses "hnsw_recommended" for new collections (M/construction_ef) and the API
+applies its search_ef when it loads the store.
+
+Examples:
+  python scripts/hnsw_sweep.py --persist-dir chroma_store --collection runbooks_dev \\
+    --manifest-file chroma_store/manifest.json
+
+  # write straight to the published manifest (same env vars as build_chroma.py)
+  python scripts/hnsw_sweep.py --persist-dir chroma_store --collection runbooks_dev --s3-manifest
+
+  # custom sweep grid / query set
+  python scripts/hnsw_sweep.py --persist-dir chroma_store --collection runbooks_dev \\
+    --queries questions.txt --k 5 --M 8,16,32 --construction-ef 64,128,256 --search-ef 16,32,64,128
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# --- sqlite shim (only needed in Lambda; safe locally) ---
+try:
+    import pysqlite3  # type: ignore
+    sys.modules["sqlite3"] = pysqlite3
+except Exception:
+    pass
+
+import chromadb
+import hnswlib  # ships with chromadb (chroma-hnswlib)
+from chromadb.config import Settings
+
+
+def parse_int_list(raw: str) -> List[int]:
+    return [int(x) for x in raw.split(",") if x.strip()]
+
+
+# ---------------------------
+# Data loading
+# ---------------------------
+def load_vectors(persist_dir: str, collection: str, page: int = 5000) -> Tuple[np.ndarray, str]:
+    client = chromadb.PersistentClient(path=persist_dir, settings=Settings(anonymized_telemetry=False))
+    col = client.get_collection(collection)
+    space = str((col.metadata or {}).get("hnsw:space", "l2"))
+
+    total = col.count()
+    rows: List[Any] = []
+    for offset in range(0, total, page):
+        got = col.get(include=["embeddings"], limit=page, offset=offset)
+        emb = got.get("embeddings")
+        if emb is not None and len(emb):
+            rows.append(np.asarray(emb, dtype=np.float32))
+    if not rows:
+        raise SystemExit(f"Collection {collection} in {persist_dir} has no vectors")
+    return np.concatenate(rows, axis=0), space
+
+
+def embed_queries(path: str, model: str) -> np.ndarray:
+    from openai import OpenAI
+
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [ln.strip() for ln in f if ln.strip()]
+    if not questions:
+        raise SystemExit(f"No questions in {path}")
+    client = OpenAI()
+    out: List[List[float]] = []
+    for i in range(0, len(questions), 64):
+        resp = client.embeddings.create(model=model, input=questions[i : i + 64])
+        out.extend(d.embedding for d in resp.data)
+    return np.asarray(out, dtype=np.float32)
+
+
+# ---------------------------
+# Exact search (ground truth)
+# ---------------------------
+def exact_topk(data: np.ndarray, queries: np.ndarray, k: int, space: str) -> np.ndarray:
+    if space == "cosine":
+        d = data / np.maximum(np.linalg.norm(data, axis=1, keepdims=True), 1e-12)
+        q = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = -(q @ d.T)
+    elif space == "ip":
+        scores = -(queries @ data.T)
+    else:  # l2 (squared), Chroma default
+        scores = (
+            np.sum(queries**2, axis=1, keepdims=True)
+            - 2.0 * (queries @ data.T)
+            + np.sum(data**2, axis=1)[None, :]
+        )
+    idx = np.argpartition(scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, idx, axis=1).argsort(axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+# ---------------------------
+# Sweep
+# ---------------------------
+def run_sweep(
+    data: np.ndarray,
+    queries: np.ndarray,
+    truth: np.ndarray,
+    space: str,
+    k: int,
+    m_values: List[int],
+    cef_values: List[int],
+    sef_values: List[int],
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    labels = np.arange(data.shape[0])
+
+    for m in m_values:
+        for cef in cef_values:
+            index = hnswlib.Index(space=space, dim=data.shape[1])
+            t0 = time.perf_counter()
+            index.init_index(max_elements=data.shape[0], ef_construction=cef, M=m)
+            index.add_items(data, labels)
+            build_sec = time.perf_counter() - t0
+            index.set_num_threads(1)  # single-query latency, like one API request
+
+            for sef in sef_values:
+                index.set_ef(max(sef, k))
+                lat_ms: List[float] = []
+                hits = 0
+                for qi in range(queries.shape[0]):
+                    t1 = time.perf_counter()
+                    found, _ = index.knn_query(queries[qi : qi + 1], k=k)
+                    lat_ms.append((time.perf_counter() - t1) * 1000.0)
+                    hits += len(set(found[0].tolist()) & set(truth[qi].tolist()))
+
+                row = {
+                    "M": m,
+                    "construction_ef": cef,
+                    "search_ef": sef,
+                    "recall_at_k": round(hits / float(k * queries.shape[0]), 4),
+                    "p50_ms": round(float(np.percentile(lat_ms, 50)), 4),
+                    "p95_ms": round(float(np.percentile(lat_ms, 95)), 4),
+                    "p99_ms": round(float(np.percentile(lat_ms, 99)), 4),
+                    "build_sec": round(build_sec, 3),
+                }
+                results.append(row)
+                print(
+                    f"M={m:<3} cef={cef:<4} sef={sef:<4} recall@{k}={row['recall_at_k']:.4f} "
+                    f"p50={row['p50_ms']:.3f}ms p95={row['p95_ms']:.3f}ms p99={row['p99_ms']:.3f}ms "
+                    f"build={row['build_sec']:.2f}s"
+                )
+    return results
+
+
+def recommend(results: List[Dict[str, Any]], target_recall: float) -> Dict[str, Any]:
+    ok = [r for r in results if r["recall_at_k"] >= target_recall]
+    if ok:
+        # Fastest tail latency first; then the cheaper build (smaller M / construction_ef)
+        return min(ok, key=lambda r: (r["p95_ms"], r["M"], r["construction_ef"], r["search_ef"]))
+    return max(results, key=lambda r: (r["recall_at_k"], -r["p95_ms"]))
+
+
+# ---------------------------
+# Manifest
+# ---------------------------
+def write_manifest(args, recommended: Dict[str, Any], sweep: Dict[str, Any]) -> None:
+    if args.manifest_file:
+        manifest: Dict[str, Any] = {}
+        if os.path.isfile(args.manifest_file):
+            with open(args.manifest_file, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        manifest["hnsw_recommended"] = recommended
+        manifest["hnsw_sweep"] = sweep
+        with open(args.manifest_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Wrote recommendation -> {args.manifest_file}")
+
+    if args.s3_manifest:
+        # Same env-driven manifest location as build_chroma.py: the live version's manifest
+        # (annotated in place; the next build carries the recommendation into its version)
+        from build_chroma import S3_BUCKET, resolve_publish, s3_get_json, s3_put_json
+
+        if not S3_BUCKET:
+            raise SystemExit("S3_BUCKET env var is required for --s3-manifest")
+        manifest_key = resolve_publish(versioned=False).live_manifest_key
+        manifest = s3_get_json(S3_BUCKET, manifest_key)
+        manifest["hnsw_recommended"] = recommended
+        manifest["hnsw_sweep"] = sweep
+        s3_put_json(S3_BUCKET, manifest_key, manifest)
+        print(f"Wrote recommendation -> s3://{S3_BUCKET}/{manifest_key}")
+
+
+# ---------------------------
+# Main
+# ---------------------------
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--persist-dir", default=os.environ.get("LOCAL_CHROMA_DIR", "./chroma_store"))
+    ap.add_argument("--collection", default=os.environ.get("CHROMA_COLLECTION", "runbooks_dev"))
+    ap.add_argument("--queries", help="Text file, one question per line (embedded with --embed-model)")
+    ap.add_argument("--embed-model", default=os.environ.get("EMBED_MODEL", "text-embedding-3-small"))
+    ap.add_argument("--sample", type=int, default=200, help="Held-out stored vectors used as queries (no --queries)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--M", default="8,16,32")
+    ap.add_argument("--construction-ef", default="64,100,200")
+    ap.add_argument("--search-ef", default="10,20,40,80,160")
+    ap.add_argument("--target-recall", type=float, default=0.95)
+    ap.add_argument("--manifest-file", help="Local manifest.json to update")
+    ap.add_argument("--s3-manifest", action="store_true", help="Update the live manifest (current.json's version, else MANIFEST_KEY) in S3_BUCKET")
+    args = ap.parse_args()
+
+    data, space = load_vectors(args.persist_dir, args.collection)
+    print(f"Loaded {data.shape[0]} vectors dim={data.shape[1]} space={space} from {args.persist_dir}")
+
+    if args.queries:
+        queries = embed_queries(args.queries, args.embed_model)
+        source = f"file:{os.path.basename(args.queries)}"
+    else:
+        # Hold the sampled vectors out of the index so a query never finds itself
+        rng = np.random.default_rng(args.seed)
+        n = min(args.sample, max(1, data.shape[0] // 5))
+        picked = rng.choice(data.shape[0], size=n, replace=False)
+        mask = np.ones(data.shape[0], dtype=bool)
+        mask[picked] = False
+        queries, data = data[picked], data[mask]
+        source = f"sample:{n}:seed={args.seed}"
+
+    k = max(1, min(args.k, data.shape[0]))
+    truth = exact_topk(data, queries, k, space)
+    print(f"Queries: {queries.shape[0]} ({source}); exact top-{k} computed")
+    print("----")
+
+    results = run_sweep(
+        data,
+        queries,
+        truth,
+        space,
+        k,
+        parse_int_list(args.M),
+        parse_int_list(args.construction_ef),
+        parse_int_list(args.search_ef),
+    )
+    best = recommend(results, args.target_recall)
+
+    measured_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    recommended = {**best, "k": k, "target_recall": args.target_recall, "measured_at": measured_at}
+    sweep = {
+        "measured_at": measured_at,
+        "collection": args.collection,
+        "vectors": int(data.shape[0]),
+        "dim": int(data.shape[1]),
+        "space": space,
+        "queries": source,
+        "k": k,
+        "results": results,
+    }
+
+    print("----")
+    print(f"Recommended: {json.dumps(recommended)}")
+    if best["recall_at_k"] < args.target_recall:
+        print(f"WARN: no config reached recall@{k} >= {args.target_recall}; picked the highest recall")
+
+    write_manifest(args, recommended, sweep)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Recall / size / scan-time trade-off of reduced dimensions and quantized vectors.
+
+What it does:
+1) Reads every vector from a local Chroma collection (same loader as hnsw_sweep.py)
+2) Builds a fixed query set (--queries FILE embedded with --embed-model, or --sample held-out vectors)
+3) Ground truth: exact top-k over the full-precision, full-dimension vectors
+4) For every --dims (reduced the way the embeddings API does it: leading dims, re-normalized)
+   and every storage kind:
+     float32   exact scan at that size
+     int8      per-dimension scaled codes, then re-score k * oversample candidates in float32
+     binary    sign bits (scored against the float query), then re-score k * oversample candidates
+   measures recall@k against the ground truth, bytes per vector and single-query scan p50/p95
+5) Prints the table (and writes it to --manifest-file as "quant_benchmark" if given)
+
+A reduced dimension changes the embeddings themselves, so the store must be rebuilt with
+EMBED_DIMENSIONS to use it; VECTOR_QUANT only adds vectors.q.npy next to the store.
+
+Examples:
+  python scripts/quant_benchmark.py --persist-dir chroma_store --collection runbooks_dev
+  python scripts/quant_benchmark.py --persist-dir chroma_store --collection runbooks_dev \\
+    --dims 0,512,256 --oversample 1,4,10 --k 5 --manifest-file chroma_store/manifest.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from hnsw_sweep import embed_queries, exact_topk, load_vectors, parse_int_list
+from rag_quant import quantize_binary, quantize_int8, reduce_dims
+
+_SIGNS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float32) * 2.0 - 1.0
+
+
+def first_pass(kind: str, store: Any, scale: Any, q: np.ndarray) -> np.ndarray:
+    """Scores over the stored representation; lower is closer."""
+    if kind == "binary":
+        # Same per-byte lookup table as the API (features/rag/quantized.py)
+        qp = np.zeros(store.shape[1] * 8, dtype=np.float32)
+        qp[: q.shape[0]] = q
+        lut = _SIGNS @ qp.reshape(-1, 8).T
+        return -lut[store, np.arange(store.shape[1])].sum(axis=1)
+    if kind == "int8":
+        return -(store.astype(np.float32) @ (q * scale))
+    return -(store @ q)
+
+
+def run_benchmark(
+    data: np.ndarray,
+    queries: np.ndarray,
+    truth: np.ndarray,
+    k: int,
+    dims: List[int],
+    oversamples: List[int],
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    full_dim = data.shape[1]
+
+    for dim in dims:
+        d = reduce_dims(data, dim)
+        qs = reduce_dims(queries, dim)
+        codes, scale = quantize_int8(d)
+        stores = {"float32": (d, None), "int8": (codes, scale), "binary": (quantize_binary(d), None)}
+
+        for kind, (store, sc) in stores.items():
+            for over in [1] if kind == "float32" else oversamples:
+                n = min(k * over, d.shape[0])
+                hits = 0
+                lat_ms: List[float] = []
+                for qi in range(qs.shape[0]):
+                    q = qs[qi]
+                    t0 = time.perf_counter()
+                    scores = first_pass(kind, store, sc, q)
+                    cand = np.argpartition(scores, n - 1)[:n]
+                    if kind != "float32":
+                        # Re-score the shortlist at full precision (the API reads these from Chroma)
+                        exact = -(d[cand] @ q)
+                        cand = cand[np.argsort(exact)[:k]]
+                    else:
+                        cand = cand[np.argsort(scores[cand])[:k]]
+                    lat_ms.append((time.perf_counter() - t0) * 1000.0)
+                    hits += len(set(cand.tolist()) & set(truth[qi].tolist()))
+
+                row = {
+                    "dim": d.shape[1],
+                    "kind": kind,
+                    "oversample": over,
+                    "recall_at_k": round(hits / float(k * qs.shape[0]), 4),
+                    "bytes_per_vector": int(store.nbytes // store.shape[0]),
+                    "compression": round((full_dim * 4) / float(store.nbytes // store.shape[0]), 1),
+                    "p50_ms": round(float(np.percentile(lat_ms, 50)), 4),
+                    "p95_ms": round(float(np.percentile(lat_ms, 95)), 4),
+                }
+                results.append(row)
+                print(
+                    f"dim={row['dim']:<5} {kind:<7} x{over:<3} recall@{k}={row['recall_at_k']:.4f} "
+                    f"bytes/vec={row['bytes_per_vector']:<5} ({row['compression']:>5}x) "
+                    f"p50={row['p50_ms']:.3f}ms p95={row['p95_ms']:.3f}ms"
+                )
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--persist-dir", default=os.environ.get("LOCAL_CHROMA_DIR", "./chroma_store"))
+    ap.add_argument("--collection", default=os.environ.get("CHROMA_COLLECTION", "runbooks_dev"))
+    ap.add_argument("--queries", help="Text file, one question per line (embedded with --embed-model)")
+    ap.add_argument("--embed-model", default=os.environ.get("EMBED_MODEL", "text-embedding-3-small"))
+    ap.add_argument("--sample", type=int, default=200, help="Held-out stored vectors used as queries (no --queries)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--dims", default="0,1024,512,256", help="0 = stored dimension")
+    ap.add_argument("--oversample", default="1,2,4,10", help="Shortlist = k * oversample before re-scoring")
+    ap.add_argument("--manifest-file", help="Local manifest.json to update with the results")
+    args = ap.parse_args()
+
+    data, space = load_vectors(args.persist_dir, args.collection)
+    print(f"Loaded {data.shape[0]} vectors dim={data.shape[1]} space={space} from {args.persist_dir}")
+    # Quantized scoring ranks by dot product; exact for l2/cosine only on unit vectors
+    norms = np.linalg.norm(data, axis=1)
+    if not np.allclose(norms, 1.0, atol=1e-3):
+        print(f"WARN: vectors are not unit length (norm {norms.min():.3f}..{norms.max():.3f}); dot-product ranking is approximate")
+
+    if args.queries:
+        queries = embed_queries(args.queries, args.embed_model)
+        source = f"file:{os.path.basename(args.queries)}"
+    else:
+        rng = np.random.default_rng(args.seed)
+        n = min(args.sample, max(1, data.shape[0] // 5))
+        picked = rng.choice(data.shape[0], size=n, replace=False)
+        mask = np.ones(data.shape[0], dtype=bool)
+        mask[picked] = False
+        queries, data = data[picked], data[mask]
+        source = f"sample:{n}:seed={args.seed}"
+
+    k = max(1, min(args.k, data.shape[0]))
+    truth = exact_topk(data, queries, k, space)
+    print(f"Queries: {queries.shape[0]} ({source}); exact top-{k} computed")
+    print("----")
+
+    results = run_benchmark(data, queries, truth, k, parse_int_list(args.dims), parse_int_list(args.oversample))
+
+    if args.manifest_file:
+        manifest: Dict[str, Any] = {}
+        if os.path.isfile(args.manifest_file):
+            with open(args.manifest_file, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        manifest["quant_benchmark"] = {
+            "measured_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "collection": args.collection,
+            "vectors": int(data.shape[0]),
+            "dim": int(data.shape[1]),
+            "space": space,
+            "queries": source,
+            "k": k,
+            "results": results,
+        }
+        with open(args.manifest_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Wrote results -> {args.manifest_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+"""
+Shared chunking helpers for the runbook ingestion scripts
+(build_chroma.py and rag_ingest_to_chroma.py).
+
+Two-level (parent/child) layout:
+  - A PARENT is a large section of a runbook. Its text is stored ONCE in a
+    side table (parents.json) next to the Chroma store.
+  - A CHILD is a small window inside exactly one parent. Only children are
+    embedded; each child records its parent_id in metadata.
+
+At query time the serving side groups child hits by parent_id and sends each
+parent section to the LLM once, instead of several overlapping fragments.
+
+Structured chunks (chunk_structured, CHUNK_MODE=structured):
+  - Repeated page headers / footers are dropped (strip_page_boilerplate).
+  - Text is split into heading / paragraph / code blocks and packed into
+    chunks under a token budget, keeping sections and commands whole.
+  - Each chunk records its page range and section heading for metadata.
+  - iter_structured_chunks takes a page iterator and yields chunks as they
+    close, so a large PDF is chunked one page at a time.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from rag_suggest import heading_title
+
+PARENTS_FILENAME = "parents.json"
+# Page headers / footers of a streamed document are learned from its first pages
+BOILERPLATE_SAMPLE_PAGES = 12
+
+
+@dataclass(frozen=True)
+class ChildChunk:
+    text: str
+    parent_id: str
+    parent_index: int
+    chunk_index: int  # position across the whole document
+
+
+@dataclass(frozen=True)
+class ParentChunk:
+    parent_id: str
+    parent_index: int
+    text: str
+
+
+def window_text(text: str, size: int, overlap: int) -> List[str]:
+    """Fixed-size character windows (same semantics as the flat chunkers)."""
+    text = (text or "").strip()
+    if not text:
+        return []
+    size = max(1, size)
+    step = max(1, size - max(0, overlap))
+    out: List[str] = []
+    i = 0
+    while i < len(text):
+        piece = text[i : i + size].strip()
+        if piece:
+            out.append(piece)
+        if i + size >= len(text):
+            break
+        i += step
+    return out
+
+
+def parent_id_for(source_key: str, parent_index: int) -> str:
+    raw = f"{source_key}::parent::{parent_index}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+def split_parent_child(
+    source_key: str,
+    text: str,
+    *,
+    parent_size: int,
+    child_size: int,
+    child_overlap: int,
+) -> Tuple[List[ParentChunk], List[ChildChunk]]:
+    """
+    Split text into non-overlapping parent sections, then each parent into
+    small overlapping child windows. Children never cross a parent boundary,
+    so every child maps to exactly one parent.
+    """
+    parents: List[ParentChunk] = []
+    children: List[ChildChunk] = []
+
+    for p_idx, p_text in enumerate(window_text(text, parent_size, 0)):
+        pid = parent_id_for(source_key, p_idx)
+        parents.append(ParentChunk(parent_id=pid, parent_index=p_idx, text=p_text))
+        for c_text in window_text(p_text, child_size, child_overlap):
+            children.append(
+                ChildChunk(text=c_text, parent_id=pid, parent_index=p_idx, chunk_index=len(children))
+            )
+
+    return parents, children
+
+
+# ---------------------------
+# Structure-aware chunking
+# ---------------------------
+# Pages -> boilerplate stripped -> heading / paragraph / code blocks -> chunks packed
+# under a token budget. A chunk starts at a heading once the current one is big
+# enough, so sections stay together and tiny sections are merged instead of
+# becoming tiny chunks. Paragraphs split on sentences and code blocks on lines
+# only when a single block exceeds the budget.
+
+_DIGITS = re.compile(r"\d+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# "-", "*", bullets, and the glyphs PDF extraction yields for Symbol-font bullets
+_BULLET_CHARS = "-*\u2022\u25aa\u25cf\u25e6\uf0a7\uf0b7\x7f"
+_SYMBOL_BULLET = re.compile(r"^[" + re.escape(_BULLET_CHARS) + r"](?:\s+|$)")
+_NUMBERED_ITEM = re.compile(r"^\d+[.)]\s+")
+_SHELL = (
+    "sudo", "kubectl", "aws", "az", "gcloud", "curl", "wget", "docker", "helm", "terraform",
+    "git", "systemctl", "journalctl", "psql", "mysql", "redis-cli", "ssh", "scp", "python",
+    "python3", "pip", "npm", "make", "export", "cd", "ls", "cat", "grep", "tail", "rm", "mv",
+    "cp", "chmod", "chown", "echo", "openssl", "dig", "nslookup", "ping", "traceroute",
+)
+# Shell prompts / comments, query pipelines ("| filter ..."), common CLI invocations
+_CODE_LINE = re.compile(r"^(?:\$|#|\|)\s*\S|^(?:" + "|".join(re.escape(c) for c in _SHELL) + r")\s+\S")
+
+
+@dataclass(frozen=True)
+class Block:
+    kind: str  # heading | para | code
+    text: str
+    page: int  # 1-based
+
+
+@dataclass(frozen=True)
+class StructuredChunk:
+    text: str
+    page_start: int
+    page_end: int
+    heading: str  # nearest heading above the chunk ("" before the first one)
+
+
+def estimate_tokens(text: str) -> int:
+    # Same estimate as the embedding scheduler (rag_embed_scheduler.py)
+    return len(text or "") // 4 + 1
+
+
+def _boilerplate_key(line: str) -> str:
+    # "Page 3 of 12" and "Page 4 of 12" are the same footer
+    return _DIGITS.sub("#", " ".join(line.split()).lower())
+
+
+def _edge_lines(lines: List[str], edge_lines: int) -> List[int]:
+    idx = [i for i, l in enumerate(lines) if l.strip()]
+    return sorted(set(idx[:edge_lines] + idx[-edge_lines:]))
+
+
+def strip_page_boilerplate(pages: List[str], edge_lines: int = 2, min_share: float = 0.5) -> List[str]:
+    """
+    Drop header / footer lines: lines within the first or last edge_lines non-empty lines
+    of a page that repeat (digits ignored) at the edges of at least min_share of the pages.
+    """
+    return list(iter_strip_page_boilerplate(pages, sample=len(pages), edge_lines=edge_lines, min_share=min_share))
+
+
+def iter_strip_page_boilerplate(
+    pages: Iterable[str],
+    *,
+    sample: int = BOILERPLATE_SAMPLE_PAGES,
+    edge_lines: int = 2,
+    min_share: float = 0.5,
+) -> Iterator[str]:
+    """strip_page_boilerplate over a page stream: the repeated lines are learned from the first `sample` pages."""
+    it = iter(pages)
+    first = list(itertools.islice(it, max(1, sample)))
+    if len(first) < 3:
+        yield from first
+        yield from it
+        return
+    head = [p.splitlines() for p in first]
+    del first
+
+    counts: Counter = Counter()
+    for lines in head:
+        counts.update({_boilerplate_key(lines[i]) for i in _edge_lines(lines, edge_lines)})
+    threshold = max(2, math.ceil(min_share * len(head)))
+    repeated = {k for k, c in counts.items() if c >= threshold}
+
+    def strip(lines: List[str]) -> str:
+        drop = {i for i in _edge_lines(lines, edge_lines) if _boilerplate_key(lines[i]) in repeated}
+        return "\n".join(l for i, l in enumerate(lines) if i not in drop)
+
+    yield from (strip(lines) for lines in head)
+    yield from (strip(p.splitlines()) for p in it)
+
+
+def _is_code(line: str) -> bool:
+    if line.startswith(("    ", "\t")) and line.strip():
+        return True
+    stripped = line.strip()
+    return bool(_CODE_LINE.match(stripped)) or stripped.endswith(" \\") or stripped in ("{", "}", "]")
+
+
+def page_blocks(text: str, page: int) -> List[Block]:
+    """Headings, paragraphs (soft-wrapped lines joined, list items kept on their own line) and code blocks."""
+    blocks: List[Block] = []
+    para: List[str] = []
+    code: List[str] = []
+    fenced = False
+    in_list = False  # last paragraph line was a list item (no closing punctuation expected)
+    bullet = False   # previous line was a bare bullet glyph
+
+    def flush_para() -> None:
+        if para:
+            blocks.append(Block("para", "".join(para).strip(), page))
+            para.clear()
+
+    def flush_code() -> None:
+        if code:
+            blocks.append(Block("code", "\n".join(code).strip("\n"), page))
+            code.clear()
+
+    for raw in (text or "").splitlines():
+        line = raw.rstrip()
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            flush_para()
+            code.append(stripped)
+            if fenced:
+                flush_code()
+            fenced = not fenced
+            continue
+        continued = bool(code) and code[-1].endswith("\\")  # shell line continuation
+        if fenced or continued or _is_code(line):
+            flush_para()
+            code.append(line)
+            continue
+        flush_code()
+        if not stripped:
+            flush_para()
+            in_list = False
+            continue
+        collapsed = " ".join(stripped.split())
+        item = _SYMBOL_BULLET.match(collapsed)
+        if item:
+            collapsed = collapsed[item.end() :]
+            if not collapsed:  # glyph on its own line, the item text follows
+                bullet = True
+                continue
+        if item or bullet:
+            collapsed, bullet = f"- {collapsed}", False
+        # A heading never continues a sentence that is still open ("1. Overview" can be either)
+        closed = not para or in_list or para[-1].rstrip().endswith((".", ":", "!", "?"))
+        if closed and not collapsed.startswith("- ") and heading_title(collapsed):
+            flush_para()
+            in_list = False
+            blocks.append(Block("heading", collapsed, page))
+            continue
+        if collapsed.startswith("- ") or _NUMBERED_ITEM.match(collapsed):
+            para.append(("\n" if para else "") + collapsed)
+            in_list = True
+        else:
+            para.append((" " if para else "") + collapsed)
+    flush_para()
+    flush_code()
+    return blocks
+
+
+def _split_block(block: Block, max_tokens: int) -> List[Block]:
+    """A block over the budget: paragraphs on sentence boundaries, code on line boundaries."""
+    if estimate_tokens(block.text) <= max_tokens:
+        return [block]
+    if block.kind == "code":
+        units, sep = block.text.split("\n"), "\n"
+    else:
+        units, sep = _SENTENCE_END.split(block.text), " "
+    pieces: List[str] = []
+    cur = ""
+    for unit in units:
+        for part in window_text(unit, max_tokens * 4, 0) if estimate_tokens(unit) > max_tokens else [unit]:
+            if cur and estimate_tokens(cur + sep + part) > max_tokens:
+                pieces.append(cur)
+                cur = part
+            else:
+                cur = cur + sep + part if cur else part
+    if cur:
+        pieces.append(cur)
+    return [Block(block.kind, p, block.page) for p in pieces]
+
+
+def chunk_structured(
+    pages: List[str],
+    *,
+    max_tokens: int = 350,
+    min_tokens: int = 0,
+    strip_boilerplate: bool = True,
+) -> List[StructuredChunk]:
+    """
+    Chunk page texts along their structure. A chunk holds whole blocks up to max_tokens
+    (estimated) and is closed at a heading once it has min_tokens (default max_tokens / 2).
+    Chunks that do not start at a heading are prefixed with the section heading.
+    """
+    return list(
+        iter_structured_chunks(
+            pages,
+            max_tokens=max_tokens,
+            min_tokens=min_tokens,
+            strip_boilerplate=strip_boilerplate,
+            boilerplate_sample=len(pages),
+        )
+    )
+
+
+def iter_structured_chunks(
+    pages: Iterable[str],
+    *,
+    max_tokens: int = 350,
+    min_tokens: int = 0,
+    strip_boilerplate: bool = True,
+    boilerplate_sample: int = BOILERPLATE_SAMPLE_PAGES,
+) -> Iterator[StructuredChunk]:
+    """
+    chunk_structured over a page stream (e.g. rag_pdf_stream.iter_pdf_pages): chunks are
+    yielded as soon as they close, so only the open chunk and the current page are held.
+    Header / footer lines are learned from the first boilerplate_sample pages.
+    """
+    max_tokens = max(16, max_tokens)
+    min_tokens = min_tokens or max_tokens // 2
+    if strip_boilerplate:
+        pages = iter_strip_page_boilerplate(pages, sample=boilerplate_sample)
+    blocks = (b for i, p in enumerate(pages, start=1) for b in page_blocks(p, i))
+
+    pending: List[StructuredChunk] = []
+    cur: List[Block] = []
+    cur_tokens = 0
+    heading = ""      # latest heading seen
+    cur_heading = ""  # heading in effect where the current chunk starts
+
+    def has_body() -> bool:
+        return any(b.kind != "heading" for b in cur)
+
+    def flush() -> List[Block]:
+        # Trailing headings belong to the next chunk, not the end of this one
+        carry: List[Block] = []
+        while cur and cur[-1].kind == "heading":
+            carry.insert(0, cur.pop())
+        if cur:
+            body = "\n\n".join(b.text for b in cur)
+            section = cur_heading
+            if cur[0].kind == "heading":
+                section = cur[0].text
+            elif cur_heading:
+                body = f"{cur_heading}\n\n{body}"
+            pending.append(StructuredChunk(body, cur[0].page, cur[-1].page, section))
+        cur.clear()
+        cur.extend(carry)
+        return carry
+
+    for block in blocks:
+        if block.kind == "heading":
+            if has_body() and cur[-1].kind != "heading" and cur_tokens >= min_tokens:
+                flush()
+                cur_tokens = 0
+                yield from pending
+                pending.clear()
+            if not cur:
+                cur_heading = heading
+            heading = block.text
+            cur.append(block)
+            cur_tokens += estimate_tokens(block.text)
+            continue
+        for piece in _split_block(block, max_tokens):
+            t = estimate_tokens(piece.text)
+            if has_body() and cur_tokens + t > max_tokens:
+                carry = flush()
+                cur_heading = heading
+                cur_tokens = sum(estimate_tokens(b.text) for b in carry) or (estimate_tokens(heading) if heading else 0)
+            cur.append(piece)
+            cur_tokens += t
+        yield from pending
+        pending.clear()
+    flush()
+    yield from pending
+
+
+# ---------------------------
+# Parent side table
+# ---------------------------
+class ParentStore:
+    """
+    parents.json lives inside the persisted Chroma directory so it is uploaded
+    and downloaded together with the vectors.
+
+    Layout:
+      {"schema": 1, "parents": {parent_id: {"source", "file", "index", "text"}}}
+    """
+
+    def __init__(self, local_dir: str):
+        self.path = os.path.join(local_dir, PARENTS_FILENAME)
+        self.parents: Dict[str, Dict[str, Any]] = {}
+
+    def load(self) -> "ParentStore":
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            parents = data.get("parents") if isinstance(data, dict) else None
+            self.parents = parents if isinstance(parents, dict) else {}
+        except FileNotFoundError:
+            self.parents = {}
+        return self
+
+    def remove_source(self, source_key: str) -> int:
+        stale = [pid for pid, p in self.parents.items() if p.get("source") == source_key]
+        for pid in stale:
+            del self.parents[pid]
+        return len(stale)
+
+    def put(self, source_key: str, filename: str, parents: List[ParentChunk]) -> None:
+        for p in parents:
+            self.parents[p.parent_id] = {
+                "source": source_key,
+                "file": filename,
+                "index": p.parent_index,
+                "text": p.text,
+            }
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"schema": 1, "parents": self.parents}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,168 @@
+"""
+Per-runbook document table for coarse (IVF-style) routing.
+
+For every indexed runbook we keep one centroid embedding: the mean of its chunk
+vectors, L2-normalized. At query time the API first ranks runbooks by centroid
+similarity and then searches chunks only inside the top-M files, so query cost
+stays roughly flat as the corpus grows.
+
+Files (inside the persisted Chroma directory, uploaded with the store):
+  documents.json  {"schema": 1, "key_field": "s3_key", "dim": N,
+                   "docs": [{"key", "file", "chunks"}, ...]}
+  centroids.npy   float32 [len(docs), dim], same row order as "docs"
+
+The same centroids give the related-runbooks graph (top-k neighbours by cosine
+similarity), written by build_chroma.py next to the store as related.json:
+  {"schema": 1, "k": 5, "docs": {"<key>": {"file": "x.pdf",
+                                           "related": [{"key", "file", "score"}, ...]}}}
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DOCUMENTS_FILENAME = "documents.json"
+CENTROIDS_FILENAME = "centroids.npy"
+RELATED_FILENAME = "related.json"
+
+
+class CentroidAccumulator:
+    """Running sum of chunk vectors for one document (batches arrive one at a time)."""
+
+    def __init__(self) -> None:
+        self.total: Optional[np.ndarray] = None
+        self.count = 0
+
+    def add(self, vectors: Sequence[Sequence[float]]) -> None:
+        arr = np.asarray(vectors, dtype=np.float64)
+        if arr.size == 0:
+            return
+        s = arr.sum(axis=0)
+        self.total = s if self.total is None else self.total + s
+        self.count += arr.shape[0]
+
+    def centroid(self) -> Optional[np.ndarray]:
+        if self.total is None or self.count == 0:
+            return None
+        c = self.total / self.count
+        norm = float(np.linalg.norm(c))
+        if norm > 0:
+            c = c / norm
+        return c.astype(np.float32)
+
+
+class DocumentTable:
+    def __init__(self, local_dir: str, key_field: str = "s3_key"):
+        self.local_dir = local_dir
+        self.key_field = key_field
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.centroids: Dict[str, np.ndarray] = {}
+
+    def load(self) -> "DocumentTable":
+        meta_path = os.path.join(self.local_dir, DOCUMENTS_FILENAME)
+        vec_path = os.path.join(self.local_dir, CENTROIDS_FILENAME)
+        if not (os.path.isfile(meta_path) and os.path.isfile(vec_path)):
+            return self
+
+        with open(meta_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rows = np.load(vec_path)
+        docs = data.get("docs") if isinstance(data, dict) else None
+        if not isinstance(docs, list) or len(docs) != rows.shape[0]:
+            print(f"WARN: ignoring inconsistent document table in {self.local_dir}")
+            return self
+
+        self.key_field = data.get("key_field") or self.key_field
+        for d, row in zip(docs, rows):
+            key = d.get("key")
+            if key:
+                self.docs[key] = {"file": d.get("file"), "chunks": int(d.get("chunks") or 0)}
+                self.centroids[key] = row
+        return self
+
+    def remove(self, key: str) -> None:
+        self.docs.pop(key, None)
+        self.centroids.pop(key, None)
+
+    def put(self, key: str, filename: str, centroid: Optional[np.ndarray], chunks: int) -> None:
+        if centroid is None:
+            self.remove(key)
+            return
+        self.docs[key] = {"file": filename, "chunks": int(chunks)}
+        self.centroids[key] = np.asarray(centroid, dtype=np.float32)
+
+    def update(self, other: "DocumentTable") -> None:
+        """Overlay another table (e.g. a delta segment); its rows win per key."""
+        for key, row in other.centroids.items():
+            self.docs[key] = dict(other.docs.get(key, {}))
+            self.centroids[key] = row
+
+    def dim(self) -> int:
+        row = next(iter(self.centroids.values()), None)
+        return int(row.shape[0]) if row is not None else 0
+
+    def missing(self, keys: List[str]) -> List[str]:
+        return [k for k in keys if k not in self.centroids]
+
+    def save(self) -> None:
+        os.makedirs(self.local_dir, exist_ok=True)
+        keys = sorted(self.centroids.keys())
+        dim = self.dim()
+        rows = (
+            np.stack([self.centroids[k] for k in keys]).astype(np.float32)
+            if keys
+            else np.zeros((0, dim), dtype=np.float32)
+        )
+        meta = {
+            "schema": 1,
+            "key_field": self.key_field,
+            "dim": dim,
+            "docs": [{"key": k, **self.docs.get(k, {})} for k in keys],
+        }
+
+        # np.save appends ".npy" unless the name already ends with it
+        vec_tmp = os.path.join(self.local_dir, "centroids.tmp.npy")
+        np.save(vec_tmp, rows)
+        os.replace(vec_tmp, os.path.join(self.local_dir, CENTROIDS_FILENAME))
+
+        meta_tmp = os.path.join(self.local_dir, DOCUMENTS_FILENAME + ".tmp")
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_tmp, os.path.join(self.local_dir, DOCUMENTS_FILENAME))
+
+
+def related_graph(table: DocumentTable, k: int = 5, min_score: float = 0.0, block_rows: int = 1024) -> Dict[str, Any]:
+    """
+    Top-k most similar runbooks per runbook. Centroid rows are unit length, so
+    C @ C.T is the cosine matrix; it is computed in row blocks to bound memory.
+    """
+    keys = sorted(table.centroids.keys())
+    out: Dict[str, Any] = {"schema": 1, "k": int(k), "docs": {}}
+    if not keys:
+        return out
+
+    rows = np.stack([table.centroids[key] for key in keys]).astype(np.float32)
+    n = len(keys)
+    kk = min(k, n - 1)
+    for start in range(0, n, block_rows):
+        sims = rows[start : start + block_rows] @ rows.T
+        for r in range(sims.shape[0]):
+            sims[r, start + r] = -np.inf  # never related to itself
+        if kk > 0:
+            top = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+            order = np.take_along_axis(sims, top, axis=1).argsort(axis=1)[:, ::-1]
+            top = np.take_along_axis(top, order, axis=1)
+        for r in range(sims.shape[0]):
+            key = keys[start + r]
+            related = []
+            if kk > 0:
+                for j in top[r]:
+                    score = float(sims[r, j])
+                    if score >= min_score:
+                        related.append({"key": keys[j], "file": table.docs.get(keys[j], {}).get("file"), "score": round(score, 4)})
+            out["docs"][key] = {"file": table.docs.get(key, {}).get("file"), "related": related}
+    return out
@@ -0,0 +1,213 @@
+"""
+Content-addressed embedding cache shared by build_chroma.py and rag_ingest_to_chroma.py.
+
+A chunk's vector depends only on (embed model, dimensions, chunk text), so it is
+stored under sha256 of exactly that and reused by any run, file or script that
+produces the same text again: a re-index after a small edit, a chunking experiment
+that leaves most chunks unchanged, or the same runbook under two paths.
+
+  embeddings.sqlite   table embeddings(key TEXT PRIMARY KEY, dim INT, vec BLOB float32, created REAL)
+
+Text is normalized before hashing (Unicode NFC, whitespace runs collapsed, trimmed),
+so re-extraction noise does not miss; the text sent to the API is unchanged.
+
+Optional S3 sync shares the cache between machines and CI runs:
+  pull(s3, bucket, key)   merge the remote copy into the local file (INSERT OR IGNORE)
+  push(s3, bucket, key)   upload the local file
+Concurrent builders can only lose each other's newest entries, never corrupt vectors.
+
+  cache = EmbeddingCache(".embed_cache/embeddings.sqlite")
+  embedder = CachedEmbedder(EmbeddingScheduler(...), cache)
+  vectors, calls = embedder.embed(chunks, batch_size=64)   # only misses reach the API
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = "./.embed_cache/embeddings.sqlite"
+
+_WS = re.compile(r"\s+")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    dim INTEGER NOT NULL,
+    vec BLOB NOT NULL,
+    created REAL NOT NULL
+)
+"""
+_LOOKUP_CHUNK = 500  # stay under SQLite's bound-parameter limit
+
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def cache_key(model: str, dimensions: int, text: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"{model}\x00{int(dimensions or 0)}\x00".encode("utf-8"))
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+def parse_s3_uri(uri: str) -> Tuple[str, str]:
+    """s3://bucket/key -> (bucket, key)."""
+    if not uri.startswith("s3://") or "/" not in uri[5:]:
+        raise ValueError(f"expected s3://bucket/key, got: {uri}")
+    bucket, key = uri[5:].split("/", 1)
+    return bucket, key
+
+
+class EmbeddingCache:
+    """SQLite-backed; one connection shared by the pipeline's embed threads under a lock."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0])
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique), _LOOKUP_CHUNK):
+                part = unique[i : i + _LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key, dim, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, dim, blob in rows:
+                    vec = np.frombuffer(blob, dtype=np.float32)
+                    if vec.shape[0] == dim:
+                        found[key] = vec.tolist()
+        return found
+
+    def put_many(self, items: Sequence[Tuple[str, Sequence[float]]]) -> None:
+        now = time.time()
+        rows = []
+        for key, vec in items:
+            arr = np.asarray(vec, dtype=np.float32)
+            rows.append((key, int(arr.shape[0]), arr.tobytes(), now))
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings (key, dim, vec, created) VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def merge_from(self, other_path: str) -> int:
+        """Copy entries missing here from another cache file; returns rows added."""
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("ATTACH DATABASE ? AS other", (other_path,))
+            try:
+                self._conn.execute("INSERT OR IGNORE INTO embeddings SELECT key, dim, vec, created FROM other.embeddings")
+                self._conn.commit()
+            finally:
+                self._conn.execute("DETACH DATABASE other")
+            return self._conn.total_changes - before
+
+    def checkpoint(self) -> None:
+        # Fold the WAL into the main file so it can be copied / uploaded alone
+        with self._lock:
+            self._conn.commit()
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---- S3 sync ----
+    def pull(self, s3, bucket: str, key: str) -> int:
+        """Merge s3://bucket/key into the local cache; a missing object is an empty cache."""
+        from botocore.exceptions import ClientError
+
+        fd, tmp = tempfile.mkstemp(suffix=".sqlite", dir=os.path.dirname(os.path.abspath(self.path)))
+        os.close(fd)
+        try:
+            try:
+                s3.download_file(bucket, key, tmp)
+            except ClientError as e:
+                code = (e.response.get("Error") or {}).get("Code")
+                if code in ("404", "NoSuchKey", "NotFound"):
+                    return 0
+                raise
+            return self.merge_from(tmp)
+        finally:
+            os.remove(tmp)
+
+    def push(self, s3, bucket: str, key: str) -> None:
+        self.checkpoint()
+        s3.upload_file(self.path, bucket, key, ExtraArgs={"ContentType": "application/vnd.sqlite3"})
+
+
+class CachedEmbedder:
+    """Wraps an EmbeddingScheduler: same embed() contract, cache hits never reach the API."""
+
+    def __init__(self, embedder: Any, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model = embedder.model
+        self.dimensions = int(getattr(embedder, "dimensions", 0) or 0)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    def embed(self, texts: Sequence[str], batch_size: int = 64) -> Tuple[List[List[float]], int]:
+        """(vectors in input order, embedding API calls made for the misses)."""
+        keys = [cache_key(self.model, self.dimensions, t) for t in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it repeats within this call
+        missing: Dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in found and k not in missing:
+                missing[k] = t
+
+        calls = 0
+        if missing:
+            vectors, calls = self.embedder.embed(list(missing.values()), batch_size)
+            fresh = list(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+
+        with self._lock:
+            self.stats["misses"] += len(missing)
+            self.stats["hits"] += len(keys) - len(missing)  # repeats of a miss are free too
+        return [list(found[k]) for k in keys], calls
+
+    def print_summary(self) -> None:
+        s = self.stats
+        total = s["hits"] + s["misses"]
+        rate = f"{100.0 * s['hits'] / total:.1f}%" if total else "-"
+        print(
+            f"Embedding cache: hits={s['hits']} misses={s['misses']} hit_rate={rate} "
+            f"entries={len(self.cache)} path={self.cache.path}"
+        )
+        self.embedder.print_summary()
+
+
+def open_cache(path: str, s3=None, s3_uri: str = "") -> Optional[EmbeddingCache]:
+    """path "" / "off" disables the cache; s3_uri (s3://bucket/key) is merged in first when given."""
+    if not path or path.lower() in ("off", "none", "0"):
+        return None
+    cache = EmbeddingCache(path)
+    if s3_uri and s3 is not None:
+        bucket, key = parse_s3_uri(s3_uri)
+        added = cache.pull(s3, bucket, key)
+        print(f"Embedding cache: merged {added} entries from {s3_uri} ({len(cache)} total)")
+    return cache
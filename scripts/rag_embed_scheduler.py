@@ -0,0 +1,293 @@
+"""
+Rate-limit-aware embedding scheduler for the ingestion scripts.
+
+Keeps several embedding batches in flight on one asyncio loop (AsyncOpenAI on a
+background thread), so rebuild throughput is bounded by the account quota rather
+than by one round trip per batch:
+
+- Token buckets sized to the account's requests/min (EMBED_RPM) and tokens/min
+  (EMBED_TPM). A batch waits until both can pay for it (tokens estimated as
+  chars / 4, corrected with the real usage.prompt_tokens afterwards).
+- The x-ratelimit-remaining-* / reset-* response headers pull the buckets down
+  to what the server says is left, so other users of the same key are accounted for.
+- A 429 pauses every request until Retry-After (retry-after-ms / retry-after /
+  x-ratelimit-reset-*), and halves the concurrency limit; successful
+  batches grow it back by one per limit's worth (AIMD).
+- Connection errors, timeouts and 5xx are retried with jittered exponential
+  backoff; other API errors (bad input, auth) fail immediately.
+
+The SDK's own retries are disabled so the scheduler sees every 429.
+
+  scheduler = EmbeddingScheduler(api_key, model, rpm=3000, tpm=1_000_000)
+  vectors, calls = scheduler.embed(chunks, batch_size=64)   # blocking; safe from many threads
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_MAX_CONCURRENCY = 8
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 30.0
+
+
+def estimate_tokens(texts: Sequence[str]) -> int:
+    return sum(len(t or "") // 4 + 1 for t in texts)
+
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SEC = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """x-ratelimit-reset-* values look like "20ms", "1s", "6m0s"; returns seconds."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * _UNIT_SEC[u] for n, u in parts)
+
+
+def retry_after_sec(headers: Any) -> Optional[float]:
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    ra = headers.get("retry-after")
+    if ra:
+        try:
+            return float(ra)
+        except ValueError:
+            pass  # HTTP-date form; fall back to the reset headers
+    resets = [parse_reset(headers.get(h)) for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second up to one minute's worth. Loop-confined."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float) -> float:
+        self._refill()
+        need = min(n, self.capacity)  # a batch larger than the bucket waits for a full bucket
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, n: float) -> None:
+        self._refill()
+        self.tokens -= n
+
+    def clamp(self, remaining: float) -> None:
+        """Server says only `remaining` is left in the current window."""
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+
+class EmbeddingScheduler:
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        *,
+        dimensions: int = 0,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ):
+        """rpm / tpm = 0 leave that limit to the server (429s and headers only)."""
+        self.api_key = api_key
+        self.model = model
+        self.dimensions = dimensions
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self._requests = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm) if tpm > 0 else None
+
+        self._inflight = 0
+        self._ok_streak = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self.stats: Dict[str, Any] = {"requests": 0, "tokens": 0, "rate_limited": 0, "retries": 0, "wait_sec": 0.0, "min_limit": self.limit}
+
+        self._client: Any = None
+        self._cond: Optional[asyncio.Condition] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="embed-scheduler", daemon=True)
+        self._thread.start()
+
+    # ---- public (any thread) ----
+    def embed(self, texts: Sequence[str], batch_size: int = 64) -> Tuple[List[List[float]], int]:
+        """Embed texts in batches, all submitted at once; returns (vectors in input order, batch calls)."""
+        batches = [list(texts[i : i + batch_size]) for i in range(0, len(texts), max(1, batch_size))]
+        futures = [asyncio.run_coroutine_threadsafe(self._embed_batch(b), self._loop) for b in batches]
+        vectors: List[List[float]] = []
+        try:
+            for f in futures:
+                vectors.extend(f.result())
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+        return vectors, len(batches)
+
+    def close(self) -> None:
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+
+    def print_summary(self) -> None:
+        s = self.stats
+        print(
+            f"Embedding scheduler: requests={s['requests']} tokens={s['tokens']} rate_limited={s['rate_limited']} "
+            f"retries={s['retries']} waited={s['wait_sec']:.1f}s concurrency={self.limit}/{self.max_concurrency} "
+            f"(min {s['min_limit']})"
+        )
+
+    # ---- loop side ----
+    def _ensure_client(self) -> Any:
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(api_key=self.api_key or None, max_retries=0)
+            self._cond = asyncio.Condition()
+        return self._client
+
+    async def _acquire(self, est_tokens: int) -> None:
+        assert self._cond is not None
+        t0 = time.monotonic()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._inflight < self.limit)
+            self._inflight += 1
+        try:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if self._requests is not None:
+                    wait = max(wait, self._requests.wait_time(1))
+                if self._tokens is not None:
+                    wait = max(wait, self._tokens.wait_time(est_tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(min(wait, 5.0))
+        except BaseException:
+            await self._release()
+            raise
+        if self._requests is not None:
+            self._requests.take(1)
+        if self._tokens is not None:
+            self._tokens.take(est_tokens)
+        self.stats["wait_sec"] += time.monotonic() - t0
+
+    async def _release(self) -> None:
+        assert self._cond is not None
+        async with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _on_headers(self, headers: Any) -> None:
+        if not headers:
+            return
+        for bucket, name in ((self._requests, "requests"), (self._tokens, "tokens")):
+            remaining = headers.get(f"x-ratelimit-remaining-{name}")
+            if bucket is not None and remaining is not None:
+                try:
+                    bucket.clamp(float(remaining))
+                except ValueError:
+                    pass
+
+    def _on_rate_limited(self, headers: Any, attempt: int) -> float:
+        self.stats["rate_limited"] += 1
+        now = time.monotonic()
+        # Several in-flight batches hit the same 429 wave: halve once per second at most
+        if now - self._last_decrease > 1.0:
+            self.limit = max(1, self.limit // 2)
+            self._last_decrease = now
+            self.stats["min_limit"] = min(self.stats["min_limit"], self.limit)
+        self._ok_streak = 0
+        delay = retry_after_sec(headers)
+        if delay is None:
+            delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt))
+        delay += random.uniform(0, 0.25)
+        self._paused_until = max(self._paused_until, now + delay)
+        return delay
+
+    def _on_success(self) -> None:
+        self._ok_streak += 1
+        if self.limit < self.max_concurrency and self._ok_streak >= self.limit:
+            self.limit += 1
+            self._ok_streak = 0
+            if self._cond is not None:
+                asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        assert self._cond is not None
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+        client = self._ensure_client()
+        est = estimate_tokens(texts)
+        kwargs: Dict[str, Any] = {"model": self.model, "input": texts}
+        if self.dimensions:
+            kwargs["dimensions"] = self.dimensions
+
+        for attempt in range(MAX_ATTEMPTS):
+            await self._acquire(est)
+            try:
+                raw = await client.embeddings.with_raw_response.create(**kwargs)
+            except RateLimitError as e:
+                await self._release()
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                self._on_rate_limited(getattr(e.response, "headers", None), attempt)
+                self.stats["retries"] += 1
+                continue
+            except (APIConnectionError, APITimeoutError, APIStatusError) as e:
+                await self._release()
+                status = getattr(e, "status_code", None)
+                if (status is not None and status < 500) or attempt == MAX_ATTEMPTS - 1:
+                    raise
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt)) + random.uniform(0, 0.25))
+                continue
+            except BaseException:
+                await self._release()
+                raise
+
+            await self._release()
+            self._on_headers(raw.headers)
+            resp = raw.parse()
+            used = int(getattr(getattr(resp, "usage", None), "prompt_tokens", 0) or est)
+            if self._tokens is not None:
+                self._tokens.take(used - est)  # settle the estimate
+            self.stats["requests"] += 1
+            self.stats["tokens"] += used
+            self._on_success()
+            return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+        raise RuntimeError("unreachable")
@@ -25,17 +25,40 @@ PROD (s3):
     --pdf-prefix knowledge/runbooks/ \
     --persist-dir rag_store_prod \
     --collection runbooks_prod
+
+Two-level index (small child chunks embedded, parent sections in parents.json):
+  python scripts/rag_ingest_to_chroma.py ... --chunk-mode hierarchical
+
+Structure-aware chunks (page headers/footers stripped, whole headings / paragraphs / code
+blocks up to a token budget, page range + heading in metadata):
+  python scripts/rag_ingest_to_chroma.py ... --chunk-mode structured --max-tokens 350
+
+Downloads, PDF parsing and embedding overlap (see rag_pipeline.py); tune with
+  --download-workers 4 --parse-workers 3 --embed-workers 4 --queue-size 8
+S3 PDFs are held in memory up to --spool-max-mb (larger ones spill to --tmp-dir) and
+are extracted and chunked a page at a time (rag_pdf_stream.py).
+and keep embedding within the account quota (rag_embed_scheduler.py) with
+  --embed-rpm 3000 --embed-tpm 1000000 --embed-concurrency 8
+
+Chunks already embedded by an earlier run, or by build_chroma.py, are read from the
+shared embedding cache instead of the API (rag_embed_cache.py):
+  --embed-cache .embed_cache/embeddings.sqlite --embed-cache-s3 s3://bucket/knowledge/cache/embeddings.sqlite
 """
 
 from __future__ import annotations
 
-import argparse, os, re, hashlib, time
-from typing import List, Tuple, Optional
+import argparse, os, re, hashlib
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Optional
 
 import boto3
-from pypdf import PdfReader
 import chromadb
-from openai import OpenAI
+
+from rag_chunking import ParentStore, iter_structured_chunks, split_parent_child
+from rag_embed_cache import DEFAULT_CACHE_PATH, CachedEmbedder, open_cache, parse_s3_uri
+from rag_embed_scheduler import EmbeddingScheduler
+from rag_pdf_stream import DEFAULT_SPOOL_MAX_MB, MB, SpooledPdf, iter_pdf_pages, spool_s3_object
+from rag_pipeline import IngestPipeline, default_parse_workers
 
 
 # -------------------------
@@ -70,29 +93,37 @@ def local_list_pdfs(root_dir: str) -> List[str]:
     return sorted(pdfs)
 
 
-def s3_download(bucket: str, key: str, out_path: str) -> None:
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    boto3.client("s3").download_file(bucket, key, out_path)
-
-
 # -------------------------
 # PDF + text processing
 # -------------------------
 
-def extract_pdf_text(pdf_path: str) -> str:
-    reader = PdfReader(pdf_path)
-    parts = []
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
-        parts.append(f"\n\n--- Page {i+1} ---\n{text}")
-    return "\n".join(parts)
+def marked_pages(pages: Iterable[str]) -> Iterator[str]:
+    """The pieces of the page-marked document text, one page at a time."""
+    for i, text in enumerate(pages):
+        yield ("\n" if i else "") + f"\n\n--- Page {i+1} ---\n{text}"
 
 
-def clean_text(text: str) -> str:
-    text = text.replace("\x00", " ")
+def _collapse_ws(text: str) -> str:
     text = re.sub(r"[ \t]+", " ", text)
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    return text.strip()
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+
+def iter_clean_text(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    The text, arriving in pieces, with NULs blanked, space / tab runs and 3+ newlines collapsed
+    and the ends stripped. Whitespace at a piece's end waits for the next one, since a run can span pieces.
+    """
+    carry = ""
+    started = False
+    for piece in pieces:
+        buf = carry + piece.replace("\x00", " ")
+        end = len(buf.rstrip())
+        head, carry = _collapse_ws(buf[:end]), buf[end:]
+        if not started:
+            head = head.lstrip()
+            started = bool(head)
+        if head:
+            yield head
 
 
 def chunk_text(text: str, max_chars: int = 2200, overlap: int = 250) -> List[str]:
@@ -112,32 +143,62 @@ def chunk_text(text: str, max_chars: int = 2200, overlap: int = 250) -> List[str
     return chunks
 
 
+def iter_chunk_text(pieces: Iterable[str], max_chars: int = 2200, overlap: int = 250) -> Iterator[str]:
+    """chunk_text over a text that arrives in pieces: a window is yielded once the text extends past it."""
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        while len(buf) > max_chars:
+            chunk = buf[:max_chars].strip()
+            if chunk:
+                yield chunk
+            buf = buf[max(1, max_chars - overlap):]
+    yield from chunk_text(buf, max_chars, overlap)
+
+
 def stable_id(*parts: str) -> str:
     return hashlib.sha256("||".join(parts).encode("utf-8")).hexdigest()
 
 
-def safe_tmp_name(unique_key: str, filename: str) -> str:
-    # Prevent collisions if filenames repeat across folders
-    short = hashlib.sha1(unique_key.encode("utf-8")).hexdigest()[:10]
-    return f"{short}-{filename}"
-
-
-# -------------------------
-# OpenAI embeddings (retry)
-# -------------------------
-
-def embed_with_retry(client: OpenAI, model: str, inputs: List[str], max_retries: int = 6) -> List[List[float]]:
-    delay = 1.0
-    for attempt in range(1, max_retries + 1):
-        try:
-            resp = client.embeddings.create(model=model, input=inputs)
-            return [e.embedding for e in resp.data]
-        except Exception as e:
-            if attempt == max_retries:
-                raise
-            # Basic exponential backoff
-            time.sleep(delay)
-            delay = min(delay * 2, 20.0)
+def parse_pdf(
+    job: Tuple[str, SpooledPdf],
+    *,
+    chunk_mode: str,
+    parent_size: int,
+    child_size: int,
+    child_overlap: int,
+    max_tokens: int = 350,
+) -> Dict[str, Any]:
+    """Pipeline parse stage (worker process). job = (source_key, PDF); pages are extracted and chunked one at a time."""
+    source_key, pdf = job
+    pages = iter_pdf_pages(pdf)
+
+    parsed: Dict[str, Any] = {
+        "source_key": source_key,
+        "file": pdf.name,
+        "parents": [],
+        "children": [],
+        "chunks": [],
+        "chunk_meta": [],
+    }
+    if chunk_mode == "structured":
+        # Page texts go in unmarked (the page range is metadata) and keep their indentation (code)
+        for c in iter_structured_chunks((p.replace("\x00", " ") for p in pages), max_tokens=max_tokens):
+            parsed["chunks"].append(c.text)
+            parsed["chunk_meta"].append({"page_start": c.page_start, "page_end": c.page_end, "heading": c.heading})
+    elif chunk_mode == "hierarchical":
+        # Parent sections span pages, so this mode still works on the whole text
+        parents, children = split_parent_child(
+            source_key,
+            "".join(iter_clean_text(marked_pages(pages))),
+            parent_size=parent_size,
+            child_size=child_size,
+            child_overlap=child_overlap,
+        )
+        parsed.update(parents=parents, children=children, chunks=[c.text for c in children])
+    else:
+        parsed["chunks"] = list(iter_chunk_text(iter_clean_text(marked_pages(pages))))
+    return parsed
 
 
 # -------------------------
@@ -154,9 +215,30 @@ def main():
     ap.add_argument("--persist-dir", required=True, help="Local folder to persist Chroma store")
     ap.add_argument("--collection", required=True, help="Chroma collection name")
     ap.add_argument("--embed-model", default="text-embedding-3-small")
-    ap.add_argument("--tmp-dir", default=".rag_tmp")
+    ap.add_argument("--tmp-dir", default=".rag_tmp", help="Spill directory for S3 PDFs over --spool-max-mb")
+    ap.add_argument("--spool-max-mb", type=float, default=DEFAULT_SPOOL_MAX_MB, help="S3 PDFs up to this size stay in memory")
     ap.add_argument("--batch", type=int, default=64)
     ap.add_argument("--reset-collection", action="store_true", help="Delete and rebuild the collection")
+    ap.add_argument("--chunk-mode", choices=["flat", "hierarchical", "structured"], default="flat")
+    ap.add_argument("--parent-size", type=int, default=3000, help="Parent section size (hierarchical mode)")
+    ap.add_argument("--child-size", type=int, default=400, help="Embedded child chunk size (hierarchical mode)")
+    ap.add_argument("--child-overlap", type=int, default=80)
+    ap.add_argument("--max-tokens", type=int, default=350, help="Chunk token budget (structured mode)")
+    # HNSW params only take effect when the collection is created (new store or --reset-collection)
+    ap.add_argument("--hnsw-m", type=int, default=0, help="HNSW M (0 = Chroma default)")
+    ap.add_argument("--hnsw-construction-ef", type=int, default=0, help="HNSW construction_ef (0 = default)")
+    ap.add_argument("--hnsw-search-ef", type=int, default=0, help="HNSW search_ef (0 = default)")
+    # Pipeline concurrency (rag_pipeline.py)
+    ap.add_argument("--download-workers", type=int, default=4, help="S3 download threads")
+    ap.add_argument("--parse-workers", type=int, default=default_parse_workers(), help="PDF parse processes (0 = in-process)")
+    ap.add_argument("--embed-workers", type=int, default=4, help="Concurrent embedding batches")
+    ap.add_argument("--queue-size", type=int, default=8, help="Bound of each hand-off queue")
+    # Embedding quota (rag_embed_scheduler.py); 0 = rely on 429s / rate-limit headers only
+    ap.add_argument("--embed-rpm", type=int, default=3000, help="Account requests/min for the embed model")
+    ap.add_argument("--embed-tpm", type=int, default=1000000, help="Account tokens/min for the embed model")
+    ap.add_argument("--embed-concurrency", type=int, default=8, help="Max embedding batches in flight")
+    ap.add_argument("--embed-cache", default=DEFAULT_CACHE_PATH, help="Embedding cache file ('off' to disable)")
+    ap.add_argument("--embed-cache-s3", default="", help="s3://bucket/key to merge the cache from and upload it to")
 
     args = ap.parse_args()
 
@@ -166,10 +248,18 @@ def main():
     if not (local_mode or s3_mode):
         raise SystemExit("Provide either --local-dir OR (--bucket AND --pdf-prefix).")
 
-    os.makedirs(args.tmp_dir, exist_ok=True)
-
-    # OpenAI client (reads OPENAI_API_KEY from env)
-    client = OpenAI()
+    # Embeddings: batches in flight within the account quota (reads OPENAI_API_KEY from env)
+    embedder = EmbeddingScheduler(
+        os.environ.get("OPENAI_API_KEY", ""),
+        args.embed_model,
+        rpm=args.embed_rpm,
+        tpm=args.embed_tpm,
+        max_concurrency=args.embed_concurrency,
+    )
+    cache_s3 = boto3.client("s3") if args.embed_cache_s3 else None
+    cache = open_cache(args.embed_cache, cache_s3, args.embed_cache_s3)
+    if cache is not None:
+        embedder = CachedEmbedder(embedder, cache)
 
     # Chroma persistent store
     chroma = chromadb.PersistentClient(path=args.persist_dir)
@@ -178,11 +268,25 @@ def main():
             chroma.delete_collection(name=args.collection)
         except Exception:
             pass
-    col = chroma.get_or_create_collection(name=args.collection)
+    hnsw = {
+        "hnsw:M": args.hnsw_m,
+        "hnsw:construction_ef": args.hnsw_construction_ef,
+        "hnsw:search_ef": args.hnsw_search_ef,
+    }
+    hnsw = {k: v for k, v in hnsw.items() if v > 0}
+    col = chroma.get_or_create_collection(name=args.collection, metadata=hnsw or None)
+    if hnsw and any((col.metadata or {}).get(k) != v for k, v in hnsw.items()):
+        print(f"NOTE: existing collection keeps its HNSW params {col.metadata}; use --reset-collection to apply")
+
+    parent_store = None
+    if args.chunk_mode == "hierarchical":
+        parent_store = ParentStore(args.persist_dir)
+        if not args.reset_collection:
+            parent_store.load()
 
     # Discover PDFs
     items: List[Tuple[str, str]] = []
-    # items = list of (source_key, local_path_to_pdf)
+    # items = list of (source_key, local path or S3 key); S3 PDFs are downloaded by the pipeline
 
     if local_mode:
         root = args.local_dir
@@ -201,51 +305,100 @@ def main():
             raise SystemExit(f"No PDFs at s3://{args.bucket}/{args.pdf_prefix}")
         print(f"Found {len(pdf_keys)} PDFs (s3): s3://{args.bucket}/{args.pdf_prefix}")
         for key in pdf_keys:
-            filename = os.path.basename(key)
-            tmp_name = safe_tmp_name(f"{args.bucket}/{key}", filename)
-            local_pdf = os.path.join(args.tmp_dir, tmp_name)
-            s3_download(args.bucket, key, local_pdf)
-            items.append((f"s3://{args.bucket}/{key}", local_pdf))
-
-    # Ingest
-    for source_key, pdf_path in items:
-        filename = os.path.basename(pdf_path)
+            items.append((f"s3://{args.bucket}/{key}", key))
+
+    # One client for all download threads (clients are thread-safe, creating them concurrently is not)
+    s3 = boto3.client("s3") if s3_mode else None
+
+    def download(item: Tuple[str, str]) -> Tuple[str, SpooledPdf]:
+        source_key, where = item
+        if not source_key.startswith("s3://"):
+            return source_key, SpooledPdf.local(where)
+        pdf = spool_s3_object(s3, args.bucket, where, tmp_dir=args.tmp_dir, max_memory=int(args.spool_max_mb * MB))
+        return source_key, pdf
+
+    batch = max(1, args.batch)
+
+    def embed(parsed: Dict[str, Any]) -> Tuple[Dict[str, Any], List[List[float]]]:
+        vectors, _ = embedder.embed(parsed["chunks"], batch)
+        return parsed, vectors
+
+    def write(item: Tuple[str, str], embedded: Tuple[Dict[str, Any], List[List[float]]]) -> None:
+        parsed, vectors = embedded
+        source_key, filename = parsed["source_key"], parsed["file"]
+        chunks, children = parsed["chunks"], parsed["children"]
         print(f"\n==> {source_key}")
 
-        raw = extract_pdf_text(pdf_path)
-        text = clean_text(raw)
-        chunks = chunk_text(text)
+        if parent_store is not None:
+            # Drop the previous children too, so none point at a replaced parent
+            col.delete(where={"source": source_key})
+            parent_store.remove_source(source_key)
+            parent_store.put(source_key, filename, parsed["parents"])
 
         if not chunks:
             print("  (no text extracted; skipping)")
-            continue
+            return
 
-        ids, docs, metas = [], [], []
-        for idx, chunk in enumerate(chunks):
+        ids, metas = [], []
+        for idx in range(len(chunks)):
             ids.append(stable_id(source_key, str(idx)))
-            docs.append(chunk)
-            metas.append({
+            meta = {
                 "source": source_key,
                 "file": filename,
                 "chunk": idx,
-            })
-
-        batch = max(1, args.batch)
-        for i in range(0, len(docs), batch):
-            d = docs[i:i + batch]
-            vectors = embed_with_retry(client, args.embed_model, d)
+            }
+            if children:
+                meta["parent_id"] = children[idx].parent_id
+                meta["parent_index"] = children[idx].parent_index
+            if parsed["chunk_meta"]:
+                meta.update(parsed["chunk_meta"][idx])
+            metas.append(meta)
+
+        for i in range(0, len(chunks), batch):
             col.upsert(
                 ids=ids[i:i + batch],
-                documents=d,
+                documents=chunks[i:i + batch],
                 metadatas=metas[i:i + batch],
-                embeddings=vectors,
+                embeddings=vectors[i:i + batch],
             )
 
         print(f"  stored chunks: {len(chunks)}")
 
+    # Ingest: download / parse / embed overlap; Chroma writes stay on this thread
+    pipeline = IngestPipeline(
+        download=download,
+        parse=partial(
+            parse_pdf,
+            chunk_mode=args.chunk_mode,
+            parent_size=args.parent_size,
+            child_size=args.child_size,
+            child_overlap=args.child_overlap,
+            max_tokens=args.max_tokens,
+        ),
+        embed=embed,
+        write=write,
+        download_workers=args.download_workers,
+        parse_workers=args.parse_workers,
+        embed_workers=args.embed_workers,
+        queue_size=args.queue_size,
+    )
+    try:
+        pipeline.run(items)
+    finally:
+        if cache is not None and args.embed_cache_s3:
+            cache.push(cache_s3, *parse_s3_uri(args.embed_cache_s3))
+            print(f"Embedding cache: uploaded {len(cache)} entries -> {args.embed_cache_s3}")
+    pipeline.print_summary()
+    embedder.print_summary()
+
+    if parent_store is not None:
+        parent_store.save()
+        print(f"\nParent sections stored: {len(parent_store.parents)}")
+
     print("\n✅ Done building Chroma store.")
     print(f"Persist dir: {args.persist_dir}")
     print(f"Collection: {args.collection}")
+    print(f"HNSW: {({k: v for k, v in (col.metadata or {}).items() if k.startswith('hnsw:')}) or 'defaults'}")
     print(f"Count: {col.count()}")
 
 
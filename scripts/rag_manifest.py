@@ -0,0 +1,110 @@
+"""
+Sharded "files" section of the build manifest (MANIFEST_FILE_SHARDS).
+
+The manifest's "files" map (S3 key -> etag / size / last_modified / chunks) grows
+with every runbook, and rewriting it in full on each build does not scale to tens of
+thousands of runbooks. With MANIFEST_FILE_SHARDS=N the map is split by a stable
+hash of the key into N objects next to manifest.json:
+
+  files/0000.json ... files/<N-1>.json   {"<s3_key>": {...}, ...}
+
+and manifest.json keeps only the index:
+
+  "files_index": {"prefix": "files/", "shards": N, "count": <runbooks>,
+                  "digests": {"0000": "<sha256 of the shard>", ...}}
+
+A build rewrites only shards whose digest changed, so a one-runbook change uploads
+one small shard plus the manifest. Shards are written before the manifest, so the
+published manifest never points at a shard that is not there yet. MANIFEST_FILE_SHARDS=0
+keeps "files" inline (the original layout); either layout is read back transparently.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+FILES_DIRNAME = "files"
+
+
+def shard_name(index: int) -> str:
+    return f"{index:04d}"
+
+
+def shard_for(key: str, shards: int) -> str:
+    h = hashlib.sha1(key.encode("utf-8")).digest()
+    return shard_name(int.from_bytes(h[:4], "big") % shards)
+
+
+def split_files(files: Dict[str, Dict[str, Any]], shards: int) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Every shard is present (possibly empty), so the set of shard objects is fixed by N."""
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {shard_name(i): {} for i in range(shards)}
+    for key in sorted(files):
+        out[shard_for(key, shards)][key] = files[key]
+    return out
+
+
+def shard_body(entries: Dict[str, Dict[str, Any]]) -> bytes:
+    return json.dumps(entries, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def shard_key(manifest_key: str, prefix: str, name: str) -> str:
+    base = manifest_key.rsplit("/", 1)[0] + "/" if "/" in manifest_key else ""
+    return f"{base}{prefix}{name}.json"
+
+
+def files_index(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    idx = manifest.get("files_index")
+    return idx if isinstance(idx, dict) and int(idx.get("shards") or 0) > 0 else {}
+
+
+def read_files(
+    manifest: Dict[str, Any],
+    manifest_key: str,
+    get_json: Callable[[str], Dict[str, Any]],
+    workers: int = 16,
+) -> Dict[str, Dict[str, Any]]:
+    """The manifest's files map, inline or gathered from its shards (fetched in parallel)."""
+    if isinstance(manifest.get("files"), dict):
+        return manifest["files"]
+    idx = files_index(manifest)
+    if not idx:
+        return {}
+    prefix = str(idx.get("prefix") or f"{FILES_DIRNAME}/")
+    keys = [shard_key(manifest_key, prefix, shard_name(i)) for i in range(int(idx["shards"]))]
+    files: Dict[str, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(keys)))) as pool:
+        for part in pool.map(get_json, keys):
+            files.update(part or {})
+    if len(files) != int(idx.get("count") or 0):
+        raise RuntimeError(f"manifest files_index lists {idx.get('count')} runbooks, shards hold {len(files)}")
+    return files
+
+
+def plan_file_shards(
+    previous: Dict[str, Any],
+    files: Dict[str, Dict[str, Any]],
+    shards: int,
+) -> Tuple[Dict[str, Any], Dict[str, bytes]]:
+    """(new files_index, {shard name: body} to upload); unchanged shards are not re-uploaded."""
+    prev = files_index(previous)
+    prev_digests = prev.get("digests") if isinstance(prev.get("digests"), dict) and int(prev.get("shards") or 0) == shards else {}
+
+    digests: Dict[str, str] = {}
+    uploads: Dict[str, bytes] = {}
+    for name, entries in split_files(files, shards).items():
+        body = shard_body(entries)
+        digests[name] = hashlib.sha256(body).hexdigest()
+        if prev_digests.get(name) != digests[name]:
+            uploads[name] = body
+    index = {"prefix": f"{FILES_DIRNAME}/", "shards": shards, "count": len(files), "digests": digests}
+    return index, uploads
+
+
+def stale_shards(previous: Dict[str, Any], shards: int) -> List[str]:
+    """Shard names of the previous layout that the new one (N shards, or inline when 0) no longer uses."""
+    prev = files_index(previous)
+    old = int(prev.get("shards") or 0)
+    return [shard_name(i) for i in range(shards, old)]
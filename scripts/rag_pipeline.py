@@ -0,0 +1,321 @@
+"""
+Staged, streaming ingestion pipeline shared by build_chroma.py and rag_ingest_to_chroma.py.
+
+  items -> [download: threads] -> q -> [parse: process pool] -> q -> [embed: threads] -> q -> [write: caller]
+
+Every hand-off is a bounded queue, so a fast stage blocks instead of buffering the
+whole corpus (a PDF waiting to be parsed is spooled, in memory when small and on disk
+otherwise, see rag_pdf_stream.py; parsed chunks wait in memory).
+The write stage runs on the calling thread, so Chroma and the side tables
+(parents, centroids, suggest, chunk texts) are only ever touched by one thread.
+
+Stage functions:
+  download(item) -> a      e.g. S3 key -> spooled PDF      (I/O bound: threads)
+  parse(a)       -> b      PDF -> text + chunks            (CPU bound: processes; must be picklable,
+                                                            i.e. a module-level function or a partial of one)
+  embed(b)       -> c      chunks -> vectors               (network bound: threads, one batch call at a time each)
+  write(item, c)           upsert into the store           (single writer)
+
+Documents finish in completion order, not input order. The first exception in
+any stage stops the pipeline and is re-raised from run().
+
+Progress (every report_every seconds) and the final summary print per-stage
+items, items/sec, busy time and current / max queue depth.
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+_DONE = object()
+_POLL_SEC = 0.2
+
+
+class _Stopped(Exception):
+    pass
+
+
+def default_parse_workers() -> int:
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def _timed(fn: Callable[[Any], Any], arg: Any):
+    # Runs in the parse worker process, so busy time excludes pool queueing
+    t0 = time.perf_counter()
+    out = fn(arg)
+    return out, time.perf_counter() - t0
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_sec = 0.0
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            self.items += 1
+            self.busy_sec += seconds
+            if self.first_at is None:
+                self.first_at = now - seconds
+            self.last_at = now
+
+    def to_dict(self) -> Dict[str, Any]:
+        wall = (self.last_at - self.first_at) if self.first_at and self.last_at else 0.0
+        return {
+            "items": self.items,
+            "busy_sec": round(self.busy_sec, 2),
+            "wall_sec": round(wall, 2),
+            "items_per_sec": round(self.items / wall, 3) if wall > 0 else None,
+        }
+
+
+class _Queue:
+    """Bounded queue that records its depth and gives up when the pipeline stops."""
+
+    def __init__(self, name: str, maxsize: int, stop: threading.Event):
+        self.name = name
+        self.q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, maxsize))
+        self.stop = stop
+        self.max_depth = 0
+
+    def put(self, item: Any) -> None:
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                self.q.put(item, timeout=_POLL_SEC)
+                self.max_depth = max(self.max_depth, self.q.qsize())
+                return
+            except queue.Full:
+                continue
+
+    def get(self) -> Any:
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                return self.q.get(timeout=_POLL_SEC)
+            except queue.Empty:
+                continue
+
+    def depth(self) -> int:
+        return self.q.qsize()
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        *,
+        download: Callable[[Any], Any],
+        parse: Callable[[Any], Any],
+        embed: Callable[[Any], Any],
+        write: Callable[[Any, Any], None],
+        download_workers: int = 4,
+        parse_workers: int = 0,
+        embed_workers: int = 4,
+        queue_size: int = 8,
+        report_every: float = 10.0,
+    ):
+        """parse_workers=0 parses on a thread in this process (no pool; e.g. for debugging)."""
+        self.download = download
+        self.parse = parse
+        self.embed = embed
+        self.write = write
+        self.download_workers = max(1, download_workers)
+        self.parse_workers = max(0, parse_workers)
+        self.embed_workers = max(1, embed_workers)
+        self.queue_size = queue_size
+        self.report_every = report_every
+
+        self.stats = {n: StageStats(n) for n in ("download", "parse", "embed", "write")}
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._queues: Dict[str, _Queue] = {}
+        self._started = 0.0
+
+    # ---- failure handling ----
+    def _fail(self, e: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = e
+        self._stop.set()
+
+    def _thread(self, name: str, target: Callable[[], None]) -> threading.Thread:
+        def run():
+            try:
+                target()
+            except _Stopped:
+                pass
+            except BaseException as e:  # surfaced by run()
+                self._fail(e)
+
+        t = threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+        t.start()
+        return t
+
+    # ---- stages ----
+    def _download_loop(self, items: "queue.Queue[Any]", out: _Queue, remaining: List[int]) -> None:
+        try:
+            while not self._stop.is_set():
+                try:
+                    item = items.get_nowait()
+                except queue.Empty:
+                    break
+                t0 = time.perf_counter()
+                payload = self.download(item)
+                self.stats["download"].record(time.perf_counter() - t0)
+                out.put((item, payload))
+        finally:
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and not self._stop.is_set():
+                out.put(_DONE)
+
+    def _parse_loop(self, inp: _Queue, out: _Queue) -> None:
+        if self.parse_workers == 0:
+            while True:
+                got = inp.get()
+                if got is _DONE:
+                    out.put(_DONE)
+                    return
+                item, payload = got
+                t0 = time.perf_counter()
+                parsed = self.parse(payload)
+                self.stats["parse"].record(time.perf_counter() - t0)
+                out.put((item, parsed))
+
+        pending: Dict[Future, Any] = {}
+
+        def drain(block_until: int) -> None:
+            # Wait until at most block_until parses are in flight, forwarding finished ones
+            while len(pending) > block_until:
+                done, _ = wait(list(pending), timeout=_POLL_SEC, return_when=FIRST_COMPLETED)
+                if self._stop.is_set():
+                    raise _Stopped()
+                for fut in done:
+                    item = pending.pop(fut)
+                    parsed, seconds = fut.result()
+                    self.stats["parse"].record(seconds)
+                    out.put((item, parsed))
+
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            try:
+                while True:
+                    got = inp.get()
+                    if got is _DONE:
+                        break
+                    item, payload = got
+                    pending[pool.submit(_timed, self.parse, payload)] = item
+                    drain(self.parse_workers - 1 + self.queue_size // 2)
+                drain(0)
+            finally:
+                for fut in pending:
+                    fut.cancel()
+        out.put(_DONE)
+
+    def _embed_loop(self, inp: _Queue, out: _Queue, remaining: List[int]) -> None:
+        try:
+            while True:
+                got = inp.get()
+                if got is _DONE:
+                    inp.put(_DONE)  # let the other embed workers see it too
+                    return
+                item, parsed = got
+                t0 = time.perf_counter()
+                embedded = self.embed(parsed)
+                self.stats["embed"].record(time.perf_counter() - t0)
+                out.put((item, embedded))
+        finally:
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and not self._stop.is_set():
+                out.put(_DONE)
+
+    # ---- reporting ----
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "elapsed_sec": round(time.time() - self._started, 1) if self._started else 0.0,
+            "stages": {n: s.to_dict() for n, s in self.stats.items()},
+            "queues": {n: {"depth": q.depth(), "max_depth": q.max_depth} for n, q in self._queues.items()},
+        }
+
+    def _progress_line(self) -> str:
+        parts = [f"{n}={s.items}" for n, s in self.stats.items()]
+        depths = " ".join(f"{n}:{q.depth()}/{q.max_depth}" for n, q in self._queues.items())
+        return f"[pipeline {time.time() - self._started:.0f}s] {' '.join(parts)} | queue depth(now/max) {depths}"
+
+    def _report_loop(self) -> None:
+        while not self._finished.wait(self.report_every):
+            print(self._progress_line())
+
+    def print_summary(self) -> None:
+        snap = self.snapshot()
+        print(f"Pipeline finished in {snap['elapsed_sec']}s")
+        for name, s in snap["stages"].items():
+            rate = f"{s['items_per_sec']}/s" if s["items_per_sec"] is not None else "-"
+            print(f"  {name:<8} items={s['items']:<5} rate={rate:<10} busy={s['busy_sec']}s wall={s['wall_sec']}s")
+        for name, q in snap["queues"].items():
+            print(f"  queue {name:<8} max_depth={q['max_depth']}")
+
+    # ---- main ----
+    def run(self, items: Iterable[Any]) -> Dict[str, Any]:
+        work: "queue.Queue[Any]" = queue.Queue()
+        count = 0
+        for it in items:
+            work.put(it)
+            count += 1
+        self._started = time.time()
+        if count == 0:
+            return self.snapshot()
+
+        downloaded = _Queue("parse_in", self.queue_size, self._stop)
+        parsed = _Queue("embed_in", self.queue_size, self._stop)
+        embedded = _Queue("write_in", self.queue_size, self._stop)
+        self._queues = {"parse_in": downloaded, "embed_in": parsed, "write_in": embedded}
+
+        n_dl = min(self.download_workers, count)
+        dl_left, emb_left = [n_dl], [self.embed_workers]
+        threads = [self._thread(f"download-{i}", lambda: self._download_loop(work, downloaded, dl_left)) for i in range(n_dl)]
+        threads.append(self._thread("parse", lambda: self._parse_loop(downloaded, parsed)))
+        threads += [self._thread(f"embed-{i}", lambda: self._embed_loop(parsed, embedded, emb_left)) for i in range(self.embed_workers)]
+        reporter = threading.Thread(target=self._report_loop, name="ingest-report", daemon=True)
+        if self.report_every > 0:
+            reporter.start()
+
+        try:
+            while True:
+                got = embedded.get()
+                if got is _DONE:
+                    break
+                item, payload = got
+                t0 = time.perf_counter()
+                self.write(item, payload)
+                self.stats["write"].record(time.perf_counter() - t0)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            if self._error is not None:
+                self._stop.set()
+            for t in threads:
+                t.join()
+            self._finished.set()
+
+        if self._error is not None:
+            raise self._error
+        return self.snapshot()
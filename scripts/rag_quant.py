@@ -0,0 +1,122 @@
+"""
+Quantized copy of the base store's vectors for a fast first-pass scan (VECTOR_QUANT).
+
+Written into the persisted Chroma directory (uploaded with the store):
+
+  vectors.q.npy    int8 [n, dim]      per-dimension symmetric scale: x ~= code * scale[d]
+                   uint8 [n, dim/8]   binary: one sign bit per dimension (np.packbits)
+  vectors.q.json   {"schema": 1, "kind": "int8" | "binary", "dim": D, "ids": [...],
+                    "keys": ["<s3_key>", ...], "key_index": [row -> keys position],
+                    "scale": [...] (int8 only)}
+
+The manifest records the same scale in "quantization": {"kind", "dim", "vectors",
+"bytes", "float_bytes", "scale"}; the API reads it from vectors.q.json so codes and
+scale always come from the same upload. The API scans the codes, then re-scores a shortlist
+with the full-precision vectors from Chroma (services/agent_api/features/rag/quantized.py).
+
+OpenAI text-embedding-3 vectors are unit length, so ranking by dot product gives
+the same order as l2 / cosine; a reduced EMBED_DIMENSIONS vector is the leading
+dimensions re-normalized (reduce_dims reproduces it for benchmarks).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+QUANT_FILENAME = "vectors.q.npy"
+QUANT_INDEX_FILENAME = "vectors.q.json"
+QUANT_KINDS = ("int8", "binary")
+
+
+def reduce_dims(x: np.ndarray, dim: int) -> np.ndarray:
+    """What the embeddings API returns for `dimensions=dim` (leading dims, re-normalized)."""
+    if not dim or dim >= x.shape[1]:
+        return x
+    y = x[:, :dim]
+    return y / np.maximum(np.linalg.norm(y, axis=1, keepdims=True), 1e-12)
+
+
+def quantize_int8(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    scale = np.maximum(np.abs(x).max(axis=0), 1e-12) / 127.0
+    codes = np.clip(np.rint(x / scale), -127, 127).astype(np.int8)
+    return codes, scale.astype(np.float32)
+
+
+def quantize_binary(x: np.ndarray) -> np.ndarray:
+    return np.packbits(x > 0, axis=1)
+
+
+def quantize(x: np.ndarray, kind: str) -> Tuple[np.ndarray, np.ndarray | None]:
+    if kind == "int8":
+        return quantize_int8(x)
+    if kind == "binary":
+        return quantize_binary(x), None
+    raise ValueError(f"unknown quantization kind: {kind}")
+
+
+def read_collection(collection, key_field: str = "s3_key", page: int = 5000) -> Tuple[List[str], List[str], np.ndarray]:
+    """(ids, keys, float32 vectors) of every vector in the collection."""
+    ids: List[str] = []
+    keys: List[str] = []
+    rows: List[Any] = []
+    total = collection.count()
+    for offset in range(0, total, page):
+        got = collection.get(include=["embeddings", "metadatas"], limit=page, offset=offset)
+        emb = got.get("embeddings")
+        if emb is None or not len(emb):
+            continue
+        ids.extend(got.get("ids") or [])
+        keys.extend(str((m or {}).get(key_field) or "") for m in got.get("metadatas") or [])
+        rows.append(np.asarray(emb, dtype=np.float32))
+    data = np.concatenate(rows, axis=0) if rows else np.zeros((0, 0), dtype=np.float32)
+    return ids, keys, data
+
+
+def remove_quantized(local_dir: str) -> None:
+    for name in (QUANT_FILENAME, QUANT_INDEX_FILENAME):
+        try:
+            os.remove(os.path.join(local_dir, name))
+        except FileNotFoundError:
+            pass
+
+
+def export_quantized(collection, local_dir: str, kind: str) -> Dict[str, Any]:
+    """Quantize every base vector into local_dir; returns the manifest "quantization" block."""
+    ids, keys, data = read_collection(collection)
+    if not ids:
+        remove_quantized(local_dir)
+        return {}
+
+    codes, scale = quantize(data, kind)
+    key_list = sorted(set(keys))
+    pos = {k: i for i, k in enumerate(key_list)}
+
+    with open(os.path.join(local_dir, QUANT_FILENAME), "wb") as f:
+        np.save(f, codes)
+    idx = {
+        "schema": 1,
+        "kind": kind,
+        "dim": int(data.shape[1]),
+        "ids": ids,
+        "keys": key_list,
+        "key_index": [pos[k] for k in keys],
+    }
+    if scale is not None:
+        idx["scale"] = scale.tolist()
+    with open(os.path.join(local_dir, QUANT_INDEX_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(idx, f, separators=(",", ":"))
+
+    block: Dict[str, Any] = {
+        "kind": kind,
+        "dim": int(data.shape[1]),
+        "vectors": len(ids),
+        "bytes": int(codes.nbytes),
+        "float_bytes": int(data.nbytes),
+    }
+    if scale is not None:
+        block["scale"] = [float(f"{v:.6g}") for v in scale.tolist()]
+    return block
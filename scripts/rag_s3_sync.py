@@ -0,0 +1,214 @@
+"""
+Delta sync of a local directory to an S3 prefix (the published Chroma store and its side files).
+
+  plan = plan_sync(s3, bucket, prefix, local_dir, keep=("manifest.json", "segments/"))
+  upload_planned(s3, bucket, plan, local_dir)       # only new / changed files
+  ... write the manifest that describes the new files ...
+  delete_orphans(s3, bucket, plan)                  # keys the new layout no longer has
+
+A local file is unchanged when the ETag S3 would compute for it matches the listed
+ETag: MD5 of the content for single-part uploads, MD5 of the part MD5s + "-<parts>"
+for multipart ones. Multipart kicks in at the same threshold / part size used for
+the upload (MULTIPART_CHUNK_MB, boto3's 8 MiB by default), so files uploaded by
+earlier runs compare equal too. Objects whose ETag is not an MD5 (SSE-KMS) never
+match and are simply re-uploaded.
+
+Files upload concurrently (one thread per file, up to `workers`), and large files
+are split into parts that boto3 also sends concurrently. Orphans are only returned
+by the plan; the caller deletes them after the new manifest is live, so a reader
+never loads a manifest whose files were already removed.
+
+With base_prefix (a new immutable version, see rag_versions.py) local files are
+compared against the live version instead: unchanged ones become server-side
+copies into the new prefix (no bytes through this machine, same part size so the
+ETags still match next time), and nothing is an orphan.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+DEFAULT_CHUNK_MB = 8  # boto3's default multipart_threshold / multipart_chunksize
+_READ_SIZE = 1 * MB
+
+
+@dataclass
+class SyncPlan:
+    prefix: str
+    chunk_size: int
+    uploads: List[Tuple[str, str, int]] = field(default_factory=list)  # (relative path, key, bytes)
+    copies: List[Tuple[str, str, int]] = field(default_factory=list)  # (source key, key, bytes)
+    unchanged: int = 0
+    orphans: List[str] = field(default_factory=list)
+
+    @property
+    def upload_bytes(self) -> int:
+        return sum(size for _, _, size in self.uploads)
+
+    def summary(self) -> str:
+        return (
+            f"upload={len(self.uploads)} ({self.upload_bytes} bytes) unchanged={self.unchanged} "
+            f"copied={len(self.copies)} orphans={len(self.orphans)}"
+        )
+
+
+def transfer_config(chunk_size: int, part_workers: int = 4) -> TransferConfig:
+    return TransferConfig(
+        multipart_threshold=chunk_size,
+        multipart_chunksize=chunk_size,
+        max_concurrency=max(1, part_workers),
+        use_threads=True,
+    )
+
+
+def s3_etag(path: str, chunk_size: int) -> str:
+    """The ETag S3 assigns to this file when uploaded with transfer_config(chunk_size)."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size < chunk_size:
+            h = hashlib.md5()
+            for block in iter(lambda: f.read(_READ_SIZE), b""):
+                h.update(block)
+            return h.hexdigest()
+        parts = [hashlib.md5(block).digest() for block in iter(lambda: f.read(chunk_size), b"")]
+    return f"{hashlib.md5(b''.join(parts)).hexdigest()}-{len(parts)}"
+
+
+def list_remote(s3, bucket: str, prefix: str) -> Dict[str, Tuple[str, int]]:
+    """key -> (etag, size) for every object under prefix."""
+    out: Dict[str, Tuple[str, int]] = {}
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []) or []:
+            key = obj.get("Key") or ""
+            if key and not key.endswith("/"):
+                out[key] = ((obj.get("ETag") or "").replace('"', ""), int(obj.get("Size") or 0))
+    return out
+
+
+def local_files(local_dir: str) -> List[str]:
+    """Relative, '/'-separated paths of every file under local_dir."""
+    rels: List[str] = []
+    for root, _, files in os.walk(local_dir):
+        for fn in files:
+            rels.append(os.path.relpath(os.path.join(root, fn), local_dir).replace("\\", "/"))
+    return sorted(rels)
+
+
+def plan_sync(
+    s3,
+    bucket: str,
+    prefix: str,
+    local_dir: str,
+    *,
+    keep: Tuple[str, ...] = (),
+    base_prefix: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_MB * MB,
+    workers: int = 8,
+) -> SyncPlan:
+    """
+    Compare local_dir with s3://bucket/prefix. keep: paths relative to prefix that are
+    written by someone else (manifest, side files): never uploaded from local_dir and
+    never treated as orphans ("dir/" keeps a subtree). base_prefix: compare with that
+    prefix instead and copy unchanged files from it into the (new, empty) prefix.
+    """
+    prefix = prefix.rstrip("/") + "/"
+    base = base_prefix.rstrip("/") + "/" if base_prefix is not None else prefix
+
+    def kept(rel: str) -> bool:
+        return rel in keep or any(k.endswith("/") and rel.startswith(k) for k in keep)
+
+    remote = list_remote(s3, bucket, base)
+    rels = [rel for rel in local_files(local_dir) if not kept(rel)]
+    plan = SyncPlan(prefix=prefix, chunk_size=chunk_size)
+
+    def compare(rel: str) -> Tuple[str, str, int, bool]:
+        path = os.path.join(local_dir, rel)
+        size = os.path.getsize(path)
+        got = remote.get(base + rel)
+        same = got is not None and got[1] == size and got[0] == s3_etag(path, chunk_size)
+        return rel, prefix + rel, size, same
+
+    # MD5 releases the GIL, so large files hash in parallel
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for rel, key, size, same in pool.map(compare, rels):
+            if not same:
+                plan.uploads.append((rel, key, size))
+            elif base != prefix:
+                plan.copies.append((base + rel, key, size))
+            else:
+                plan.unchanged += 1
+
+    if base != prefix:
+        return plan
+    wanted = {prefix + rel for rel in rels}
+    for key in sorted(remote):
+        rel = key[len(prefix) :]
+        if key in wanted or kept(rel):
+            continue
+        plan.orphans.append(key)
+    return plan
+
+
+def upload_planned(s3, bucket: str, plan: SyncPlan, local_dir: str, workers: int = 8) -> int:
+    """Upload the plan's new / changed files and copy its unchanged ones; returns the number uploaded."""
+    config = transfer_config(plan.chunk_size)
+
+    def put(item: Tuple[str, str, int]) -> None:
+        rel, key, _ = item
+        s3.upload_file(os.path.join(local_dir, rel), bucket, key, Config=config)
+
+    # Biggest first, so one large file does not start last and set the wall time alone
+    ordered = sorted(plan.uploads, key=lambda u: -u[2])
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(put, ordered))
+    copy_keys(s3, bucket, [(src, dst) for src, dst, _ in sorted(plan.copies, key=lambda c: -c[2])], plan.chunk_size, workers)
+    return len(ordered)
+
+
+def copy_keys(s3, bucket: str, pairs: List[Tuple[str, str]], chunk_size: int = DEFAULT_CHUNK_MB * MB, workers: int = 8) -> int:
+    """Server-side copy of (source key, key) pairs; large objects are copied in chunk_size parts."""
+    config = transfer_config(chunk_size)
+
+    def copy(pair: Tuple[str, str]) -> None:
+        src, dst = pair
+        s3.copy({"Bucket": bucket, "Key": src}, bucket, dst, Config=config)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(copy, pairs))
+    return len(pairs)
+
+
+def copy_prefix(
+    s3,
+    bucket: str,
+    src_prefix: str,
+    dst_prefix: str,
+    *,
+    exclude: Tuple[str, ...] = (),
+    chunk_size: int = DEFAULT_CHUNK_MB * MB,
+    workers: int = 8,
+) -> int:
+    """Copy every object under src_prefix to the same relative key under dst_prefix, except excluded paths."""
+    src_prefix = src_prefix.rstrip("/") + "/"
+    dst_prefix = dst_prefix.rstrip("/") + "/"
+    pairs: List[Tuple[str, str]] = []
+    for key in sorted(list_remote(s3, bucket, src_prefix)):
+        rel = key[len(src_prefix) :]
+        if rel in exclude or any(e.endswith("/") and rel.startswith(e) for e in exclude):
+            continue
+        pairs.append((key, dst_prefix + rel))
+    return copy_keys(s3, bucket, pairs, chunk_size, workers)
+
+
+def delete_orphans(s3, bucket: str, plan: SyncPlan) -> int:
+    for start in range(0, len(plan.orphans), 1000):
+        batch = plan.orphans[start : start + 1000]
+        s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True})
+    return len(plan.orphans)
@@ -0,0 +1,120 @@
+"""
+Append-only delta segments for publishing index changes (build_chroma.py --delta).
+
+Instead of downloading, mutating and re-uploading the whole Chroma store on every
+incremental run, each run publishes one small immutable segment:
+
+  <VECTORS_PREFIX>/segments/<segment_id>/
+      vectors.npy      float32 [n, dim]  embeddings of the new/changed chunks
+      records.json     {"ids": [...], "documents": [...], "metadatas": [...]}
+      parents.json     (hierarchical mode only)
+      documents.json + centroids.npy   (per-runbook centroids for routing)
+
+and lists it in the manifest together with its tombstones (the s3_keys whose
+older vectors must be hidden: changed + removed runbooks):
+
+  "segments": [{"id", "seq", "prefix", "created_at", "tombstones": [...], "vectors": n}]
+
+The API loads the base store plus every listed segment and merges them at query
+time; a hit from an older layer is dropped when a newer segment tombstones its
+s3_key. `build_chroma.py --compact` folds all segments back into the base.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SEGMENTS_DIRNAME = "segments"
+VECTORS_FILENAME = "vectors.npy"
+RECORDS_FILENAME = "records.json"
+
+
+def segment_id_for(seq: int, created_at: str) -> str:
+    # e.g. 000012-20260118T101500Z (sorts by seq)
+    return f"{seq:06d}-{created_at.replace('-', '').replace(':', '')}"
+
+
+class DeltaSegmentWriter:
+    """
+    Collects upserts in memory and writes them as one segment directory.
+
+    Exposes the subset of the Chroma collection API used by store_pdf
+    (upsert/add/delete/count), so the indexing code does not need to know
+    whether it is writing to the base store or to a delta.
+    """
+
+    def __init__(self, local_dir: str, metadata: Optional[Dict[str, Any]] = None):
+        self.local_dir = local_dir
+        self.metadata = metadata or {}
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.embeddings: List[List[float]] = []
+        if os.path.isdir(local_dir):
+            shutil.rmtree(local_dir, ignore_errors=True)
+        os.makedirs(local_dir, exist_ok=True)
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None) -> None:
+        self.ids.extend(ids)
+        self.documents.extend(documents or [""] * len(ids))
+        self.metadatas.extend(metadatas or [{}] * len(ids))
+        self.embeddings.extend(embeddings or [])
+
+    add = upsert
+
+    def delete(self, where: Optional[Dict[str, Any]] = None, ids: Optional[List[str]] = None) -> None:
+        # Deletes against older layers are expressed as tombstones in the manifest
+        return None
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def save(self) -> int:
+        if len(self.embeddings) != len(self.ids):
+            raise RuntimeError("delta segment: embeddings/ids length mismatch")
+        vectors = np.asarray(self.embeddings, dtype=np.float32)
+        if vectors.ndim != 2:
+            vectors = vectors.reshape((0, 0))
+        np.save(os.path.join(self.local_dir, VECTORS_FILENAME), vectors)
+        with open(os.path.join(self.local_dir, RECORDS_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}, f)
+        return len(self.ids)
+
+
+def load_segment_records(local_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(local_dir, RECORDS_FILENAME), "r", encoding="utf-8") as f:
+        records = json.load(f)
+    records["embeddings"] = np.load(os.path.join(local_dir, VECTORS_FILENAME))
+    return records
+
+
+def fold_segment_into(collection, local_dir: str, tombstones: List[str], batch_size: int = 256, text_store=None) -> int:
+    """
+    Compaction step for ONE segment (apply segments in seq order):
+    drop tombstoned runbooks from the base collection, then upsert the segment's vectors.
+    With a text_store (rag_text_store.ChunkTextStore) the texts go there instead of Chroma.
+    """
+    for key in tombstones:
+        collection.delete(where={"s3_key": key})
+
+    rec = load_segment_records(local_dir)
+    ids, docs, metas, vecs = rec["ids"], rec["documents"], rec["metadatas"], rec["embeddings"]
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        kwargs: Dict[str, Any] = {"documents": docs[start:end]}
+        if text_store is not None:
+            for cid, text, meta in zip(ids[start:end], docs[start:end], metas[start:end]):
+                text_store.put(str((meta or {}).get("s3_key") or ""), [cid], [text])
+            kwargs = {}
+        collection.upsert(
+            ids=ids[start:end],
+            metadatas=metas[start:end],
+            embeddings=vecs[start:end].tolist(),
+            **kwargs,
+        )
+    return len(ids)
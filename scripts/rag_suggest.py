@@ -0,0 +1,119 @@
+"""
+Typeahead source data for GET /runbooks/suggest.
+
+During indexing every runbook contributes its title (from the file name) and
+the section headings found in its extracted text. build_chroma.py keeps them
+in a small JSON object next to the vector store, separate from the Chroma files
+so the API can build its suggest index without downloading the store:
+
+  s3://<bucket>/<VECTORS_PREFIX>/suggest.json
+  {"schema": 1, "updated_at": "...",
+   "docs": {"<s3_key>": {"file": "x.pdf", "title": "...", "headings": ["...", ...]}}}
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+SUGGEST_FILENAME = "suggest.json"
+
+# "2.3 Rotate the API key", "Step 4: Invalidate cache", "TROUBLESHOOTING"
+_NUMBERED = re.compile(r"^(?:\d+(?:\.\d+)*[.)]?|step\s+\d+[:.)]?|[A-Z][.)])\s+(?P<title>.+)$", re.IGNORECASE)
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9'/-]*")
+
+
+def title_from_filename(filename: str) -> str:
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    words = re.sub(r"[_\-]+", " ", stem).split()
+    return " ".join(w if w.isupper() else w.capitalize() for w in words)
+
+
+def _looks_like_heading(line: str) -> bool:
+    if not (4 <= len(line) <= 80) or line.endswith((".", ",", ";")):
+        return False
+    words = _WORD.findall(line)
+    if not (1 <= len(words) <= 10):
+        return False
+    if line.isupper():
+        return True
+    # Title Case: most words capitalized (short function words are allowed lower case)
+    caps = sum(1 for w in words if w[0].isupper() or len(w) <= 3)
+    return caps / len(words) >= 0.8 and words[0][0].isupper()
+
+
+def heading_title(line: str) -> Optional[str]:
+    """The heading's title if the (whitespace-collapsed) line looks like one, else None."""
+    m = _NUMBERED.match(line)
+    candidate = m.group("title").strip() if m else line
+    return candidate if _looks_like_heading(candidate) else None
+
+
+class HeadingCollector:
+    """Headings of a document fed in pieces (e.g. one page at a time), first max_headings kept."""
+
+    def __init__(self, max_headings: int = 40):
+        self.max_headings = max_headings
+        self.headings: List[str] = []
+        self._seen: Set[str] = set()
+
+    def feed(self, text: str) -> "HeadingCollector":
+        for raw in (text or "").splitlines():
+            if len(self.headings) >= self.max_headings:
+                break
+            line = " ".join(raw.split())
+            if not line:
+                continue
+            candidate = heading_title(line)
+            if candidate is None:
+                continue
+            if candidate.isupper():
+                candidate = candidate.title()
+            key = candidate.lower()
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            self.headings.append(candidate)
+        return self
+
+    def observe(self, pages: Iterable[str]) -> Iterator[str]:
+        """Pass pages through unchanged, collecting their headings on the way."""
+        for page in pages:
+            self.feed(page)
+            yield page
+
+
+def extract_headings(text: str, max_headings: int = 40) -> List[str]:
+    """Heuristic heading detection on extracted PDF text (numbered lines, short Title Case / CAPS lines)."""
+    return HeadingCollector(max_headings).feed(text).headings
+
+
+class SuggestTable:
+    def __init__(self, data: Dict[str, Any] | None = None):
+        docs = (data or {}).get("docs")
+        self.docs: Dict[str, Dict[str, Any]] = dict(docs) if isinstance(docs, dict) else {}
+
+    def remove(self, key: str) -> None:
+        self.docs.pop(key, None)
+
+    def put(self, key: str, filename: str, headings: List[str]) -> None:
+        """headings: from extract_headings / HeadingCollector over the runbook's text."""
+        self.docs[key] = {
+            "file": filename,
+            "title": title_from_filename(filename),
+            "headings": list(headings),
+        }
+
+    def ensure(self, key: str, filename: str) -> None:
+        """Title-only entry for runbooks indexed before headings were collected."""
+        if key not in self.docs:
+            self.docs[key] = {"file": filename, "title": title_from_filename(filename), "headings": []}
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "schema": 1,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "docs": {k: self.docs[k] for k in sorted(self.docs)},
+        }
@@ -0,0 +1,161 @@
+"""
+Compressed, offset-indexed chunk text store (CHUNK_TEXT_STORE=external).
+
+Chroma then holds only ids, metadata and vectors; the chunk texts live in two
+files inside the persisted Chroma directory (uploaded with the store):
+
+  chunks-<hash>.bin concatenated frames, one independently compressed frame per chunk
+  chunks.idx.json   {"schema": 1, "codec": "zlib" | "zstd", "object": "chunks-<hash>.bin",
+                     "bytes": N, "ids": {"<chunk_id>": [offset, length]},
+                     "sources": {"<s3_key>": ["<chunk_id>", ...]}}
+
+The API downloads only the index and fetches the frames of the final top-k
+chunks with S3 range GETs (services/agent_api/features/rag/textstore.py).
+Frames are compressed one by one so any chunk can be read without its neighbours;
+zstd is used only when requested and the zstandard package is installed.
+
+The data file is named after its content (sha256 prefix): a warm API container
+that still holds an older index keeps range-reading the data file that index was
+written for (the builder keeps the previous one for a build, see
+previous_object), never a rewritten file at the same key. Stores written before
+this used the fixed name chunks.bin.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+TEXT_INDEX_FILENAME = "chunks.idx.json"
+TEXT_DATA_FILENAME = "chunks.bin"  # stores written before content-addressed names
+TEXT_DATA_GLOB = "chunks*.bin"
+
+
+def data_filename(digest: str) -> str:
+    return f"chunks-{digest[:12]}.bin"
+
+
+def _zstd():
+    try:
+        import zstandard  # type: ignore
+    except ImportError:
+        return None
+    return zstandard
+
+
+def resolve_codec(requested: str) -> str:
+    requested = (requested or "zlib").strip().lower()
+    if requested == "zstd" and _zstd() is None:
+        print("WARN: CHUNK_TEXT_CODEC=zstd but zstandard is not installed; using zlib")
+        return "zlib"
+    return "zstd" if requested == "zstd" else "zlib"
+
+
+def compress(codec: str, text: str) -> bytes:
+    raw = text.encode("utf-8")
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=9).compress(raw)
+    return zlib.compress(raw, 9)
+
+
+def decompress(codec: str, frame: bytes) -> str:
+    if codec == "zstd":
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("chunk text store is zstd-compressed but zstandard is not installed")
+        raw = zstd.ZstdDecompressor().decompress(frame)
+    else:
+        raw = zlib.decompress(frame)
+    return raw.decode("utf-8")
+
+
+class ChunkTextStore:
+    def __init__(self, local_dir: str, codec: str = "zlib"):
+        self.local_dir = local_dir
+        self.codec = codec
+        self.frames: Dict[str, bytes] = {}           # chunk_id -> compressed frame
+        self.sources: Dict[str, List[str]] = {}      # s3_key -> chunk ids
+        self.previous_object: Optional[str] = None  # data file of the loaded index (still read by warm APIs)
+
+    def load(self) -> "ChunkTextStore":
+        idx_path = os.path.join(self.local_dir, TEXT_INDEX_FILENAME)
+        if not os.path.isfile(idx_path):
+            return self
+        with open(idx_path, "r", encoding="utf-8") as f:
+            idx = json.load(f)
+        name = str(idx.get("object") or TEXT_DATA_FILENAME)
+        data_path = os.path.join(self.local_dir, name)
+        if not os.path.isfile(data_path):
+            return self
+        self.previous_object = name
+        with open(data_path, "rb") as f:
+            blob = f.read()
+        old_codec = str(idx.get("codec") or "zlib")
+        if old_codec != self.codec:
+            # Frames are copied as-is on save, so re-encode them into the configured codec once
+            print(f"Chunk text store: re-encoding {old_codec} -> {self.codec}")
+        for cid, (off, length) in (idx.get("ids") or {}).items():
+            frame = blob[off : off + length]
+            if old_codec != self.codec:
+                frame = compress(self.codec, decompress(old_codec, frame))
+            self.frames[cid] = frame
+        self.sources = {k: list(v) for k, v in (idx.get("sources") or {}).items()}
+        return self
+
+    def put(self, s3_key: str, ids: Sequence[str], texts: Sequence[str]) -> None:
+        known = self.sources.setdefault(s3_key, [])
+        for cid, text in zip(ids, texts):
+            if cid not in self.frames:
+                known.append(cid)
+            self.frames[cid] = compress(self.codec, text or "")
+
+    def remove_source(self, s3_key: str) -> None:
+        for cid in self.sources.pop(s3_key, []):
+            self.frames.pop(cid, None)
+
+    def get(self, cid: str) -> Optional[str]:
+        frame = self.frames.get(cid)
+        return None if frame is None else decompress(self.codec, frame)
+
+    def save(self) -> int:
+        """Rewrite the data file (under its content name) + index; returns the data file size in bytes."""
+        os.makedirs(self.local_dir, exist_ok=True)
+        offsets: Dict[str, List[int]] = {}
+        data_tmp = os.path.join(self.local_dir, "chunks.tmp")
+        digest = hashlib.sha256()
+        pos = 0
+        with open(data_tmp, "wb") as f:
+            # Source order keeps one runbook's chunks adjacent, so range reads coalesce
+            for s3_key in sorted(self.sources):
+                for cid in self.sources[s3_key]:
+                    frame = self.frames.get(cid)
+                    if frame is None:
+                        continue
+                    f.write(frame)
+                    digest.update(frame)
+                    offsets[cid] = [pos, len(frame)]
+                    pos += len(frame)
+        name = data_filename(digest.hexdigest())
+        os.replace(data_tmp, os.path.join(self.local_dir, name))
+        # Older data files leave the local store; the sync keeps previous_object in S3 for one build
+        for path in glob.glob(os.path.join(self.local_dir, TEXT_DATA_GLOB)):
+            if os.path.basename(path) != name:
+                os.remove(path)
+
+        idx = {
+            "schema": 1,
+            "codec": self.codec,
+            "object": name,
+            "bytes": pos,
+            "ids": offsets,
+            "sources": {k: [c for c in v if c in offsets] for k, v in sorted(self.sources.items())},
+        }
+        idx_tmp = os.path.join(self.local_dir, TEXT_INDEX_FILENAME + ".tmp")
+        with open(idx_tmp, "w", encoding="utf-8") as f:
+            json.dump(idx, f, separators=(",", ":"))
+        os.replace(idx_tmp, os.path.join(self.local_dir, TEXT_INDEX_FILENAME))
+        return pos
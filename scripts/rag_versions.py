@@ -0,0 +1,164 @@
+"""
+Immutable, versioned publishing of the Chroma store behind an atomic pointer.
+
+  <VECTORS_PREFIX>/current.json                      the only object a build overwrites
+  <VECTORS_PREFIX>/versions/<version>/               one complete store per publish, never modified
+      manifest.json  files/  suggest.json  related.json  segments/  chroma.sqlite3  ...
+
+  {"schema": 1, "version": "v000042-20261018T101500Z", "prefix": "versions/v000042-20261018T101500Z/",
+   "seq": 42, "published_at": "2026-10-18T10:15:00Z", "previous": "v000041-20261017T101500Z"}
+
+A build writes its whole store under a new version prefix (unchanged files as
+server-side copies of the live version, see rag_s3_sync.py) and only then
+replaces current.json. A PUT replaces an object atomically, so a reader that
+resolves the pointer sees the old store or the new one, never a mix of the two,
+and a container that loaded version N keeps a consistent view while N+1 uploads.
+
+The pointer write is conditional on the ETag read when the build started
+(If-Match, or If-None-Match for the first publish): a build that lost a race
+with another one fails instead of silently replacing its publish.
+
+Rollback is a pointer write to an older version; the newest `keep` versions
+(plus the live one and its predecessor) survive pruning for that.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from botocore.exceptions import ClientError
+
+POINTER_FILENAME = "current.json"
+VERSIONS_DIRNAME = "versions"
+DEFAULT_KEEP = 5
+
+
+class PointerConflict(RuntimeError):
+    """current.json changed since it was read (another build or a rollback published first)."""
+
+
+def version_id(seq: int, when: Optional[float] = None) -> str:
+    # e.g. v000042-20261018T101500Z (sorts by seq)
+    return f"v{seq:06d}-{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(when))}"
+
+
+def version_prefix(version: str) -> str:
+    """Prefix of a version relative to the vectors prefix."""
+    return f"{VERSIONS_DIRNAME}/{version}/"
+
+
+def pointer_key(root: str) -> str:
+    return f"{root.rstrip('/')}/{POINTER_FILENAME}"
+
+
+@dataclass
+class Pointer:
+    version: str
+    seq: int
+    published_at: str = ""
+    previous: Optional[str] = None
+    etag: str = ""  # of the object as read; empty for a pointer not written yet
+
+    @property
+    def prefix(self) -> str:
+        return version_prefix(self.version)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any], etag: str = "") -> "Pointer":
+        version = str(data.get("version") or "")
+        if not version or "/" in version or version.startswith("."):
+            raise ValueError(f"invalid {POINTER_FILENAME}: version={version!r}")
+        return cls(
+            version=version,
+            seq=int(data.get("seq") or 0),
+            published_at=str(data.get("published_at") or ""),
+            previous=data.get("previous") or None,
+            etag=etag,
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "schema": 1,
+            "version": self.version,
+            "prefix": self.prefix,
+            "seq": self.seq,
+            "published_at": self.published_at,
+            "previous": self.previous,
+        }
+
+
+def _error_code(e: ClientError) -> str:
+    return str(e.response.get("Error", {}).get("Code") or "")
+
+
+def read_pointer(s3, bucket: str, root: str) -> Optional[Pointer]:
+    """The live pointer, or None while the store is still published in place (no current.json)."""
+    try:
+        resp = s3.get_object(Bucket=bucket, Key=pointer_key(root))
+    except ClientError as e:
+        if _error_code(e) in ("NoSuchKey", "404"):
+            return None
+        raise
+    data = json.loads(resp["Body"].read().decode("utf-8"))
+    return Pointer.from_json(data, etag=(resp.get("ETag") or "").replace('"', ""))
+
+
+def write_pointer(s3, bucket: str, root: str, pointer: Pointer, expected: Optional[Pointer]) -> None:
+    """Replace current.json, but only if it is still `expected` (None: only if there is none yet)."""
+    condition = {"IfMatch": f'"{expected.etag}"'} if expected is not None else {"IfNoneMatch": "*"}
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=pointer_key(root),
+            Body=json.dumps(pointer.to_json(), indent=2).encode("utf-8"),
+            ContentType="application/json",
+            CacheControl="no-cache",
+            **condition,
+        )
+    except ClientError as e:
+        # 412: the ETag no longer matches; 409: a concurrent conditional write is in progress
+        if _error_code(e) in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409"):
+            was = expected.version if expected is not None else "none"
+            raise PointerConflict(f"{pointer_key(root)} changed since it was read (was {was})") from e
+        raise
+
+
+def list_versions(s3, bucket: str, root: str) -> List[str]:
+    """Version ids present under root/versions/, oldest first."""
+    prefix = f"{root.rstrip('/')}/{VERSIONS_DIRNAME}/"
+    out: List[str] = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        for cp in page.get("CommonPrefixes", []) or []:
+            name = (cp.get("Prefix") or "")[len(prefix) :].strip("/")
+            if name:
+                out.append(name)
+    return sorted(out)
+
+
+def delete_version(s3, bucket: str, root: str, version: str) -> int:
+    """Delete every object of one version; returns the number deleted."""
+    prefix = f"{root.rstrip('/')}/{version_prefix(version)}"
+    deleted = 0
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys = [obj["Key"] for obj in page.get("Contents", []) or [] if obj.get("Key")]
+        if keys:
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True})
+            deleted += len(keys)
+    return deleted
+
+
+def prune_versions(s3, bucket: str, root: str, keep: int, protect: Iterable[Optional[str]] = ()) -> List[str]:
+    """
+    Delete all but the newest `keep` versions (at least 2, so there is always one to roll back to);
+    versions in `protect` (the live one, its predecessor) are never deleted. Returns the deleted ids.
+    """
+    keep = max(2, keep)
+    protected = {v for v in protect if v}
+    versions = list_versions(s3, bucket, root)
+    doomed = [v for v in versions[: max(0, len(versions) - keep)] if v not in protected]
+    for v in doomed:
+        delete_version(s3, bucket, root, v)
+    return doomed
@@ -8,10 +8,14 @@ Endpoints (behind CloudFront /api/*):
   GET  /api/agents
   GET  /api/news/latest
   POST /api/agent/run
+  GET  /api/runbooks/suggest?prefix=
+  GET  /api/runbooks/{file}/related
+  GET  /api/runbooks/index/stats
   POST /api/runbooks/ask
   POST /api/mcp/run
   GET  /api/_routes          (debug)
   GET  /api/_debug/news      (debug)
+  GET  /api/_debug/metrics   (debug, includes rolling LLM token usage)
   OPTIONS *                  (CORS)
 
 Important:
@@ -21,18 +25,61 @@ Important:
 
 from __future__ import annotations
 
+import fnmatch
 import json
 import os
 import shutil
 import sys
-from typing import Any, Dict, List, Tuple
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
 import traceback
-
-from core.request import get_method, get_path, get_body_json
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from core import deadline, usage
+from core.hedge import FailedAttempt, get_policy, hedged_call
+from core.ratelimit import DynamoBucketStore, MemoryBucketStore, RateLimiter, parse_api_keys, parse_limits
+from core.idempotency import MemoryIdempotencyStore, S3IdempotencyStore, run_idempotent
+from core.metrics import histogram, snapshot_all
+from core.request import get_method, get_path, get_body_json, get_query_params
 from core.response import json_response
 
 from news_service import handle_get_debug_news, handle_get_news_latest
 from features.mcp.mcp_routes import handle_post_mcp_run  # ✅ MCP handler lives here
+from features.rag.embed_batcher import EmbeddingBatcher
+from features.rag.experiments import assign_all, log_exposure, merged_overrides, parse_experiments
+from features.rag.hierarchy import group_hits_by_parent, load_parents
+from features.rag.hnsw import apply_search_ef, search_ef_from_manifest
+from features.rag.manifest import (
+    MANIFEST_FILES_DIRNAME,
+    load_local_manifest,
+    manifest_file_count,
+    manifest_file_shard_keys,
+)
+from features.rag.routing import load_document_table, merge_document_tables, route_documents, routing_where
+from features.rag.quantized import DEFAULT_OVERSAMPLE, load_quantized
+from features.rag.segments import distances, link_tombstones, load_segment, manifest_segments, query_segment
+from features.rag.related import RELATED_FILENAME, RelatedGraph
+from features.rag.suggest import SuggestIndex
+from features.rag.textstore import TEXT_DATA_GLOB, load_text_index
+from features.rag.versions import (
+    POINTER_FILENAME,
+    VERSIONS_DIRNAME,
+    PointerCache,
+    Published,
+    versioned_local_dir,
+)
+from features.rag.shards import (
+    LoadedShard,
+    ShardCache,
+    ShardConfig,
+    fan_out,
+    merge_by_distance,
+    parse_shard_configs,
+    select_shards,
+)
 
 # ---- sqlite shim (must be BEFORE any chromadb import) ----
 # IMPORTANT: chromadb checks sqlite3 version at import time.
@@ -67,9 +114,84 @@ S3_BUCKET = os.environ.get("S3_BUCKET", "").strip()
 VECTORS_PREFIX = os.environ.get("VECTORS_PREFIX", "knowledge/vectors/dev/chroma/").strip().lstrip("/")
 CHROMA_COLLECTION = os.environ.get("CHROMA_COLLECTION", "runbooks_dev").strip()
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-3-small").strip()
+# Must match the EMBED_DIMENSIONS the store was built with (manifest "embed_dimensions"); 0 = model default
+EMBED_DIMENSIONS = int(os.environ.get("EMBED_DIMENSIONS", "0"))
 
 CHROMA_LOCAL_DIR = "/tmp/chroma_store"
 
+# Hierarchical index: fetch top_k * fanout child chunks, then collapse them into parent sections
+RAG_CHILD_FANOUT = max(1, int(os.environ.get("RAG_CHILD_FANOUT", "4")))
+
+# Coarse routing: pick the top-M runbooks by centroid similarity, then search chunks only in them.
+# Skipped for small corpora (<= RAG_ROUTE_MIN_DOCS) where a full chunk search is already cheap.
+RAG_ROUTE_TOP_M = int(os.environ.get("RAG_ROUTE_TOP_M", "8"))
+RAG_ROUTE_MIN_DOCS = int(os.environ.get("RAG_ROUTE_MIN_DOCS", "50"))
+
+# Sharded retrieval (optional). JSON list of {"name","prefix","collection","bucket","tags"};
+# unset -> one shard built from S3_BUCKET/VECTORS_PREFIX/CHROMA_COLLECTION.
+RAG_SHARDS = os.environ.get("RAG_SHARDS", "").strip()
+RAG_SHARDS_LOCAL_ROOT = "/tmp/chroma_shards"
+RAG_SHARD_CACHE_MB = int(os.environ.get("RAG_SHARD_CACHE_MB", "256"))
+RAG_SHARD_WORKERS = max(1, int(os.environ.get("RAG_SHARD_WORKERS", "4")))
+
+# HNSW search-time ef (0 -> use manifest "hnsw_recommended", else the value baked into the collection)
+RAG_HNSW_SEARCH_EF = int(os.environ.get("RAG_HNSW_SEARCH_EF", "0"))
+
+# Stores built with VECTOR_QUANT: scan the quantized codes, then re-score n_results * oversample
+# candidates at full precision (0 -> per-kind default). RAG_QUANT_SEARCH=0 uses the HNSW query instead.
+RAG_QUANT_SEARCH = os.environ.get("RAG_QUANT_SEARCH", "1").strip() not in ("0", "false", "off")
+RAG_QUANT_OVERSAMPLE = int(os.environ.get("RAG_QUANT_OVERSAMPLE", "0"))
+
+# Query embedding micro-batching (concurrent requests share one embeddings call). Opt-in for
+# multi-threaded hosts: a Lambda container serves one request at a time, so a wait there would
+# only add latency. RAG_EMBED_BATCH_WAIT_MS=0 (default) flushes at once, i.e. no batching.
+RAG_EMBED_BATCH_MAX = max(1, int(os.environ.get("RAG_EMBED_BATCH_MAX", "16")))
+RAG_EMBED_BATCH_WAIT_MS = float(os.environ.get("RAG_EMBED_BATCH_WAIT_MS", "0"))
+
+# A/B experiments for /runbooks/ask: RAG_EXPERIMENTS JSON wins over agent-config/experiments.json
+RAG_EXPERIMENTS = os.environ.get("RAG_EXPERIMENTS", "").strip()
+
+# Typeahead (GET /runbooks/suggest): asked questions are suggested once asked this many times;
+# the index (questions, runbook titles/headings) is rebuilt after SUGGEST_REFRESH_SEC
+SUGGEST_POPULAR_MIN_COUNT = int(os.environ.get("SUGGEST_POPULAR_MIN_COUNT", "3"))
+SUGGEST_REFRESH_SEC = int(os.environ.get("SUGGEST_REFRESH_SEC", "600"))
+
+# Related-runbooks graph (<VECTORS_PREFIX>/related.json per shard): neighbours attached to
+# each /runbooks/ask source, and how often the graph is re-read
+RAG_RELATED_PER_SOURCE = int(os.environ.get("RAG_RELATED_PER_SOURCE", "3"))
+RELATED_REFRESH_SEC = int(os.environ.get("RELATED_REFRESH_SEC", "600"))
+
+# GET /runbooks/index/stats re-reads each shard's manifest.json at most this often
+INDEX_STATS_CACHE_SEC = int(os.environ.get("INDEX_STATS_CACHE_SEC", "30"))
+
+# Versioned stores: re-read each shard's current.json this often and reload the shard when it
+# points at another version (a new build or a rollback). 0 = keep the version loaded at cold start.
+RAG_VERSION_CHECK_SEC = int(os.environ.get("RAG_VERSION_CHECK_SEC", "60"))
+
+# Idempotency-Key replay for retried POSTs: s3 (shared) | memory (per container) | off
+IDEMPOTENCY_BACKEND = os.environ.get("IDEMPOTENCY_BACKEND", "s3").strip().lower()
+IDEMPOTENCY_PREFIX = os.environ.get("IDEMPOTENCY_PREFIX", "idempotency").strip().strip("/")
+IDEMPOTENCY_TTL_SEC = int(os.environ.get("IDEMPOTENCY_TTL_SEC", "900"))
+# In-flight claim lease when there is no request deadline (local runs); the Lambda timeout is 30s
+IDEMPOTENCY_LEASE_SEC = float(os.environ.get("IDEMPOTENCY_LEASE_SEC", "35"))
+
+# Token-bucket limits per client + route: memory (per container) | dynamodb (shared) | off
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").strip().lower()
+RATE_LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE", "").strip()
+RATE_LIMITS = os.environ.get("RATE_LIMITS", "").strip()
+# X-Api-Key values (SHA-256 hex, comma-separated) that get their own bucket; any other key is ignored
+RATE_LIMIT_API_KEYS = os.environ.get("RATE_LIMIT_API_KEYS", "").strip()
+# Proxies that append to X-Forwarded-For in front of the API (1 = CloudFront); 0 = API Gateway source IP
+RATE_LIMIT_TRUSTED_HOPS = int(os.environ.get("RATE_LIMIT_TRUSTED_HOPS", "1"))
+
+# Attach the per-request LLM usage summary to JSON responses (also per request: ?usage=1
+# or X-Include-Usage: 1). The token ceiling itself is LLM_TOKEN_CEILING, see core/usage.py.
+LLM_USAGE_IN_RESPONSE = os.environ.get("LLM_USAGE_IN_RESPONSE", "").strip().lower() in ("1", "true", "yes")
+
+# If a request is still running this close to the Lambda timeout, answer 504 JSON
+# (outbound calls already stop at DEADLINE_MARGIN_MS, see core/deadline.py)
+WATCHDOG_MARGIN_MS = int(os.environ.get("WATCHDOG_MARGIN_MS", "500"))
+
 DEFAULT_ALLOWED_LOCATIONS = sorted(
     ["New York, NY", "San Francisco, CA", "Seattle, WA", "London, UK", "Delhi, India", "Tokyo, Japan"]
 )
@@ -79,11 +201,25 @@ AGENT_ID_WEATHER = "agent-weather"
 AGENT_ID_TRAVEL = "agent-travel"
 
 _s3 = None
-_config_cache: Dict[str, Any] = {"agents": None, "allowlists": None}
+_config_cache: Dict[str, Any] = {"agents": None, "allowlists": None, "experiments": None}
 
 _openai_client = None
-_chroma_client = None
-_chroma_collection = None
+_shard_cache = None
+_shard_pool = None
+_shard_configs: List[ShardConfig] = []
+_embed_batcher = None
+_idempotency_store = None
+_rate_limiter = None
+_ddb = None
+_suggest_index = None
+_suggest_built_at = 0.0
+_suggest_lock = threading.Lock()
+_related_graph = None
+_related_loaded_at = 0.0
+_manifest_cache: Dict[str, Tuple[float, dict]] = {}
+_manifest_files_cache: Dict[str, Dict[str, Any]] = {}
+_pointer_cache = None
+_reload_failed_at: Dict[str, float] = {}
 
 
 # ---------------- Basic helpers ----------------
@@ -97,7 +233,7 @@ def _s3_client():
     if boto3 is None:
         raise RuntimeError("boto3 not available in this Lambda runtime")
     if _s3 is None:
-        _s3 = boto3.client("s3")
+        _s3 = deadline.guard_client(boto3.client("s3"))
     return _s3
 
 
@@ -141,6 +277,82 @@ def _load_agent_config() -> Tuple[dict, dict]:
     return agents, allow
 
 
+def _load_experiments() -> list:
+    if _config_cache["experiments"] is not None:
+        return _config_cache["experiments"]
+
+    data: Any = {}
+    if RAG_EXPERIMENTS:
+        try:
+            data = json.loads(RAG_EXPERIMENTS)
+        except Exception as e:
+            _log(f"RAG_EXPERIMENTS ignored (invalid JSON): {e}")
+    elif AGENT_CONFIG_BUCKET:
+        data = _s3_get_json(AGENT_CONFIG_BUCKET, f"{AGENT_CONFIG_PREFIX}/experiments.json")
+
+    _config_cache["experiments"] = parse_experiments(data)
+    return _config_cache["experiments"]
+
+
+def _build_suggest_index(previous: Any = None) -> SuggestIndex:
+    idx = SuggestIndex(popular_min_count=SUGGEST_POPULAR_MIN_COUNT)
+    if AGENT_CONFIG_BUCKET:
+        questions = _s3_get_json(AGENT_CONFIG_BUCKET, f"{AGENT_CONFIG_PREFIX}/questions.json")
+        for q in _normalize_str_list(questions.get("questions")):
+            idx.add(q, "question")
+        # Curated from logs; trusted, so counted as already popular
+        popular = _s3_get_json(AGENT_CONFIG_BUCKET, f"{AGENT_CONFIG_PREFIX}/popular_questions.json")
+        for q in _normalize_str_list(popular.get("questions")):
+            idx.add(q, "popular", count=SUGGEST_POPULAR_MIN_COUNT)
+
+    # Titles + headings written by scripts/build_chroma.py next to each vector store
+    for cfg in _get_shard_configs():
+        prefix = _published_prefix(cfg)
+        if not (cfg.bucket and prefix):
+            continue
+        data = _s3_get_json(cfg.bucket, prefix + "suggest.json")
+        docs = data.get("docs") if isinstance(data, dict) else None
+        for doc in (docs or {}).values():
+            if not isinstance(doc, dict):
+                continue
+            idx.add(doc.get("title") or "", "title", file=doc.get("file"))
+            for h in _normalize_str_list(doc.get("headings")):
+                idx.add(h, "heading", file=doc.get("file"))
+
+    if previous is not None:
+        for q, n in previous.recorded().items():
+            idx.add(q, "popular", asked=n)
+    return idx
+
+
+def _get_suggest_index() -> SuggestIndex:
+    global _suggest_index, _suggest_built_at
+    if _suggest_index is not None and time.time() - _suggest_built_at < SUGGEST_REFRESH_SEC:
+        return _suggest_index
+    with _suggest_lock:
+        if _suggest_index is None or time.time() - _suggest_built_at >= SUGGEST_REFRESH_SEC:
+            _suggest_index = _build_suggest_index(_suggest_index)
+            _suggest_built_at = time.time()
+            _log(f"Suggest index built: entries={len(_suggest_index)}")
+    return _suggest_index
+
+
+def _get_related_graph() -> RelatedGraph:
+    global _related_graph, _related_loaded_at
+    if _related_graph is not None and time.time() - _related_loaded_at < RELATED_REFRESH_SEC:
+        return _related_graph
+    graph = RelatedGraph()
+    configs = _get_shard_configs()
+    for cfg in configs:
+        prefix = _published_prefix(cfg)
+        if cfg.bucket and prefix:
+            data = _s3_get_json(cfg.bucket, prefix + RELATED_FILENAME)
+            graph.add_shard(data, shard=cfg.name if len(configs) > 1 else None)
+    _related_graph, _related_loaded_at = graph, time.time()
+    _log(f"Related graph loaded: runbooks={len(graph)}")
+    return graph
+
+
 def _normalize_str_list(value: Any) -> List[str]:
     if not isinstance(value, list):
         return []
@@ -174,6 +386,7 @@ import urllib.error
 
 
 def _http_get_json(url: str, timeout_sec: int = 8) -> dict:
+    timeout_sec = deadline.timeout(timeout_sec, f"GET {url}")
     with urllib.request.urlopen(url, timeout=timeout_sec) as resp:
         return json.loads(resp.read().decode("utf-8", errors="ignore"))
 
@@ -252,6 +465,7 @@ def _http_post_json(url: str, payload: dict, headers: dict | None = None, timeou
     if headers:
         req_headers.update(headers)
     req = urllib.request.Request(url, data=data, headers=req_headers, method="POST")
+    timeout_sec = deadline.timeout(timeout_sec, f"POST {url}")
     try:
         with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
             return json.loads(resp.read().decode("utf-8", errors="ignore"))
@@ -279,7 +493,22 @@ def _openai_call(prompt: str) -> dict:
     url = "https://api.openai.com/v1/responses"
     payload = {"model": OPENAI_MODEL, "input": prompt, "max_output_tokens": 650}
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
-    return _http_post_json(url, payload, headers=headers, timeout_sec=25)
+    usage.reserve(usage.estimate_tokens(prompt) + payload["max_output_tokens"], "travel plan")
+    t0 = time.perf_counter()
+
+    def _attempt() -> dict:
+        resp = _http_post_json(url, payload, headers=headers, timeout_sec=25)
+        if isinstance(resp, dict) and resp.get("error"):
+            raise FailedAttempt(resp)
+        return resp
+
+    try:
+        resp = hedged_call(get_policy("responses_json"), _attempt)
+    except FailedAttempt as e:
+        resp = e.result
+    if isinstance(resp, dict) and not resp.get("error"):
+        usage.record("travel", OPENAI_MODEL, resp.get("usage"), (time.perf_counter() - t0) * 1000)
+    return resp
 
 
 def get_travel_info(city: str) -> dict:
@@ -379,7 +608,11 @@ def _s3_list_keys(bucket: str, prefix: str) -> List[str]:
     return keys
 
 
-def _s3_download_prefix(bucket: str, prefix: str, local_dir: str) -> int:
+def _s3_download_prefix(bucket: str, prefix: str, local_dir: str, exclude: Tuple[str, ...] = ()) -> int:
+    """
+    exclude: paths (or fnmatch patterns) relative to prefix that stay in S3 (e.g. the chunk text data
+    file); "dir/" skips a subtree.
+    """
     s3 = _s3_client()
     keys = _s3_list_keys(bucket, prefix)
     if not keys:
@@ -391,7 +624,10 @@ def _s3_download_prefix(bucket: str, prefix: str, local_dir: str) -> int:
 
     count = 0
     for key in keys:
+        deadline.check(f"downloading s3://{bucket}/{prefix}")
         rel = key[len(prefix) :].lstrip("/")
+        if any(fnmatch.fnmatchcase(rel, e) or (e.endswith("/") and rel.startswith(e)) for e in exclude):
+            continue
         dest = os.path.join(local_dir, rel)
         os.makedirs(os.path.dirname(dest), exist_ok=True)
         s3.download_file(bucket, key, dest)
@@ -452,17 +688,109 @@ def _patch_chromadb_config_dispatch() -> None:
         _log(f"Chroma config dispatch patch skipped: {e}")
 
 
-def _ensure_chroma():
-    global _chroma_client, _chroma_collection
-    if _chroma_collection is not None:
-        return _chroma_collection
+def _ddb_client():
+    global _ddb
+    if _ddb is None:
+        if boto3 is None:
+            raise RuntimeError("boto3 not available")
+        _ddb = deadline.guard_client(boto3.client("dynamodb"))
+    return _ddb
+
+
+def _get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        if RATE_LIMIT_BACKEND == "off":
+            store = None
+        elif RATE_LIMIT_BACKEND == "dynamodb" and RATE_LIMIT_TABLE and boto3 is not None:
+            store = DynamoBucketStore(_ddb_client, RATE_LIMIT_TABLE)
+        else:
+            store = MemoryBucketStore()
+        _rate_limiter = RateLimiter(
+            store, parse_limits(RATE_LIMITS), parse_api_keys(RATE_LIMIT_API_KEYS), RATE_LIMIT_TRUSTED_HOPS
+        )
+    return _rate_limiter
+
+
+def _get_idempotency_store():
+    global _idempotency_store
+    if _idempotency_store is None and IDEMPOTENCY_BACKEND != "off":
+        bucket = AGENT_CONFIG_BUCKET or S3_BUCKET
+        if IDEMPOTENCY_BACKEND == "s3" and bucket and boto3 is not None:
+            _idempotency_store = S3IdempotencyStore(
+                _s3_client, bucket, IDEMPOTENCY_PREFIX, ttl_sec=IDEMPOTENCY_TTL_SEC, lease_sec=IDEMPOTENCY_LEASE_SEC
+            )
+        else:
+            _idempotency_store = MemoryIdempotencyStore(ttl_sec=IDEMPOTENCY_TTL_SEC, lease_sec=IDEMPOTENCY_LEASE_SEC)
+    return _idempotency_store
+
+
+def _default_shard_config() -> ShardConfig:
+    return ShardConfig(
+        name="default",
+        bucket=S3_BUCKET,
+        prefix=VECTORS_PREFIX,
+        collection=CHROMA_COLLECTION,
+        local_dir=CHROMA_LOCAL_DIR,
+    )
+
+
+def _get_shard_configs() -> List[ShardConfig]:
+    global _shard_configs
+    if not _shard_configs:
+        _shard_configs = parse_shard_configs(
+            RAG_SHARDS, default=_default_shard_config(), local_root=RAG_SHARDS_LOCAL_ROOT
+        )
+    return _shard_configs
+
+
+def _read_pointer(cfg: ShardConfig) -> dict:
+    """The shard's current.json ({} while the store is published in place); raises on other S3 errors."""
+    try:
+        resp = _s3_client().get_object(Bucket=cfg.bucket, Key=cfg.prefix.rstrip("/") + "/" + POINTER_FILENAME)
+    except Exception as e:
+        if (getattr(e, "response", None) or {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return {}
+        raise
+    return json.loads(resp["Body"].read().decode("utf-8"))
+
+
+def _published(cfg: ShardConfig, max_age: Optional[float] = None) -> Published:
+    """The shard's live version + prefix, re-resolved at most every RAG_VERSION_CHECK_SEC."""
+    global _pointer_cache
+    if not (cfg.bucket and cfg.prefix):
+        return Published(None, cfg.prefix)
+    if _pointer_cache is None:
+        _pointer_cache = PointerCache(_read_pointer, max_age=RAG_VERSION_CHECK_SEC)
+    return _pointer_cache.get(cfg, max_age)
+
+
+def _published_prefix(cfg: ShardConfig) -> str:
+    """Where the shard's published side files (suggest.json, manifest.json, ...) live; "" if unresolvable."""
+    try:
+        prefix = _published(cfg).prefix
+    except Exception as e:
+        _log(f"{POINTER_FILENAME} read failed ({cfg.name}): {e}")
+        return ""
+    return prefix.rstrip("/") + "/" if prefix else ""
+
 
-    if not S3_BUCKET:
+def _load_shard(cfg: ShardConfig) -> LoadedShard:
+    if not cfg.bucket:
         raise RuntimeError("S3_BUCKET env var missing")
-    if not VECTORS_PREFIX:
+    if not cfg.prefix:
         raise RuntimeError("VECTORS_PREFIX env var missing")
 
-    _s3_download_prefix(S3_BUCKET, VECTORS_PREFIX, CHROMA_LOCAL_DIR)
+    # Versioned store: only the version current.json names (always re-read when loading)
+    published = _published(cfg, max_age=0)
+    prefix = published.prefix
+    cfg = replace(cfg, local_dir=versioned_local_dir(cfg.local_dir, published.version))
+
+    # The chunk text data file stays in S3: texts of the final contexts are range-read (see _hydrate_texts)
+    _s3_download_prefix(
+        cfg.bucket, prefix, cfg.local_dir,
+        exclude=(TEXT_DATA_GLOB, f"{MANIFEST_FILES_DIRNAME}/", f"{VERSIONS_DIRNAME}/", POINTER_FILENAME),
+    )
 
     try:
         import chromadb  # type: ignore
@@ -470,20 +798,129 @@ def _ensure_chroma():
     except Exception as e:
         raise RuntimeError(f"chromadb not installed in this Lambda image. Import error: {e}") from e
 
-    _chroma_client = chromadb.PersistentClient(
-        path=CHROMA_LOCAL_DIR,
+    client = chromadb.PersistentClient(
+        path=cfg.local_dir,
         settings=Settings(anonymized_telemetry=False, allow_reset=False),
     )
 
-    _chroma_collection = _chroma_client.get_or_create_collection(CHROMA_COLLECTION)
-    _ = _chroma_collection.count()
-    return _chroma_collection
+    collection = client.get_or_create_collection(cfg.collection)
+    count = collection.count()
+
+    manifest = load_local_manifest(cfg.local_dir)
+    search_ef = RAG_HNSW_SEARCH_EF or search_ef_from_manifest(manifest)
+    if search_ef and not apply_search_ef(client, collection, search_ef):
+        search_ef = None
+
+    # parents.json is only present for hierarchical (parent/child) builds
+    parents = load_parents(cfg.local_dir)
+
+    # chunks.idx.json is only present when texts are stored outside Chroma (CHUNK_TEXT_STORE=external)
+    texts = load_text_index(cfg.local_dir, prefix)
+
+    # vectors.q.npy is only present for VECTOR_QUANT builds
+    quant = load_quantized(cfg.local_dir) if RAG_QUANT_SEARCH else None
+    built_dims = int(manifest.get("embed_dimensions") or 0)
+    if built_dims != EMBED_DIMENSIONS:
+        _log(f"WARN: shard {cfg.name} built with embed_dimensions={built_dims or 'default'}, EMBED_DIMENSIONS={EMBED_DIMENSIONS or 'default'}")
+
+    # Delta segments listed in the manifest (downloaded with the prefix under segments/<id>/)
+    segments = []
+    seg_tables = []
+    for entry in manifest_segments(manifest):
+        seg_dir = os.path.join(cfg.local_dir, str(entry.get("prefix") or f"segments/{entry['id']}/"))
+        segments.append(load_segment(seg_dir, entry))
+        seg_tables.append(load_document_table(seg_dir))
+    base_hidden = link_tombstones(segments)
+    for seg in segments:
+        parents = {**parents, **seg.parents}
+
+    # documents.json + centroids.npy (written by build_chroma.py)
+    try:
+        doc_table = merge_document_tables(
+            [load_document_table(cfg.local_dir)] + seg_tables, [set()] + [seg.tombstones for seg in segments]
+        )
+    except Exception as e:
+        _log(f"Document table skipped ({cfg.name}): {e}")
+        doc_table = None
+
+    _log(
+        f"Shard loaded: {cfg.name} version={published.version or 'in-place'} collection={cfg.collection} count={count} "
+        f"parents={len(parents)} docs={len(doc_table.keys) if doc_table else 0} search_ef={search_ef or 'default'} "
+        f"segments={len(segments)} tombstoned={len(base_hidden)} external_texts={len(texts) if texts else 0} "
+        f"quant={f'{quant.kind}/{len(quant)}' if quant else 'off'}"
+    )
+    return LoadedShard(
+        config=cfg,
+        client=client,
+        collection=collection,
+        parents=parents,
+        doc_table=doc_table,
+        manifest=manifest,
+        search_ef=search_ef,
+        segments=segments,
+        base_hidden=base_hidden,
+        texts=texts,
+        quant=quant,
+        count=count,
+        version=published.version,
+    )
 
 
-def _embed_text(text: str) -> List[float]:
+def _ensure_shard(cfg: ShardConfig) -> LoadedShard:
+    """The shard, acquired from the cache: pass it to _shard_cache.release() when done."""
+    global _shard_cache
+    if _shard_cache is None:
+        _shard_cache = ShardCache(_load_shard, budget_bytes=RAG_SHARD_CACHE_MB * 1024 * 1024)
+    shard = _shard_cache.get(cfg)
+    if RAG_VERSION_CHECK_SEC <= 0:
+        return shard
+    # A failed switch keeps serving the loaded version and is retried after the next check interval
+    if time.time() - _reload_failed_at.get(cfg.name, 0.0) < RAG_VERSION_CHECK_SEC:
+        return shard
+    try:
+        live = _published(cfg)
+        if live.version == shard.version:
+            return shard
+        _log(f"Shard {cfg.name}: published version {shard.version or 'in-place'} -> {live.version or 'in-place'}, reloading")
+        fresh = _shard_cache.reload(cfg, stale=shard)
+        _shard_cache.release(shard)
+        return fresh
+    except Exception as e:
+        _reload_failed_at[cfg.name] = time.time()
+        _log(f"Shard {cfg.name}: version switch failed, serving {shard.version or 'in-place'}: {e}")
+        return shard
+
+
+def _ensure_chroma():
+    """Collection of the first configured shard (the only one unless RAG_SHARDS is set)."""
+    shard = _ensure_shard(_get_shard_configs()[0])
+    _shard_cache.release(shard)
+    return shard.collection
+
+
+def _embed_texts(texts: List[str]) -> List[List[float]]:
     client = _ensure_openai_sdk()
-    emb = client.embeddings.create(model=EMBED_MODEL, input=[text])
-    return emb.data[0].embedding
+    t0 = time.perf_counter()
+    emb = hedged_call(
+        get_policy("embeddings", default_delay_ms=800),
+        lambda: client.embeddings.create(
+            model=EMBED_MODEL,
+            input=texts,
+            timeout=deadline.timeout(20, "embeddings"),
+            **({"dimensions": EMBED_DIMENSIONS} if EMBED_DIMENSIONS else {}),
+        ),
+    )
+    usage.record("embeddings", EMBED_MODEL, getattr(emb, "usage", None), (time.perf_counter() - t0) * 1000)
+    return [d.embedding for d in sorted(emb.data, key=lambda d: d.index)]
+
+
+def _embed_text(text: str) -> List[float]:
+    global _embed_batcher
+    if _embed_batcher is None:
+        _embed_batcher = EmbeddingBatcher(
+            _embed_texts, max_batch=RAG_EMBED_BATCH_MAX, max_wait_ms=RAG_EMBED_BATCH_WAIT_MS
+        )
+    return _embed_batcher.embed(text)
 
 
 def _response_text_from_openai_response(resp: Any) -> str:
@@ -511,48 +948,202 @@ def _response_text_from_openai_response(resp: Any) -> str:
     return (text or "").strip()
 
 
-def _retrieve_chunks(question: str, top_k: int) -> List[Dict[str, Any]]:
-    col = _ensure_chroma()
-    q_emb = _embed_text(question)
-
-    res = col.query(
-        query_embeddings=[q_emb],
-        n_results=top_k,
-        include=["documents", "metadatas", "distances"],
-    )
+def _query_shard(
+    shard: LoadedShard, q_emb: List[float], top_k: int, overrides: Dict[str, Any] | None = None
+) -> List[Dict[str, Any]]:
+    cfg = shard.config
+    overrides = overrides or {}
+    fanout = max(1, overrides.get("child_fanout", RAG_CHILD_FANOUT))
+    route_top_m = overrides.get("route_top_m", RAG_ROUTE_TOP_M)
+
+    # Child chunks are small and several can share a parent: over-fetch, then group
+    n_results = top_k * fanout if shard.parents else top_k
+
+    query_kwargs: Dict[str, Any] = {}
+    route_filter = None
+    query_base = True
+    table = shard.doc_table
+    if table is not None and route_top_m > 0 and len(table.keys) > max(RAG_ROUTE_MIN_DOCS, route_top_m):
+        # Routed keys are all live; a runbook re-indexed by a segment is searched there, not in the base
+        routed = route_documents(table, q_emb, route_top_m)
+        route_filter = routing_where(table, routed)
+        base_keys = [k for k in routed if k not in shard.base_hidden]
+        query_base = bool(base_keys)
+        if query_base:
+            query_kwargs["where"] = routing_where(table, base_keys)
+    elif shard.base_hidden:
+        # Runbooks changed/removed by delta segments: hide their stale base vectors
+        query_kwargs["where"] = {"s3_key": {"$nin": sorted(shard.base_hidden)}}
+
+    include = ["metadatas", "distances"] if shard.texts is not None else ["documents", "metadatas", "distances"]
+    if not query_base:
+        res: Dict[str, Any] = {}
+    elif shard.quant is not None:
+        res = _quant_query(shard, q_emb, n_results, query_kwargs.get("where"), include)
+    else:
+        res = shard.collection.query(
+            query_embeddings=[q_emb],
+            n_results=n_results,
+            include=include,
+            **query_kwargs,
+        )
 
-    docs = (res.get("documents") or [[]])[0]
+    ids = (res.get("ids") or [[]])[0]
     metas = (res.get("metadatas") or [[]])[0]
     dists = (res.get("distances") or [[]])[0]
+    docs = (res.get("documents") or [[]])[0] or [None] * len(ids)
 
     out: List[Dict[str, Any]] = []
-    for doc, meta, dist in zip(docs, metas, dists):
-        out.append({"text": doc, "meta": meta, "distance": dist})
+    for cid, doc, meta, dist in zip(ids, docs, metas, dists):
+        # External text stores leave doc empty; _hydrate_texts fills the final contexts only
+        out.append({"id": cid, "text": doc or "", "meta": meta, "distance": dist, "shard": cfg.name})
+
+    if shard.segments:
+        space = str((shard.collection.metadata or {}).get("hnsw:space", "l2"))
+        layers = [out]
+        for seg in shard.segments:
+            hits = query_segment(seg, q_emb, n_results, space=space, where=route_filter)
+            layers.append([{**h, "shard": cfg.name} for h in hits])
+        out = merge_by_distance(layers, n_results)
+
+    if shard.parents:
+        return group_hits_by_parent(out, shard.parents, limit=top_k)
     return out
 
 
-def _answer_with_llm(question: str, contexts: List[Dict[str, Any]]) -> str:
+def _quant_query(
+    shard: LoadedShard, q_emb: List[float], n_results: int, where: Dict[str, Any] | None, include: List[str]
+) -> Dict[str, Any]:
+    """Quantized first pass + exact re-score; returns the collection.query result shape."""
+    import numpy as np
+
+    quant = shard.quant
+    oversample = RAG_QUANT_OVERSAMPLE or DEFAULT_OVERSAMPLE.get(quant.kind, 4)
+    t0 = time.perf_counter()
+    candidates = quant.shortlist(q_emb, n_results * oversample, where=where)
+    histogram("rag.quant.scan_ms").observe((time.perf_counter() - t0) * 1000.0)
+    if not candidates:
+        return {"ids": [[]], "metadatas": [[]], "documents": [[]], "distances": [[]]}
+
+    got = shard.collection.get(ids=candidates, include=["embeddings"] + [f for f in include if f != "distances"])
+    got_ids = list(got.get("ids") or [])
+    space = str((shard.collection.metadata or {}).get("hnsw:space", "l2"))
+    dist = distances(np.asarray(got.get("embeddings"), dtype=np.float32), q_emb, space)
+    order = np.argsort(dist)[:n_results]
+
+    metas = got.get("metadatas") or [None] * len(got_ids)
+    docs = got.get("documents") or [None] * len(got_ids)
+    return {
+        "ids": [[got_ids[i] for i in order]],
+        "metadatas": [[metas[i] for i in order]],
+        "documents": [[docs[i] for i in order]],
+        "distances": [[float(dist[i]) for i in order]],
+    }
+
+
+def _retrieve_chunks(
+    question: str,
+    top_k: int,
+    shards: List[str] | None = None,
+    overrides: Dict[str, Any] | None = None,
+) -> List[Dict[str, Any]]:
+    global _shard_pool
+    targets = select_shards(_get_shard_configs(), shards)
+    q_emb = _embed_text(question)
+
+    if _shard_pool is None and len(targets) > 1:
+        _shard_pool = ThreadPoolExecutor(max_workers=RAG_SHARD_WORKERS, thread_name_prefix="rag-shard")
+
+    # Shards stay acquired until their texts are hydrated, so eviction/reload cannot close them mid-request
+    held: Dict[str, LoadedShard] = {}
+
+    def _search(cfg: ShardConfig) -> List[Dict[str, Any]]:
+        shard = held[cfg.name] = _ensure_shard(cfg)
+        return _query_shard(shard, q_emb, top_k, overrides)
+
+    try:
+        hit_lists = fan_out(_shard_pool, targets, deadline.run_in_context(_search))
+        return _hydrate_texts(merge_by_distance(hit_lists, top_k), held)
+    finally:
+        for shard in held.values():
+            _shard_cache.release(shard)
+
+
+def _s3_range_get(bucket: str, key: str, start: int, end: int) -> bytes:
+    resp = _s3_client().get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+    return resp["Body"].read()
+
+
+def _hydrate_texts(hits: List[Dict[str, Any]], shards: Dict[str, LoadedShard]) -> List[Dict[str, Any]]:
+    """
+    Fill in texts kept in the external chunk store, for the selected hits only. Ids the
+    offsets table does not know (chunks indexed inline) are read from Chroma's documents.
+    """
+    missing: Dict[str, List[Dict[str, Any]]] = {}
+    for h in hits:
+        if not h.get("text") and h.get("id"):
+            missing.setdefault(h.get("shard") or "", []).append(h)
+    for name, group in missing.items():
+        shard = shards.get(name)
+        if shard is None or shard.texts is None:
+            continue
+        bucket = shard.config.bucket
+        texts = shard.texts.fetch(
+            [h["id"] for h in group], lambda key, a, b: _s3_range_get(bucket, key, a, b)
+        )
+        inline = [h["id"] for h in group if h["id"] not in texts]
+        if inline:
+            got = shard.collection.get(ids=inline, include=["documents"])
+            texts.update(zip(got.get("ids") or [], got.get("documents") or []))
+        for h in group:
+            h["text"] = texts.get(h["id"]) or ""
+    return hits
+
+
+def _answer_with_llm(
+    question: str,
+    contexts: List[Dict[str, Any]],
+    overrides: Dict[str, Any] | None = None,
+    stats: Dict[str, Any] | None = None,
+) -> str:
     client = _ensure_openai_sdk()
+    overrides = overrides or {}
 
     ctx_lines: List[str] = []
     for i, c in enumerate(contexts, start=1):
         meta = c.get("meta") or {}
         src = meta.get("file") or meta.get("s3_key") or "runbook"
         chunk = meta.get("chunk")
-        label = f"[{i}] {src}" + (f" (chunk {chunk})" if chunk is not None else "")
+        section = meta.get("section")
+        if section is not None:
+            label = f"[{i}] {src} (section {section})"
+        elif meta.get("page_start"):
+            # Structured chunks (CHUNK_MODE=structured) carry their page range; the heading is in the text
+            pages = f"p. {meta['page_start']}" + (f"-{meta['page_end']}" if meta.get("page_end") != meta["page_start"] else "")
+            label = f"[{i}] {src} ({pages})"
+        else:
+            label = f"[{i}] {src}" + (f" (chunk {chunk})" if chunk is not None else "")
         ctx_lines.append(f"{label}\n{c.get('text','')}\n")
 
-    context_block = "\n".join(ctx_lines)[:14000]
+    context_block = "\n".join(ctx_lines)[: overrides.get("context_chars", 14000)]
+
+    if overrides.get("prompt_format") == "concise":
+        answer_format = """Format:
+- One-line summary
+- Numbered steps only (commands OK), max 6
+- Cite sources like [1], [2]"""
+    else:
+        answer_format = """Format:
+- 1–2 sentence summary
+- Steps (commands/snippets OK)
+- "If still failing" checks
+- Cite sources like [1], [2]"""
 
     prompt = f"""
 You are an SRE runbook assistant. Answer ONLY using the provided excerpts.
 If the excerpts don’t contain the answer, say what is missing and what to check next.
 
-Format:
-- 1–2 sentence summary
-- Steps (commands/snippets OK)
-- "If still failing" checks
-- Cite sources like [1], [2]
+{answer_format}
 
 Question:
 {question}
@@ -561,11 +1152,27 @@ Excerpts:
 {context_block}
 """.strip()
 
-    resp = client.responses.create(
-        model=OPENAI_MODEL,
-        input=prompt,
-        max_output_tokens=700,
+    model = overrides.get("model", OPENAI_MODEL)
+    max_output_tokens = overrides.get("max_output_tokens", 700)
+    usage.reserve(usage.estimate_tokens(prompt) + max_output_tokens, "answer generation")
+
+    t0 = time.perf_counter()
+    resp = hedged_call(
+        get_policy("answer", default_delay_ms=8000, max_delay_ms=15000),
+        lambda: client.responses.create(
+            model=model,
+            input=prompt,
+            max_output_tokens=max_output_tokens,
+            timeout=deadline.timeout(25, "answer generation"),
+        ),
     )
+    call = usage.record("answer", model, getattr(resp, "usage", None), (time.perf_counter() - t0) * 1000)
+
+    if stats is not None:
+        stats["model"] = model
+        stats["input_tokens"] = call["input_tokens"]
+        stats["output_tokens"] = call["output_tokens"]
+        stats["cached_tokens"] = call["cached_tokens"]
 
     out_text = _response_text_from_openai_response(resp)
     return out_text or "No answer returned."
@@ -598,7 +1205,11 @@ def _handle_get_routes(event: dict, method: str, path: str) -> dict:
                 "GET /news/latest",
                 "GET /_routes",
                 "GET /_debug/news",
+                "GET /_debug/metrics",
                 "POST /agent/run",
+                "GET /runbooks/suggest?prefix=",
+                "GET /runbooks/{file}/related",
+                "GET /runbooks/index/stats",
                 "POST /runbooks/ask",
                 "POST /mcp/run",
             ],
@@ -717,39 +1328,283 @@ def _safe_meta(meta: Any) -> Dict[str, Any]:
 
 def _safe_source_from_context(c: Dict[str, Any]) -> Dict[str, Any]:
     meta = _safe_meta(c.get("meta"))
-    return {"file": meta.get("file"), "s3_key": meta.get("s3_key"), "chunk": meta.get("chunk")}
+    src = {"file": meta.get("file"), "s3_key": meta.get("s3_key"), "chunk": meta.get("chunk")}
+    if meta.get("parent_id"):
+        src["section"] = meta.get("section")
+        src["parent_id"] = meta.get("parent_id")
+    if meta.get("page_start"):
+        src["pages"] = [meta.get("page_start"), meta.get("page_end") or meta.get("page_start")]
+        if meta.get("heading"):
+            src["heading"] = meta.get("heading")
+    if len(_get_shard_configs()) > 1:
+        src["shard"] = c.get("shard")
+    return src
+
+
+def _handle_get_runbooks_suggest(event: dict) -> dict:
+    params = get_query_params(event)
+    prefix = (params.get("prefix") or params.get("q") or "").strip()[:200]
+    try:
+        limit = int(params.get("limit") or 8)
+    except ValueError:
+        limit = 8
+    limit = max(1, min(20, limit))
+
+    idx = _get_suggest_index()
+    t0 = time.perf_counter()
+    suggestions = idx.suggest(prefix, limit)
+    took_ms = round((time.perf_counter() - t0) * 1000, 2)
+    return json_response(event, 200, {"prefix": prefix, "suggestions": suggestions, "took_ms": took_ms})
+
+
+def _handle_get_runbooks_related(event: dict, path: str) -> dict:
+    name = urllib.parse.unquote(path.split("/runbooks/", 1)[1][: -len("/related")]).strip("/")
+    params = get_query_params(event)
+    try:
+        limit = int(params.get("limit") or 5)
+    except ValueError:
+        limit = 5
+    limit = max(1, min(20, limit))
+
+    graph = _get_related_graph()
+    key = graph.resolve(name)
+    if key is None:
+        return json_response(event, 404, {"error": {"code": "RUNBOOK_NOT_FOUND", "message": f"No runbook named {name}"}})
+    return json_response(event, 200, {"file": name, "s3_key": key, "related": graph.for_key(key, limit)})
+
+
+def _published_manifest(cfg: ShardConfig) -> dict:
+    hit = _manifest_cache.get(cfg.name)
+    if hit is not None and time.time() - hit[0] < INDEX_STATS_CACHE_SEC:
+        return hit[1]
+    prefix = _published_prefix(cfg)
+    manifest = _s3_get_json(cfg.bucket, prefix + "manifest.json") if cfg.bucket and prefix else {}
+    _manifest_cache[cfg.name] = (time.time(), manifest)
+    _manifest_files_cache.pop(cfg.name, None)
+    return manifest
+
+
+def _published_files(cfg: ShardConfig, manifest: dict) -> Dict[str, Any]:
+    """The manifest's files map; sharded ones are fetched once per manifest refresh."""
+    if isinstance(manifest.get("files"), dict):
+        return manifest["files"]
+    hit = _manifest_files_cache.get(cfg.name)
+    if hit is not None:
+        return hit
+    files: Dict[str, Any] = {}
+    keys = manifest_file_shard_keys(manifest, _published_prefix(cfg))
+    if keys:
+        with ThreadPoolExecutor(max_workers=min(8, len(keys)), thread_name_prefix="manifest-files") as pool:
+            for part in pool.map(lambda k: _s3_get_json(cfg.bucket, k), keys):
+                files.update(part or {})
+    _manifest_files_cache[cfg.name] = files
+    return files
+
+
+def _shard_index_stats(cfg: ShardConfig, include_files: bool) -> Dict[str, Any]:
+    manifest = _published_manifest(cfg)
+    stats = manifest.get("stats") if isinstance(manifest.get("stats"), dict) else {}
+    out: Dict[str, Any] = {
+        "shard": cfg.name,
+        "published": bool(manifest),
+        "collection": manifest.get("collection") or cfg.collection,
+        "embed_model": manifest.get("embed_model"),
+        "chunking": {
+            k: manifest.get(k)
+            for k in (
+                "chunk_mode",
+                "chunk_size",
+                "chunk_overlap",
+                "chunk_max_tokens",
+                "parent_chunk_size",
+                "child_chunk_size",
+                "child_chunk_overlap",
+            )
+            if manifest.get(k) is not None
+        },
+        "version": stats.get("version"),
+        "published_version": manifest.get("version"),
+        "updated_at": manifest.get("updated_at"),
+        "build_seconds": stats.get("build_seconds"),
+        "vectors": stats.get("vectors"),
+        "dim": stats.get("dim"),
+        "bytes": stats.get("bytes"),
+        "runbooks": manifest_file_count(manifest),
+        "segments": len(manifest_segments(manifest)),
+    }
+    if include_files:
+        files = _published_files(cfg, manifest)
+        out["files"] = {k: (v or {}).get("chunks") for k, v in sorted(files.items())}
+
+    # Never triggers a load: only reports what this container already holds
+    loaded = _shard_cache.peek(cfg.name) if _shard_cache is not None else None
+    out["container"] = {"loaded": loaded is not None}
+    if loaded is not None:
+        out["container"].update(
+            {
+                "load_ms": loaded.load_ms,
+                "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(loaded.loaded_at)),
+                "count": loaded.count,
+                "size_bytes": loaded.size_bytes,
+                "version": loaded.version,
+                "stale": (
+                    loaded.version != manifest.get("version")
+                    if manifest.get("version") or loaded.version
+                    else bool(stats.get("version")) and (loaded.manifest.get("stats") or {}).get("version") != stats.get("version")
+                ),
+            }
+        )
+    return out
+
+
+def _handle_get_index_stats(event: dict) -> dict:
+    params = get_query_params(event)
+    include_files = (params.get("files") or "1").lower() not in ("0", "false", "no")
+    shards = [_shard_index_stats(cfg, include_files) for cfg in _get_shard_configs()]
+    return json_response(event, 200, {"ok": True, "shards": shards})
 
 
 def _handle_post_runbooks_ask(event: dict) -> dict:
     req = get_body_json(event)
     question = (req.get("question") or "").strip()
     top_k = int(req.get("top_k") or 5)
+    shards = req.get("shards") if isinstance(req.get("shards"), list) else None
 
     if not question:
         return json_response(event, 400, {"error": {"code": "MISSING_QUESTION", "message": "question is required"}})
     if top_k < 1 or top_k > 10:
         top_k = 5
 
-    contexts = _retrieve_chunks(question, top_k=top_k)
-    answer = _answer_with_llm(question, contexts)
+    # Deterministic variant per client (body client_id if the caller has one, else API key / IP)
+    experiments = _load_experiments()
+    assigned = assign_all(experiments, str(req.get("client_id") or _get_rate_limiter().client_key(event))) if experiments else {}
+    overrides = merged_overrides(assigned)
+    top_k = max(1, min(10, overrides.get("top_k", top_k)))
+
+    t0 = time.time()
+    contexts = _retrieve_chunks(question, top_k=top_k, shards=shards, overrides=overrides)
+    t1 = time.time()
+    llm_stats: Dict[str, Any] = {}
+    answer = _answer_with_llm(question, contexts, overrides=overrides, stats=llm_stats)
+    t2 = time.time()
 
     sources = [_safe_source_from_context(c) for c in contexts]
+    if sources and RAG_RELATED_PER_SOURCE > 0:
+        try:
+            graph = _get_related_graph()
+            for src in sources:
+                if src.get("s3_key"):
+                    src["related"] = graph.for_key(src["s3_key"], RAG_RELATED_PER_SOURCE)
+        except Exception as e:
+            _log(f"Related runbooks skipped: {e}")
+    if contexts and _suggest_index is not None:
+        # Only answered questions count towards "popular" suggestions
+        _suggest_index.record_question(question)
+
+    body: Dict[str, Any] = {
+        "question": question,
+        "top_k": top_k,
+        "sources": sources,
+        "answer": answer,
+    }
+    if assigned:
+        variants = {name: v.name for name, v in assigned.items()}
+        body["experiments"] = variants
+        log_exposure(
+            {
+                "route": "/runbooks/ask",
+                "variants": variants,
+                "overrides": overrides,
+                "top_k": top_k,
+                "retrieve_ms": int((t1 - t0) * 1000),
+                "answer_ms": int((t2 - t1) * 1000),
+                "total_ms": int((t2 - t0) * 1000),
+                "distances": [c.get("distance") for c in contexts],
+                **llm_stats,
+            }
+        )
 
-    return json_response(
-        event,
-        200,
-        {
-            "question": question,
-            "top_k": top_k,
-            "sources": sources,
-            "answer": answer,
-        },
-    )
+    return json_response(event, 200, body)
 
 
 # ---------------- Lambda entry ----------------
 
+def _deadline_response(event: dict, message: str) -> dict:
+    return json_response(event, 504, {"error": {"code": "DEADLINE_EXCEEDED", "message": message}})
+
+
 def lambda_handler(event: dict, context: Any) -> dict:
+    budget = deadline.start(context)
+    if budget is None:
+        return _dispatch(event)
+
+    # Run the request on a worker thread so we can still answer before the platform kills us
+    fut: Future = Future()
+
+    def _run() -> None:
+        try:
+            fut.set_result(_dispatch(event))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=deadline.run_in_context(_run), name="request", daemon=True).start()
+    wait_sec = max(0.0, (context.get_remaining_time_in_millis() - WATCHDOG_MARGIN_MS) / 1000.0)
+    try:
+        return fut.result(timeout=wait_sec)
+    except FutureTimeout:
+        _log(f"WATCHDOG: request still running after {wait_sec:.1f}s; returning 504")
+        deadline.abandon()
+        return _deadline_response(event, "Request did not finish within the time limit")
+
+
+def _wants_usage(event: dict) -> bool:
+    if LLM_USAGE_IN_RESPONSE:
+        return True
+    headers = {str(k).lower(): str(v) for k, v in (event.get("headers") or {}).items()}
+    flag = get_query_params(event).get("usage") or headers.get("x-include-usage") or ""
+    return flag.strip().lower() in ("1", "true", "yes")
+
+
+def _with_usage(resp: dict, summary: Dict[str, Any]) -> dict:
+    try:
+        body = json.loads(resp.get("body") or "{}")
+    except ValueError:
+        return resp
+    if isinstance(body, dict):
+        body["usage"] = summary
+        resp = {**resp, "body": json.dumps(body, default=str)}
+    return resp
+
+
+def _dispatch(event: dict) -> dict:
+    usage.begin(_normalize_path(get_path(event)))
+    try:
+        resp = _route(event)
+    finally:
+        summary = usage.finish()
+    if summary and _wants_usage(event):
+        resp = _with_usage(resp, summary)
+    return resp
+
+
+# POST routes behind run_idempotent
+IDEMPOTENT_ROUTES = ("/agent/run", "/runbooks/ask", "/mcp/run")
+
+
+def _rate_limited(event: dict, path: str) -> Any:
+    """429 response if the client's bucket for this route is empty, else None."""
+    retry_after = _get_rate_limiter().check(event, path)
+    if retry_after is None:
+        return None
+    return json_response(
+        event,
+        429,
+        {"error": {"code": "RATE_LIMITED", "message": f"Too many requests; retry in {retry_after}s"}},
+        {"Retry-After": retry_after},
+    )
+
+
+def _route(event: dict) -> dict:
     try:
         method = get_method(event)
         path = _normalize_path(get_path(event))
@@ -759,6 +1614,13 @@ def lambda_handler(event: dict, context: Any) -> dict:
         if method == "OPTIONS":
             return json_response(event, 200, {"ok": True})
 
+        # Idempotent POSTs are checked once their key is claimed, so replays are never throttled
+        admit = lambda: _rate_limited(event, path)  # noqa: E731
+        if not (method == "POST" and any(path == r or path.endswith(r) for r in IDEMPOTENT_ROUTES)):
+            throttled = admit()
+            if throttled is not None:
+                return throttled
+
         if method == "GET" and (path == "/_routes" or path.endswith("/_routes")):
             return _handle_get_routes(event, method, path)
 
@@ -771,26 +1633,55 @@ def lambda_handler(event: dict, context: Any) -> dict:
         if method == "GET" and (path == "/_debug/news" or path.endswith("/_debug/news")):
             return handle_get_debug_news(event)
 
+        if method == "GET" and (path == "/_debug/metrics" or path.endswith("/_debug/metrics")):
+            return json_response(event, 200, {"ok": True, **snapshot_all(), "llm_usage": usage.rolling_snapshot()})
+
         if method == "GET" and (path == "/news/latest" or path.endswith("/news/latest")):
             return handle_get_news_latest(event)
 
         if method == "POST" and (path == "/agent/run" or path.endswith("/agent/run")):
-            return _handle_post_agent_run(event)
+            return run_idempotent(
+                event, _get_idempotency_store(), "agent/run", lambda: _handle_post_agent_run(event), admit=admit
+            )
+
+        if method == "GET" and (path == "/runbooks/suggest" or path.endswith("/runbooks/suggest")):
+            return _handle_get_runbooks_suggest(event)
+
+        if method == "GET" and (path == "/runbooks/index/stats" or path.endswith("/runbooks/index/stats")):
+            return _handle_get_index_stats(event)
+
+        if method == "GET" and "/runbooks/" in path and path.endswith("/related"):
+            return _handle_get_runbooks_related(event, path)
 
         if method == "POST" and (path == "/runbooks/ask" or path.endswith("/runbooks/ask")):
-            return _handle_post_runbooks_ask(event)
+            return run_idempotent(
+                event, _get_idempotency_store(), "runbooks/ask", lambda: _handle_post_runbooks_ask(event), admit=admit
+            )
 
         if method == "POST" and (path == "/mcp/run" or path.endswith("/mcp/run")):
-            return handle_post_mcp_run(event)
+            return run_idempotent(
+                event, _get_idempotency_store(), "mcp/run", lambda: handle_post_mcp_run(event), admit=admit
+            )
 
         return json_response(event, 404, {"error": {"code": "NOT_FOUND", "message": f"Route not found: {path}"}})
 
+    except deadline.DeadlineExceeded as e:
+        _log(f"DEADLINE: {e}")
+        return _deadline_response(event, str(e))
+
+    except usage.TokenBudgetExceeded as e:
+        _log(f"TOKEN CEILING: {e}")
+        return json_response(event, 413, {"error": {"code": "TOKEN_BUDGET_EXCEEDED", "message": str(e)}})
+
     except ValueError as e:
         print("BAD_REQUEST EXCEPTION:\n" + traceback.format_exc())
         return json_response(event, 400, {"error": {"code": "BAD_REQUEST", "message": str(e)}})
         
     except Exception as e:
         print("UNHANDLED EXCEPTION:\n" + traceback.format_exc())
+        if deadline.expired():
+            # Upstream socket/SDK timeout caused by the shortened deadline
+            return _deadline_response(event, str(e))
         return json_response(event, 500, {"error": {"code": "UNHANDLED", "message": str(e)}})
 
 
@@ -0,0 +1,156 @@
+# core/deadline.py
+#
+# Per-request deadline derived from the Lambda context.
+#
+# lambda_handler calls start(context) once; every outbound call then asks for
+# timeout(own_default) = min(own_default, time left - margin) instead of a
+# hard-coded value, so a slow upstream fails inside our 30s budget and we answer
+# with a JSON 504 instead of the platform timeout (HTML error page via CloudFront).
+#
+# The deadline lives in a ContextVar. Worker threads (shard fan-out, hedged
+# attempts) must run with contextvars.copy_context() to see it; see run_in_context().
+#
+# When the watchdog answers 504 the request thread keeps running (threads cannot be
+# killed) into the next warm invocation. abandon() flags the request: from then on its
+# threads fail every timeout()/check() and every call on a guard_client() boto3 client,
+# and run_idempotent skips its store writes, so the abandoned work cannot reach
+# upstreams or write state.
+#
+# Work shared by several requests (the embedding micro-batcher) runs under join():
+# until the latest member deadline, and abandoned only once every member is.
+from __future__ import annotations
+
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Outbound calls must give up this long before the Lambda timeout (time to build the error response)
+DEADLINE_MARGIN_MS = int(os.environ.get("DEADLINE_MARGIN_MS", "1500"))
+# Never hand out a socket timeout shorter than this (urllib treats 0 as non-blocking)
+MIN_CALL_TIMEOUT_SEC = 0.2
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+# One Event per request, shared by every thread that runs in a copy of its context (see join())
+_abandoned: contextvars.ContextVar[Any] = contextvars.ContextVar(
+    "request_abandoned", default=None
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when there is no time left for another outbound call."""
+
+
+def start(context: Any, margin_ms: int = DEADLINE_MARGIN_MS) -> Optional[float]:
+    """Set the deadline for the current request; returns seconds available (None without a Lambda context)."""
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if not callable(get_remaining):
+        _deadline.set(None)
+        _abandoned.set(None)
+        return None
+    _abandoned.set(threading.Event())
+    budget = max(0.0, (int(get_remaining()) - margin_ms) / 1000.0)
+    _deadline.set(time.monotonic() + budget)
+    return budget
+
+
+def set_budget(seconds: Optional[float]) -> None:
+    _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for outbound work, or None if no deadline is set (local runs)."""
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+
+class _AllAbandoned:
+    """Event-like view over several requests' abandon events: set once all of them are."""
+
+    def __init__(self, events: List[threading.Event]):
+        self._events = events
+
+    def is_set(self) -> bool:
+        return all(e.is_set() for e in self._events)
+
+    def set(self) -> None:
+        for e in self._events:
+            e.set()
+
+
+def current() -> Tuple[Optional[float], Any]:
+    """This request's (deadline, abandon event), to hand to join() for shared work."""
+    return _deadline.get(), _abandoned.get()
+
+
+def join(members: List[Tuple[Optional[float], Any]]) -> None:
+    """
+    Set the current context (run it in a copy) up for work done on behalf of several requests:
+    it may run until the latest member deadline (none if any member has none) and counts as
+    abandoned once every member is. A member that runs out sooner stops waiting on its own.
+    """
+    deadlines = [d for d, _ in members]
+    _deadline.set(None if not deadlines or any(d is None for d in deadlines) else max(deadlines))
+    events = [e for _, e in members]
+    _abandoned.set(None if not events or any(e is None for e in events) else _AllAbandoned(events))
+
+
+def abandon() -> None:
+    """Mark the current request as answered without it (504 sent); its threads stop at the next call."""
+    ev = _abandoned.get()
+    if ev is not None:
+        ev.set()
+
+
+def abandoned() -> bool:
+    ev = _abandoned.get()
+    return ev is not None and ev.is_set()
+
+
+def expired() -> bool:
+    if abandoned():
+        return True
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(what: str = "request") -> None:
+    if expired():
+        raise DeadlineExceeded(f"Deadline exceeded before {what}")
+
+
+def timeout(default_sec: float, what: str = "upstream call") -> float:
+    """min(default_sec, time left); raises DeadlineExceeded when nothing is left."""
+    if abandoned():
+        raise DeadlineExceeded(f"Request abandoned before {what}")
+    left = remaining()
+    if left is None:
+        return default_sec
+    if left < MIN_CALL_TIMEOUT_SEC:
+        raise DeadlineExceeded(f"Deadline exceeded before {what}")
+    return min(float(default_sec), left)
+
+
+def guard_client(client: Any) -> Any:
+    """Make every API call on a boto3 client fail once the calling request is abandoned."""
+
+    def _before_call(model: Any = None, **_: Any) -> None:
+        if abandoned():
+            raise DeadlineExceeded(f"Request abandoned before {getattr(model, 'name', 'AWS call')}")
+
+    client.meta.events.register("before-call", _before_call)
+    return client
+
+
+def run_in_context(fn: Callable[..., T]) -> Callable[..., T]:
+    """Bind fn to a copy of the caller's context (deadline included) for use on another thread."""
+    ctx = contextvars.copy_context()
+
+    def _bound(*args: Any, **kwargs: Any) -> T:
+        # A Context can only be entered by one thread at a time; fan-out calls _bound concurrently
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return _bound
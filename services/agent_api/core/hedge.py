@@ -0,0 +1,176 @@
+# core/hedge.py
+#
+# Hedged requests for idempotent upstream calls (OpenAI embeddings / short JSON generations).
+#
+# The call starts normally. If it has not finished after the policy's hedge delay
+# (the observed p95 latency of this call type, clamped to [min_delay, max_delay]),
+# a second identical attempt is started and whichever finishes first wins; the
+# loser is ignored (urllib/SDK calls cannot be cancelled mid-flight, it simply
+# runs to completion on a daemon thread).
+#
+# Hedges are capped at max_rate of calls (token budget), so a slow provider
+# cannot double our traffic. Metrics (core.metrics) per policy name:
+#   hedge.<name>.calls / .hedged / .hedge_wins / .primary_wins / .skipped_budget
+#   hedge.<name>.latency_ms (winner latency), hedge.<name>.delay_ms
+#
+# Only an attempt that returns wins. Callers whose fn reports errors as a value
+# (e.g. an {"error": ...} dict) raise FailedAttempt with it instead, so a fast 429/5xx
+# neither beats a slower success nor lands in the latency samples, and unwrap
+# e.result after hedged_call.
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Deque, Dict, Optional, TypeVar
+
+from core.deadline import run_in_context
+from core.metrics import counter, histogram
+
+T = TypeVar("T")
+
+HEDGE_ENABLED = os.environ.get("OPENAI_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on")
+HEDGE_MAX_RATE = float(os.environ.get("OPENAI_HEDGE_MAX_RATE", "0.1"))
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        name: str,
+        *,
+        quantile: float = 0.95,
+        min_delay_ms: float = 50.0,
+        max_delay_ms: float = 8000.0,
+        default_delay_ms: float = 2000.0,
+        max_rate: float = HEDGE_MAX_RATE,
+        min_samples: int = 20,
+        window: int = 200,
+        enabled: bool = HEDGE_ENABLED,
+    ):
+        self.name = name
+        self.quantile = quantile
+        self.min_delay_ms = min_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.default_delay_ms = default_delay_ms
+        self.max_rate = max(0.0, max_rate)
+        self.min_samples = min_samples
+        self.enabled = enabled and self.max_rate > 0
+
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=window)
+        # Each call earns max_rate of a hedge; a hedge spends 1 (burst of up to 10)
+        self._budget = 1.0
+        self._budget_cap = 10.0
+
+        self.calls = counter(f"hedge.{name}.calls")
+        self.hedged = counter(f"hedge.{name}.hedged")
+        self.hedge_wins = counter(f"hedge.{name}.hedge_wins")
+        self.primary_wins = counter(f"hedge.{name}.primary_wins")
+        self.skipped_budget = counter(f"hedge.{name}.skipped_budget")
+        self.latency_ms = histogram(f"hedge.{name}.latency_ms")
+        self.delay_hist = histogram(f"hedge.{name}.delay_ms")
+
+    def delay_ms(self) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return self.default_delay_ms
+        q = samples[min(len(samples) - 1, int(self.quantile * len(samples)))]
+        return max(self.min_delay_ms, min(self.max_delay_ms, q))
+
+    def record(self, latency_ms: float) -> None:
+        with self._lock:
+            self._samples.append(latency_ms)
+        self.latency_ms.observe(latency_ms)
+
+    def earn(self) -> None:
+        with self._lock:
+            self._budget = min(self._budget_cap, self._budget + self.max_rate)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._budget >= 1.0:
+                self._budget -= 1.0
+                return True
+            return False
+
+
+class FailedAttempt(Exception):
+    """An attempt's error result (kept in .result), raised so the attempt cannot win."""
+
+    def __init__(self, result):
+        super().__init__(str(result)[:200])
+        self.result = result
+
+
+_policies: Dict[str, HedgePolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(name: str, **kwargs) -> HedgePolicy:
+    with _policies_lock:
+        p = _policies.get(name)
+        if p is None:
+            p = _policies[name] = HedgePolicy(name, **kwargs)
+        return p
+
+
+def _start(fn: Callable[[], T], label: str) -> "Future[T]":
+    fut: "Future[T]" = Future()
+
+    def _run() -> None:
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn())
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=run_in_context(_run), name=label, daemon=True).start()
+    return fut
+
+
+def hedged_call(policy: HedgePolicy, fn: Callable[[], T]) -> T:
+    """Run fn (must be idempotent) with at most one hedge; returns the first successful result."""
+    policy.calls.inc()
+    policy.earn()
+    started = time.perf_counter()
+
+    if not policy.enabled:
+        result = fn()
+        policy.record((time.perf_counter() - started) * 1000.0)
+        return result
+
+    delay_ms = policy.delay_ms()
+    primary = _start(fn, f"hedge-{policy.name}-primary")
+    done, _ = wait([primary], timeout=delay_ms / 1000.0)
+    if done:
+        return _finish(policy, started, primary, None)
+
+    if not policy.try_spend():
+        policy.skipped_budget.inc()
+        return _finish(policy, started, primary, None)
+
+    policy.hedged.inc()
+    policy.delay_hist.observe(delay_ms)
+    backup = _start(fn, f"hedge-{policy.name}-backup")
+    return _finish(policy, started, primary, backup)
+
+
+def _finish(policy: HedgePolicy, started: float, primary: Future, backup: Optional[Future]):
+    pending = {primary} if backup is None else {primary, backup}
+    first_error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is not None:
+                first_error = first_error or fut.exception()
+                continue
+            policy.record((time.perf_counter() - started) * 1000.0)
+            if backup is not None:
+                (policy.hedge_wins if fut is backup else policy.primary_wins).inc()
+            return fut.result()
+    assert first_error is not None
+    raise first_error
@@ -0,0 +1,312 @@
+# core/idempotency.py
+#
+# Idempotency-Key support for expensive POSTs (/agent/run, /runbooks/ask, /mcp/run).
+#
+# The UI sends one Idempotency-Key per logical request and reuses it when it
+# retries on 502/503/504. The first attempt claims the key; a duplicate either
+# gets the stored response replayed (Idempotent-Replayed: true) or waits for the
+# in-flight attempt. Only non-5xx responses are stored, so a failed attempt can
+# be retried for real.
+#
+# The in-flight claim is only a lease for the time the attempt can still run (the
+# request deadline, else lease_sec): if its container dies, retries can take over
+# once the lease lapses. The full ttl_sec applies from complete() on.
+#
+# Backends:
+#   MemoryIdempotencyStore  per-container (local runs, tests, single warm Lambda)
+#   S3IdempotencyStore      shared across containers; records under <prefix>/<sha256>.json,
+#                           claimed with a conditional PUT (If-None-Match: *, or If-Match on
+#                           the ETag of an expired record), completed/released If-Match the claim
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from core import deadline
+from core.response import json_response
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LEN = 255
+# Claim attempts per request: a key released by a failed attempt is claimed again once more
+MAX_CLAIM_ATTEMPTS = 2
+
+# claim() outcomes
+CLAIMED = "claimed"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+
+
+def get_idempotency_key(event: dict) -> str:
+    headers = event.get("headers") or {}
+    for k, v in headers.items():
+        if str(k).lower() == HEADER.lower():
+            return str(v or "").strip()
+    return ""
+
+
+def request_fingerprint(method: str, path: str, body: str) -> str:
+    return hashlib.sha256(f"{method}\n{path}\n{body or ''}".encode("utf-8")).hexdigest()
+
+
+# Added to the request's remaining time for the claim lease (the deadline margin, clock skew)
+LEASE_SLACK_SEC = 5.0
+
+
+class MemoryIdempotencyStore:
+    def __init__(self, ttl_sec: int = 900, lease_sec: float = 35.0):
+        self.ttl_sec = ttl_sec
+        self.lease_sec = lease_sec
+        self._cond = threading.Condition()
+        self._records: Dict[str, Dict[str, Any]] = {}
+
+    def _live(self, key: str) -> Optional[Dict[str, Any]]:
+        rec = self._records.get(key)
+        if rec is not None and rec["expires_at"] < time.time():
+            self._records.pop(key, None)
+            return None
+        return rec
+
+    def claim(
+        self, key: str, fingerprint: str, lease_sec: Optional[float] = None
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        with self._cond:
+            rec = self._live(key)
+            if rec is None:
+                self._records[key] = {
+                    "status": IN_FLIGHT,
+                    "fingerprint": fingerprint,
+                    "expires_at": time.time() + (self.lease_sec if lease_sec is None else lease_sec),
+                }
+                return CLAIMED, None
+            return rec["status"], dict(rec)
+
+    def complete(self, key: str, response: Dict[str, Any]) -> None:
+        with self._cond:
+            rec = self._records.get(key)
+            if rec is not None:
+                rec.update({"status": DONE, "response": response, "expires_at": time.time() + self.ttl_sec})
+            self._cond.notify_all()
+
+    def release(self, key: str) -> None:
+        with self._cond:
+            self._records.pop(key, None)
+            self._cond.notify_all()
+
+    def wait(self, key: str, timeout_sec: float) -> Optional[Dict[str, Any]]:
+        end = time.monotonic() + timeout_sec
+        with self._cond:
+            while True:
+                rec = self._live(key)
+                if rec is None or rec["status"] == DONE:
+                    return dict(rec) if rec else None
+                left = end - time.monotonic()
+                if left <= 0:
+                    return dict(rec)
+                # Wake up when the claim's lease lapses, too
+                self._cond.wait(max(0.0, min(left, rec["expires_at"] - time.time())))
+
+
+class S3IdempotencyStore:
+    def __init__(self, s3_client_factory: Callable[[], Any], bucket: str, prefix: str, ttl_sec: int = 900,
+                 poll_sec: float = 0.5, lease_sec: float = 35.0):
+        self._s3 = s3_client_factory
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.ttl_sec = ttl_sec
+        self.lease_sec = lease_sec
+        self.poll_sec = poll_sec
+        # ETag of each claim this container holds: complete()/release() only touch their own claim
+        self._lock = threading.Lock()
+        self._claims: Dict[str, str] = {}
+
+    def _object_key(self, key: str) -> str:
+        # The raw key is client-controlled; never use it as an S3 key directly
+        return f"{self.prefix}/{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+    def _read(self, key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """The stored record (expired or not) and its ETag; (None, "") if there is none."""
+        try:
+            obj = self._s3().get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if _error_code(e) in ("NoSuchKey", "404"):
+                return None, ""
+            raise
+        rec = json.loads(obj["Body"].read().decode("utf-8"))
+        return rec, str(obj.get("ETag") or "")
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        rec, _ = self._read(key)
+        if rec is None or float(rec.get("expires_at") or 0) < time.time():
+            return None
+        return rec
+
+    def _put(self, key: str, rec: Dict[str, Any], *, if_absent: bool = False, if_match: str = "") -> Optional[str]:
+        """Write rec; returns its ETag, or None if the condition (if_absent / if_match) failed."""
+        kwargs: Dict[str, Any] = {}
+        if if_absent:
+            kwargs["IfNoneMatch"] = "*"
+        elif if_match:
+            kwargs["IfMatch"] = if_match
+        try:
+            resp = self._s3().put_object(
+                Bucket=self.bucket,
+                Key=self._object_key(key),
+                Body=json.dumps(rec, default=str).encode("utf-8"),
+                ContentType="application/json",
+                **kwargs,
+            )
+            return str((resp or {}).get("ETag") or "")
+        except Exception as e:
+            if kwargs and _error_code(e) in _CONDITION_FAILED:
+                return None
+            raise
+
+    def claim(
+        self, key: str, fingerprint: str, lease_sec: Optional[float] = None
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        lease = self.lease_sec if lease_sec is None else lease_sec
+        rec = {"status": IN_FLIGHT, "fingerprint": fingerprint, "expires_at": time.time() + lease}
+        etag = self._put(key, rec, if_absent=True)
+        if etag is None:
+            existing, existing_etag = self._read(key)
+            if existing is None:
+                # Released between our PUT and GET: claim it as new
+                etag = self._put(key, rec, if_absent=True)
+            elif float(existing.get("expires_at") or 0) < time.time():
+                # Expired record still in the bucket: take it over, unless another container just did
+                etag = self._put(key, rec, if_match=existing_etag)
+            else:
+                return existing.get("status") or IN_FLIGHT, existing
+            if etag is None:
+                return IN_FLIGHT, self._get(key) or {"status": IN_FLIGHT, "fingerprint": fingerprint}
+        with self._lock:
+            self._claims[key] = etag
+        return CLAIMED, None
+
+    def complete(self, key: str, response: Dict[str, Any]) -> None:
+        with self._lock:
+            etag = self._claims.pop(key, "")
+        rec, _ = self._read(key)
+        rec = rec or {}
+        rec.update({"status": DONE, "response": response, "expires_at": time.time() + self.ttl_sec})
+        # Only over our own claim: if its lease lapsed and another attempt took the key, leave theirs
+        if self._put(key, rec, if_match=etag) is None:
+            print("Idempotency complete skipped: the claim was taken over")
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            etag = self._claims.pop(key, "")
+        try:
+            self._s3().delete_object(
+                Bucket=self.bucket, Key=self._object_key(key), **({"IfMatch": etag} if etag else {})
+            )
+        except Exception as e:
+            if _error_code(e) not in _CONDITION_FAILED:
+                print(f"Idempotency release failed: {e}")
+
+    def wait(self, key: str, timeout_sec: float) -> Optional[Dict[str, Any]]:
+        end = time.monotonic() + timeout_sec
+        while True:
+            rec = self._get(key)
+            if rec is None or rec.get("status") == DONE or time.monotonic() >= end:
+                return rec
+            time.sleep(min(self.poll_sec, max(0.0, end - time.monotonic())))
+
+
+_CONDITION_FAILED = ("PreconditionFailed", "412", "ConditionalRequestConflict", "409")
+
+
+def _error_code(e: Exception) -> str:
+    resp = getattr(e, "response", None) or {}
+    return str((resp.get("Error") or {}).get("Code") or "")
+
+
+def _replay(event: dict, stored: Dict[str, Any]) -> dict:
+    resp = json_response(event, int(stored.get("statusCode") or 200), {}, {REPLAY_HEADER: "true"})
+    resp["body"] = stored.get("body") or "{}"
+    return resp
+
+
+def _error(event: dict, status: int, code: str, message: str, extra_headers: Optional[dict] = None) -> dict:
+    return json_response(event, status, {"error": {"code": code, "message": message}}, extra_headers)
+
+
+def run_idempotent(
+    event: dict,
+    store: Any,
+    scope: str,
+    handler: Callable[[], dict],
+    *,
+    max_wait_sec: float = 25.0,
+    admit: Optional[Callable[[], Optional[dict]]] = None,
+) -> dict:
+    """
+    Run handler at most once per (scope, Idempotency-Key) within the store TTL. admit (e.g. the
+    rate limiter) runs only when the handler is about to run: a replay never hits it, and a
+    response it returns is passed through without being stored.
+    """
+    key = get_idempotency_key(event)
+    if not key or store is None:
+        return (admit and admit()) or handler()
+    if len(key) > MAX_KEY_LEN:
+        return _error(event, 400, "INVALID_IDEMPOTENCY_KEY", f"{HEADER} must be at most {MAX_KEY_LEN} characters")
+
+    scoped = f"{scope}:{key}"
+    fingerprint = request_fingerprint("POST", scope, event.get("body") or "")
+
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        left = deadline.remaining()
+        lease = None if left is None else max(0.0, left) + LEASE_SLACK_SEC
+        try:
+            state, rec = store.claim(scoped, fingerprint, lease)
+        except Exception as e:
+            # The store is an optimization; never fail the request because of it
+            print(f"Idempotency store unavailable ({scope}): {e}")
+            return (admit and admit()) or handler()
+        if state == CLAIMED:
+            break
+
+        if (rec or {}).get("fingerprint") != fingerprint:
+            return _error(event, 422, "IDEMPOTENCY_KEY_REUSED", f"{HEADER} was already used for a different request")
+        if state == IN_FLIGHT:
+            rec = store.wait(scoped, max(0.0, min(max_wait_sec, left if left is not None else max_wait_sec)))
+        if rec and rec.get("status") == DONE and rec.get("response"):
+            print(f"Idempotency replay ({scope})")
+            return _replay(event, rec["response"])
+        if rec is not None:
+            break
+        # The original attempt failed and released the key: claim it again
+
+    if state != CLAIMED:
+        return _error(
+            event, 409, "IDEMPOTENCY_IN_FLIGHT", "The original request is still running; retry shortly",
+            {"Retry-After": "2"},
+        )
+
+    rejected = admit() if admit is not None else None
+    if rejected is not None:
+        store.release(scoped)
+        return rejected
+
+    try:
+        resp = handler()
+    except BaseException:
+        if not deadline.abandoned():
+            store.release(scoped)
+        raise
+
+    if deadline.abandoned():
+        # The client already got a 504; leave the claim to its lease
+        return resp
+    try:
+        if int(resp.get("statusCode") or 500) < 500:
+            store.complete(scoped, {"statusCode": resp.get("statusCode"), "body": resp.get("body")})
+        else:
+            store.release(scoped)
+    except Exception as e:
+        print(f"Idempotency store write failed ({scope}): {e}")
+    return resp
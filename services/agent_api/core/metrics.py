@@ -0,0 +1,108 @@
+# core/metrics.py
+#
+# In-process metrics for a warm container: fixed-bucket histograms and counters.
+# Values live for the lifetime of the container; they are exposed on
+# GET /_debug/metrics and can be logged with log_metrics().
+from __future__ import annotations
+
+import bisect
+import json
+import threading
+from typing import Dict, List, Optional, Sequence
+
+# Milliseconds, good enough for API call latencies and short queue waits
+DEFAULT_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_lock = threading.Lock()
+_histograms: Dict[str, "Histogram"] = {}
+_counters: Dict[str, "Counter"] = {}
+
+
+class Histogram:
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_MS_BUCKETS):
+        self.name = name
+        self.bounds: List[float] = sorted(float(b) for b in buckets)
+        self._counts = [0] * (len(self.bounds) + 1)  # last slot is +Inf
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        v = float(value)
+        i = bisect.bisect_left(self.bounds, v)
+        with self._lock:
+            self._counts[i] += 1
+            self._count += 1
+            self._sum += v
+            if v > self._max:
+                self._max = v
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (max for the +Inf bucket)."""
+        with self._lock:
+            if not self._count:
+                return None
+            rank = q * self._count
+            seen = 0
+            for i, c in enumerate(self._counts):
+                seen += c
+                if seen >= rank and c:
+                    return self.bounds[i] if i < len(self.bounds) else self._max
+            return self._max
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            buckets = {f"le_{b:g}": c for b, c in zip(self.bounds, self._counts)}
+            buckets["le_inf"] = self._counts[-1]
+            count, total, vmax = self._count, self._sum, self._max
+        return {
+            "count": count,
+            "mean": round(total / count, 3) if count else None,
+            "max": round(vmax, 3) if count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class Counter:
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1) -> None:
+        with self._lock:
+            self.value += n
+
+
+def histogram(name: str, buckets: Sequence[float] = DEFAULT_MS_BUCKETS) -> Histogram:
+    with _lock:
+        h = _histograms.get(name)
+        if h is None:
+            h = _histograms[name] = Histogram(name, buckets)
+        return h
+
+
+def counter(name: str) -> Counter:
+    with _lock:
+        c = _counters.get(name)
+        if c is None:
+            c = _counters[name] = Counter(name)
+        return c
+
+
+def snapshot_all() -> Dict[str, object]:
+    with _lock:
+        hists = dict(_histograms)
+        counters = dict(_counters)
+    return {
+        "histograms": {name: h.snapshot() for name, h in sorted(hists.items())},
+        "counters": {name: c.value for name, c in sorted(counters.items())},
+    }
+
+
+def log_metrics(prefix: str = "METRICS") -> None:
+    print(f"{prefix} {json.dumps(snapshot_all(), default=str)}")
@@ -0,0 +1,202 @@
+# core/ratelimit.py
+#
+# Token-bucket rate limiting per (client, route).
+#
+# Client key: X-Api-Key (hashed) only when its SHA-256 is in RATE_LIMIT_API_KEYS (an
+# unchecked key would give every request a fresh bucket), else the viewer IP. Everything
+# before the hop CloudFront appends to X-Forwarded-For is client-supplied, so the IP is
+# the trusted_hops-th hop from the right (after dropping the peer API Gateway appends);
+# trusted_hops=0 (API called directly) uses the API Gateway source IP.
+# Limits: RATE_LIMITS JSON overrides DEFAULT_LIMITS, e.g.
+#   {"/runbooks/ask": {"per_min": 30, "burst": 10}, "/mcp/run": {"per_min": 6, "burst": 2}}
+#
+# Backends:
+#   MemoryBucketStore  per container (also the stand-in for tests / local runs)
+#   DynamoBucketStore  shared across containers; one item per bucket, optimistic
+#                      conditional writes, items expire via DynamoDB TTL
+# The limiter fails open: a broken store never blocks traffic.
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from core.metrics import counter
+
+DEFAULT_LIMITS = {
+    "/runbooks/ask": {"per_min": 30, "burst": 10},
+    "/agent/run": {"per_min": 30, "burst": 10},
+    "/mcp/run": {"per_min": 6, "burst": 3},
+}
+
+
+@dataclass(frozen=True)
+class Limit:
+    per_sec: float
+    burst: float
+
+
+def parse_limits(raw: str) -> Dict[str, Limit]:
+    limits = dict(DEFAULT_LIMITS)
+    raw = (raw or "").strip()
+    if raw:
+        try:
+            override = json.loads(raw)
+            if isinstance(override, dict):
+                limits.update(override)
+        except Exception as e:
+            print(f"RATE_LIMITS ignored (invalid JSON): {e}")
+
+    out: Dict[str, Limit] = {}
+    for route, cfg in limits.items():
+        if not isinstance(cfg, dict):
+            continue  # null disables the default for that route
+        per_min = float(cfg.get("per_min") or 0)
+        if per_min <= 0:
+            continue
+        out[route] = Limit(per_sec=per_min / 60.0, burst=max(1.0, float(cfg.get("burst") or 1)))
+    return out
+
+
+def parse_api_keys(raw: str) -> FrozenSet[str]:
+    """RATE_LIMIT_API_KEYS: comma-separated SHA-256 hex digests of the accepted X-Api-Key values."""
+    return frozenset(k.strip().lower() for k in (raw or "").split(",") if k.strip())
+
+
+def client_ip(event: dict, trusted_hops: int = 1) -> str:
+    headers = {str(k).lower(): v for k, v in (event.get("headers") or {}).items()}
+    ctx = event.get("requestContext") or {}
+    source = str((ctx.get("http") or {}).get("sourceIp") or (ctx.get("identity") or {}).get("sourceIp") or "")
+    hops = [h.strip() for h in str(headers.get("x-forwarded-for") or "").split(",") if h.strip()]
+    if hops and hops[-1] == source:
+        hops.pop()  # the connecting peer (CloudFront), appended by API Gateway
+    if trusted_hops > 0 and len(hops) >= trusted_hops:
+        return hops[-trusted_hops]
+    return source or "unknown"
+
+
+def client_key(event: dict, api_keys: Iterable[str] = (), trusted_hops: int = 1) -> str:
+    headers = {str(k).lower(): v for k, v in (event.get("headers") or {}).items()}
+    api_key = str(headers.get("x-api-key") or "").strip()
+    if api_key:
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        if digest in api_keys:
+            return "key:" + digest[:16]
+    return "ip:" + client_ip(event, trusted_hops)
+
+
+def _refill(tokens: float, updated: float, now: float, limit: Limit) -> float:
+    return min(limit.burst, tokens + max(0.0, now - updated) * limit.per_sec)
+
+
+def _retry_after(tokens: float, limit: Limit) -> int:
+    return max(1, int(math.ceil((1.0 - tokens) / limit.per_sec)))
+
+
+class MemoryBucketStore:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str, limit: Limit, now: Optional[float] = None) -> Tuple[bool, int]:
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.burst, now))
+            tokens = _refill(tokens, updated, now, limit)
+            if tokens >= 1.0:
+                self._buckets[key] = (tokens - 1.0, now)
+                return True, 0
+            self._buckets[key] = (tokens, now)
+            return False, _retry_after(tokens, limit)
+
+
+class DynamoBucketStore:
+    """
+    Table: partition key "pk" (S); attributes tokens (N), updated_at (N), expires_at (N, TTL).
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], table: str, max_attempts: int = 3):
+        self._ddb = client_factory
+        self.table = table
+        self.max_attempts = max_attempts
+
+    def take(self, key: str, limit: Limit, now: Optional[float] = None) -> Tuple[bool, int]:
+        ddb = self._ddb()
+        for _ in range(self.max_attempts):
+            now = time.time() if now is None else now
+            item = ddb.get_item(TableName=self.table, Key={"pk": {"S": key}}, ConsistentRead=True).get("Item")
+            if item:
+                prev_updated = item["updated_at"]["N"]
+                tokens = _refill(float(item["tokens"]["N"]), float(prev_updated), now, limit)
+            else:
+                prev_updated = None
+                tokens = limit.burst
+
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            # Idle buckets are full again after burst/rate seconds; let TTL drop them after that
+            expires = int(now + limit.burst / limit.per_sec + 60)
+            put = {
+                "TableName": self.table,
+                "Item": {
+                    "pk": {"S": key},
+                    "tokens": {"N": repr(tokens)},
+                    "updated_at": {"N": repr(now)},
+                    "expires_at": {"N": str(expires)},
+                },
+            }
+            if prev_updated is None:
+                put["ConditionExpression"] = "attribute_not_exists(pk)"
+            else:
+                put["ConditionExpression"] = "updated_at = :u"
+                put["ExpressionAttributeValues"] = {":u": {"N": prev_updated}}
+            try:
+                ddb.put_item(**put)
+            except Exception as e:
+                code = str(((getattr(e, "response", None) or {}).get("Error") or {}).get("Code") or "")
+                if code == "ConditionalCheckFailedException":
+                    now = None  # another container updated the bucket: re-read and retry
+                    continue
+                raise
+            return (True, 0) if allowed else (False, _retry_after(tokens, limit))
+        # Heavy contention on one bucket is itself a sign of overload
+        return False, 1
+
+
+class RateLimiter:
+    def __init__(self, store: Any, limits: Dict[str, Limit], api_keys: Iterable[str] = (), trusted_hops: int = 1):
+        self.store = store
+        self.limits = limits
+        self.api_keys = frozenset(api_keys)
+        self.trusted_hops = trusted_hops
+        self._allowed = counter("ratelimit.allowed")
+        self._throttled = counter("ratelimit.throttled")
+        self._errors = counter("ratelimit.store_errors")
+
+    def client_key(self, event: dict) -> str:
+        return client_key(event, self.api_keys, self.trusted_hops)
+
+    def check(self, event: dict, path: str) -> Optional[int]:
+        """None if the request may proceed, else the Retry-After seconds."""
+        # Same matching as the router (exact or suffix, e.g. /dev/runbooks/ask)
+        route = next((r for r in self.limits if path == r or path.endswith(r)), None)
+        if route is None or self.store is None:
+            return None
+        limit = self.limits[route]
+        key = f"{route}|{self.client_key(event)}"
+        try:
+            allowed, retry_after = self.store.take(key, limit)
+        except Exception as e:
+            self._errors.inc()
+            print(f"Rate limit store error (allowing request): {e}")
+            return None
+        if allowed:
+            self._allowed.inc()
+            return None
+        self._throttled.inc()
+        return retry_after
@@ -35,4 +35,9 @@ def get_body_json(event: dict) -> Dict[str, Any]:
     try:
         return json.loads(body)
     except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON body: {e}") from e
\ No newline at end of file
+        raise ValueError(f"Invalid JSON body: {e}") from e
+
+def get_query_params(event: dict) -> Dict[str, str]:
+    """Query string as a flat dict (HTTP API v2 and REST API v1 both use queryStringParameters)."""
+    params = event.get("queryStringParameters") or {}
+    return {str(k): str(v) for k, v in params.items() if v is not None}
@@ -22,7 +22,7 @@ def json_response(event: dict, status_code: int, body: dict, extra_headers: dict
         "Access-Control-Allow-Origin": str(cors_origin),
         "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
         "Access-Control-Allow-Headers": (
-            "Content-Type,Authorization,X-Requested-With,X-Amz-Date,X-Api-Key,X-Amz-Security-Token"
+            "Content-Type,Authorization,X-Requested-With,X-Amz-Date,X-Api-Key,X-Amz-Security-Token,Idempotency-Key,X-Include-Usage"
         ),
         "Vary": "Origin",
     }
@@ -0,0 +1,224 @@
+# core/usage.py
+#
+# Per-request LLM token accounting.
+#
+# _dispatch opens a RequestUsage per request (begin/finish); every OpenAI call
+# reports its usage block with record(). At the end of the request we log one
+# structured line
+#   LLM_USAGE {"route": "/runbooks/ask", "input_tokens": ..., "calls": [...]}
+# and fold the calls into rolling per-route / per-model aggregates (last
+# ROLLING_MINUTES, one bucket per minute) shown on GET /_debug/metrics.
+#
+# Ceiling: reserve() is called before each call with a rough estimate
+# (prompt chars / 4 + max output tokens). If the request would go over
+# LLM_TOKEN_CEILING it raises TokenBudgetExceeded instead of sending the call.
+#
+# Embedding calls made by the micro-batcher serve several requests at once (see
+# features/rag/embed_batcher.py): inside split_between() a recorded call is
+# charged to each of them by its share (input size), in its own totals and in
+# its route's rolling aggregates. Each request reserves its own estimate up front.
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.metrics import counter, histogram
+
+LOG_PREFIX = "LLM_USAGE"
+
+# 0 disables the per-request ceiling
+LLM_TOKEN_CEILING = int(os.environ.get("LLM_TOKEN_CEILING", "30000"))
+ROLLING_MINUTES = int(os.environ.get("LLM_USAGE_ROLLING_MINUTES", "60"))
+
+_FIELDS = ("calls", "input_tokens", "output_tokens", "cached_tokens", "latency_ms")
+
+
+class TokenBudgetExceeded(Exception):
+    """The next LLM call would push this request over its token ceiling."""
+
+
+class RequestUsage:
+    def __init__(self, route: str, ceiling: int = LLM_TOKEN_CEILING):
+        self.route = route
+        self.ceiling = ceiling
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def total_tokens(self) -> int:
+        with self._lock:
+            return sum(int(c["input_tokens"] or 0) + int(c["output_tokens"] or 0) for c in self.calls)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+        return {
+            "route": self.route,
+            "calls": len(calls),
+            "input_tokens": sum(int(c["input_tokens"] or 0) for c in calls),
+            "output_tokens": sum(int(c["output_tokens"] or 0) for c in calls),
+            "cached_tokens": sum(int(c["cached_tokens"] or 0) for c in calls),
+            "latency_ms": sum(int(c["latency_ms"] or 0) for c in calls),
+            "by_call": calls,
+        }
+
+
+_current: contextvars.ContextVar[Optional[RequestUsage]] = contextvars.ContextVar("request_usage", default=None)
+# Set by split_between(): calls recorded in this context are divided between these requests
+_split: contextvars.ContextVar[Optional[List[Tuple[Optional[RequestUsage], float]]]] = contextvars.ContextVar(
+    "usage_split", default=None
+)
+
+
+def begin(route: str) -> RequestUsage:
+    ru = RequestUsage(route)
+    _current.set(ru)
+    return ru
+
+
+def current() -> Optional[RequestUsage]:
+    return _current.get()
+
+
+def split_between(shares: List[Tuple[Optional[RequestUsage], float]]) -> None:
+    """
+    For the rest of the current context (run it in a copy), charge each recorded call to
+    the given requests by share (fractions summing to 1) instead of to the current request.
+    """
+    _split.set(list(shares))
+
+
+def _scaled(call: Dict[str, Any], share: float) -> Dict[str, Any]:
+    part = dict(call, share=round(share, 3))
+    for f in ("input_tokens", "output_tokens", "cached_tokens"):
+        if call.get(f) is not None:
+            part[f] = int(round(int(call[f]) * share))
+    return part
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or "") // 4 + 1
+
+
+def reserve(estimated_tokens: int, what: str = "LLM call") -> None:
+    ru = _current.get()
+    if ru is None or ru.ceiling <= 0:
+        return
+    used = ru.total_tokens()
+    if used + estimated_tokens > ru.ceiling:
+        counter("llm.ceiling_aborts").inc()
+        raise TokenBudgetExceeded(
+            f"{what} needs ~{estimated_tokens} tokens; request already used {used} of {ru.ceiling}"
+        )
+
+
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def parse_usage(usage: Any) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+    """(input, output, cached) from a Responses or Embeddings usage block (SDK object or dict)."""
+    if usage is None:
+        return None, None, None
+    inp = _field(usage, "input_tokens")
+    if inp is None:
+        inp = _field(usage, "prompt_tokens")  # embeddings
+    out = _field(usage, "output_tokens")
+    cached = _field(_field(usage, "input_tokens_details"), "cached_tokens")
+    return inp, out, cached
+
+
+def record(kind: str, model: str, usage: Any, latency_ms: float) -> Dict[str, Any]:
+    inp, out, cached = parse_usage(usage)
+    call = {
+        "kind": kind,
+        "model": model,
+        "input_tokens": inp,
+        "output_tokens": out,
+        "cached_tokens": cached,
+        "latency_ms": int(latency_ms),
+    }
+    split = _split.get()
+    if split is None or len(split) == 1:
+        owner = split[0][0] if split else _current.get()
+        split = [(owner, 1.0)]
+
+    histogram(f"llm.{kind}.call_ms").observe(latency_ms)
+    counter(f"llm.tokens.input.{model}").inc(int(inp or 0))
+    counter(f"llm.tokens.output.{model}").inc(int(out or 0))
+    shares = []
+    for ru, share in split:
+        part = call if share >= 1.0 else _scaled(call, share)
+        if ru is not None:
+            with ru._lock:
+                ru.calls.append(part)
+        shares.append((ru.route if ru is not None else "-", part))
+    _rolling.add(shares[0][0], model, call, shares=shares)
+    return call
+
+
+def finish() -> Optional[Dict[str, Any]]:
+    """Log the request's LLM_USAGE line; returns the summary (None if no LLM call was made)."""
+    ru = _current.get()
+    _current.set(None)
+    if ru is None or not ru.calls:
+        return None
+    summary = ru.summary()
+    print(f"{LOG_PREFIX} {json.dumps(summary, default=str, separators=(',', ':'))}")
+    return summary
+
+
+class RollingUsage:
+    def __init__(self, minutes: int = ROLLING_MINUTES):
+        self.minutes = max(1, minutes)
+        self._lock = threading.Lock()
+        # minute -> {("route", r) | ("model", m): {field: total}}
+        self._buckets: Dict[int, Dict[Tuple[str, str], Dict[str, int]]] = {}
+
+    def add(
+        self,
+        route: str,
+        model: str,
+        call: Dict[str, Any],
+        now: Optional[float] = None,
+        shares: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+    ) -> None:
+        """shares: [(route, part of call)] for a call split between requests; the model counts it once."""
+        minute = int((time.time() if now is None else now) // 60)
+        entries = [(("model", model), call)] + [(("route", r), part) for r, part in (shares or [(route, call)])]
+        with self._lock:
+            bucket = self._buckets.setdefault(minute, {})
+            for dim, part in entries:
+                agg = bucket.setdefault(dim, dict.fromkeys(_FIELDS, 0))
+                agg["calls"] += 1
+                for f in _FIELDS[1:]:
+                    agg[f] += int(part.get(f) or 0)
+            for old in [m for m in self._buckets if m <= minute - self.minutes]:
+                del self._buckets[old]
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Any]:
+        minute = int((time.time() if now is None else now) // 60)
+        out: Dict[str, Dict[str, Dict[str, int]]] = {"route": {}, "model": {}}
+        with self._lock:
+            for m, bucket in self._buckets.items():
+                if m <= minute - self.minutes:
+                    continue
+                for (dim, name), agg in bucket.items():
+                    tot = out[dim].setdefault(name, dict.fromkeys(_FIELDS, 0))
+                    for f in _FIELDS:
+                        tot[f] += agg[f]
+        return {"window_minutes": self.minutes, "by_route": out["route"], "by_model": out["model"]}
+
+
+_rolling = RollingUsage()
+
+
+def rolling_snapshot() -> Dict[str, Any]:
+    return _rolling.snapshot()
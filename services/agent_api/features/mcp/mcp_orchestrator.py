@@ -13,6 +13,9 @@ from typing import Any, Dict, List, Optional
 import urllib.request
 import urllib.error
 
+from core import deadline, usage
+from core.hedge import FailedAttempt, get_policy, hedged_call
+
 
 # -----------------------------
 # Models / Data Structures
@@ -74,6 +77,8 @@ def _http_request(
         headers["Content-Type"] = "application/json"
 
     req = urllib.request.Request(url, data=data, headers=headers, method=method.upper())
+    # Outside the try: running out of request time aborts the run with a 504, not a failed tool step
+    timeout_sec = deadline.timeout(timeout_sec, f"{method.upper()} {url}")
     try:
         with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
             raw = resp.read()
@@ -146,6 +151,7 @@ def _openai_post_json(payload: dict, timeout_sec: int = 25) -> dict:
             "Authorization": f"Bearer {OPENAI_API_KEY}",
         },
     )
+    timeout_sec = deadline.timeout(timeout_sec, "OpenAI call")
     try:
         with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
             return json.loads(resp.read().decode("utf-8", errors="replace"))
@@ -179,9 +185,22 @@ def _llm_json(prompt: str, *, model: str, temperature: float, max_tokens: int) -
         "temperature": temperature,
         "max_output_tokens": max_tokens,
     }
-    resp = _openai_post_json(payload, timeout_sec=30)
+    usage.reserve(usage.estimate_tokens(prompt) + max_tokens, "MCP LLM call")
+    t0 = time.perf_counter()
+    # Plan/reason calls are idempotent: hedge them when OPENAI_HEDGE is on
+    def _attempt() -> dict:
+        resp = _openai_post_json(payload, timeout_sec=30)
+        if resp.get("error"):
+            raise FailedAttempt(resp)
+        return resp
+
+    try:
+        resp = hedged_call(get_policy("mcp_json"), _attempt)
+    except FailedAttempt as e:
+        resp = e.result
     if resp.get("error"):
         return {"error": resp.get("error"), "raw": resp}
+    usage.record("mcp", model, resp.get("usage"), (time.perf_counter() - t0) * 1000)
 
     out_text = _openai_output_text(resp)
     candidate = _extract_json_object(out_text)
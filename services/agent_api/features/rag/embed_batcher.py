@@ -0,0 +1,123 @@
+# services/agent_api/features/rag/embed_batcher.py
+#
+# Micro-batching of query embeddings.
+#
+# Under a concurrent server every /runbooks/ask would otherwise send its own
+# one-item embeddings call. Here the first caller opens a batch and waits up to
+# max_wait_ms (or until max_batch texts have joined), then sends ONE embeddings
+# call for the whole batch and hands each waiting caller its own vector.
+# A lone caller pays at most max_wait_ms extra; max_wait_ms=0 flushes immediately
+# (the default in app.py: only worth enabling on hosts that serve requests concurrently).
+#
+# The flush runs in (a copy of) the leader's context, joined with the other
+# members: it may run until the latest member deadline and stops once every member
+# is abandoned (core.deadline.join), so one caller's short budget cannot fail the
+# others. Each caller reserves its own estimate before joining; the call's usage is
+# charged to each member by input size (core.usage.split_between), under its route.
+#
+# Metrics (core.metrics): rag.embed.batch_size, rag.embed.wait_ms, rag.embed.call_ms
+
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from core import deadline, usage
+from core.metrics import counter, histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.texts: List[str] = []
+        self.enqueued_at: List[float] = []
+        self.vectors: List[List[float]] = []
+        # Per text: (usage.current(), deadline.current()) of the request that sent it
+        self.members: List[Tuple[Any, Tuple[Optional[float], Any]]] = []
+        self.error: Optional[BaseException] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], List[List[float]]],
+        *,
+        max_batch: int = 16,
+        max_wait_ms: float = 5.0,
+        result_timeout_sec: float = 60.0,
+    ):
+        self._embed_many = embed_many
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_sec = max(0.0, float(max_wait_ms)) / 1000.0
+        self.result_timeout_sec = result_timeout_sec
+        self._lock = threading.Lock()
+        self._open: Optional[_Batch] = None
+
+        self._batch_size = histogram("rag.embed.batch_size", BATCH_SIZE_BUCKETS)
+        self._wait_ms = histogram("rag.embed.wait_ms")
+        self._call_ms = histogram("rag.embed.call_ms")
+        self._calls = counter("rag.embed.calls")
+        self._texts = counter("rag.embed.texts")
+
+    def embed(self, text: str) -> List[float]:
+        usage.reserve(usage.estimate_tokens(text), "query embedding")
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            idx = len(batch.texts)
+            batch.texts.append(text)
+            batch.enqueued_at.append(time.perf_counter())
+            batch.members.append((usage.current(), deadline.current()))
+            if len(batch.texts) >= self.max_batch:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            if self.max_wait_sec and self.max_batch > 1:
+                batch.full.wait(self.max_wait_sec)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._flush(batch)
+        elif not batch.done.wait(deadline.timeout(self.result_timeout_sec, "query embedding")):
+            raise TimeoutError("embedding batch did not complete")
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[idx]
+
+    def _flush(self, batch: _Batch) -> None:
+        started = time.perf_counter()
+        for t in batch.enqueued_at:
+            self._wait_ms.observe((started - t) * 1000.0)
+        self._batch_size.observe(len(batch.texts))
+
+        # Identical questions in the same window are embedded once
+        unique = list(dict.fromkeys(batch.texts))
+        try:
+            vectors = contextvars.copy_context().run(self._call, batch, unique)
+            if len(vectors) != len(unique):
+                raise RuntimeError(f"embeddings: got {len(vectors)} vectors for {len(unique)} inputs")
+            by_text = dict(zip(unique, vectors))
+            batch.vectors = [by_text[t] for t in batch.texts]
+        except BaseException as e:
+            batch.error = e
+        finally:
+            self._call_ms.observe((time.perf_counter() - started) * 1000.0)
+            self._calls.inc()
+            self._texts.inc(len(batch.texts))
+            batch.done.set()
+
+    def _call(self, batch: _Batch, texts: List[str]) -> List[List[float]]:
+        # Runs in a copy of the leader's context, widened to the whole batch
+        deadline.join([d for _, d in batch.members])
+        total = sum(max(1, len(t)) for t in batch.texts)
+        usage.split_between([(ru, max(1, len(t)) / total) for (ru, _), t in zip(batch.members, batch.texts)])
+        return self._embed_many(texts)
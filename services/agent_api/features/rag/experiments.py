@@ -0,0 +1,112 @@
+# services/agent_api/features/rag/experiments.py
+#
+# Online A/B experiments for /runbooks/ask (retrieval + generation settings).
+#
+# Config (agent-config/experiments.json in S3, or RAG_EXPERIMENTS env JSON):
+#   {"experiments": [
+#     {"name": "topk-3-vs-5", "enabled": true, "salt": "v1",
+#      "variants": [{"name": "control", "weight": 50, "overrides": {}},
+#                   {"name": "k3", "weight": 50, "overrides": {"top_k": 3}}]}
+#   ]}
+#
+# A client is assigned deterministically: sha256(experiment:salt:client_id) picks
+# a point in the weight range, so the same client always sees the same variant.
+# Every request logs one structured EXPERIMENT line (variants, latency, tokens,
+# retrieval distances); scripts/experiment_report.py compares variants from those logs.
+
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+LOG_PREFIX = "EXPERIMENT"
+
+# Knobs a variant may change; anything else in "overrides" is ignored
+OVERRIDE_KEYS = {
+    "top_k": int,               # final contexts sent to the LLM
+    "child_fanout": int,        # over-fetch factor for parent/child grouping
+    "route_top_m": int,         # runbooks kept by centroid routing (0 = no routing)
+    "model": str,               # answer model
+    "max_output_tokens": int,
+    "context_chars": int,       # excerpt budget in the prompt
+    "prompt_format": str,       # "default" | "concise"
+}
+
+
+@dataclass
+class Variant:
+    name: str
+    weight: float
+    overrides: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Experiment:
+    name: str
+    variants: List[Variant]
+    salt: str = ""
+
+
+def _clean_overrides(raw: Any) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    if not isinstance(raw, dict):
+        return out
+    for k, v in raw.items():
+        cast = OVERRIDE_KEYS.get(k)
+        if cast is None or v is None:
+            continue
+        try:
+            out[k] = cast(v)
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+def parse_experiments(data: Any) -> List[Experiment]:
+    items = data.get("experiments") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return []
+
+    out: List[Experiment] = []
+    for it in items:
+        if not isinstance(it, dict) or not it.get("name") or it.get("enabled") is False:
+            continue
+        variants = [
+            Variant(name=str(v["name"]), weight=float(v.get("weight") or 0), overrides=_clean_overrides(v.get("overrides")))
+            for v in (it.get("variants") or [])
+            if isinstance(v, dict) and v.get("name") and float(v.get("weight") or 0) > 0
+        ]
+        if variants:
+            out.append(Experiment(name=str(it["name"]), variants=variants, salt=str(it.get("salt") or "")))
+    return out
+
+
+def assign_variant(exp: Experiment, client_id: str) -> Variant:
+    digest = hashlib.sha256(f"{exp.name}:{exp.salt}:{client_id}".encode("utf-8")).hexdigest()
+    total = sum(v.weight for v in exp.variants)
+    point = (int(digest[:15], 16) / float(16 ** 15)) * total
+    acc = 0.0
+    for v in exp.variants:
+        acc += v.weight
+        if point < acc:
+            return v
+    return exp.variants[-1]
+
+
+def assign_all(experiments: List[Experiment], client_id: str) -> Dict[str, Variant]:
+    return {exp.name: assign_variant(exp, client_id) for exp in experiments}
+
+
+def merged_overrides(assigned: Dict[str, Variant]) -> Dict[str, Any]:
+    """Experiments should not overlap on a knob; if they do, the first listed wins."""
+    out: Dict[str, Any] = {}
+    for variant in assigned.values():
+        for k, v in variant.overrides.items():
+            out.setdefault(k, v)
+    return out
+
+
+def log_exposure(record: Dict[str, Any]) -> None:
+    print(f"{LOG_PREFIX} {json.dumps(record, default=str, separators=(',', ':'))}")
@@ -0,0 +1,72 @@
+# services/agent_api/features/rag/hierarchy.py
+#
+# Parent/child retrieval (see scripts/rag_chunking.py for the ingestion side).
+#
+# Small child chunks are embedded for precise matching; each child carries a
+# parent_id in its metadata. The parent section text lives once in parents.json
+# next to the Chroma store. Here we collapse child hits into de-duplicated
+# parent sections before they are sent to the LLM.
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List
+
+PARENTS_FILENAME = "parents.json"
+
+
+def load_parents(local_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Return {parent_id: {source, file, index, text}} or {} for a flat index."""
+    path = os.path.join(local_dir, PARENTS_FILENAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    parents = data.get("parents") if isinstance(data, dict) else None
+    return parents if isinstance(parents, dict) else {}
+
+
+def group_hits_by_parent(
+    hits: List[Dict[str, Any]],
+    parents: Dict[str, Dict[str, Any]],
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """
+    hits: [{"text", "meta", "distance"}] ordered by distance (best first).
+
+    Each parent appears once, ranked by its best child distance; the parent
+    text replaces the child text. Children without a known parent (flat
+    chunks, or a parent missing from the side table) pass through unchanged.
+    """
+    out: List[Dict[str, Any]] = []
+    by_parent: Dict[str, Dict[str, Any]] = {}
+
+    for h in hits:
+        meta = h.get("meta") if isinstance(h.get("meta"), dict) else {}
+        pid = meta.get("parent_id")
+        parent = parents.get(pid) if pid else None
+
+        if parent is None:
+            out.append(h)
+        elif pid in by_parent:
+            by_parent[pid]["meta"]["children"].append(meta.get("chunk"))
+            continue
+        else:
+            grouped = {
+                "text": parent.get("text") or h.get("text") or "",
+                "meta": {
+                    **meta,
+                    "section": parent.get("index", meta.get("parent_index")),
+                    "children": [meta.get("chunk")],
+                },
+                "distance": h.get("distance"),
+            }
+            by_parent[pid] = grouped
+            out.append(grouped)
+
+        if len(out) >= limit:
+            break
+
+    return out
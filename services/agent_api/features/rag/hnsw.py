@@ -0,0 +1,46 @@
+# services/agent_api/features/rag/hnsw.py
+#
+# HNSW search-time tuning for downloaded Chroma stores.
+#
+# M and construction_ef are fixed when a collection is built (see the HNSW_*
+# settings in scripts/build_chroma.py / rag_ingest_to_chroma.py). search_ef can
+# be changed per container: RAG_HNSW_SEARCH_EF wins, otherwise we use the
+# recommendation written to manifest.json by scripts/hnsw_sweep.py.
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+
+def search_ef_from_manifest(manifest: Dict[str, Any]) -> Optional[int]:
+    rec = manifest.get("hnsw_recommended")
+    if isinstance(rec, dict) and rec.get("search_ef"):
+        try:
+            return int(rec["search_ef"])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def apply_search_ef(client: Any, collection: Any, search_ef: int) -> bool:
+    """
+    Best-effort: Chroma reads hnsw:search_ef from the vector segment metadata
+    when the segment is opened and has no public API to change it afterwards,
+    so we set it on the loaded segment directly. Returns False if internals differ.
+    """
+    try:
+        from chromadb.segment import VectorReader  # type: ignore
+
+        manager = client._server._manager  # type: ignore[attr-defined]
+        segment = manager.get_segment(collection.id, VectorReader)
+        params = getattr(segment, "_params", None)
+        if params is None:
+            return False
+        params.search_ef = int(search_ef)
+        index = getattr(segment, "_index", None)
+        if index is not None:
+            index.set_ef(int(search_ef))
+        return True
+    except Exception as e:
+        print(f"HNSW search_ef not applied: {e}")
+        return False
@@ -0,0 +1,43 @@
+# services/agent_api/features/rag/manifest.py
+#
+# Reading the build manifest (manifest.json, published inside the vectors prefix).
+#
+# With MANIFEST_FILE_SHARDS the build's "files" map moves to files/NNNN.json next
+# to the manifest, which then keeps only "files_index" (scripts/rag_manifest.py);
+# these helpers read either layout.
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_FILES_DIRNAME = "files"
+
+
+def load_local_manifest(local_dir: str) -> Dict[str, Any]:
+    """manifest.json is published inside the vectors prefix, so it arrives with the store."""
+    try:
+        with open(os.path.join(local_dir, MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def manifest_file_count(manifest: Dict[str, Any]) -> int:
+    files = manifest.get("files")
+    if isinstance(files, dict):
+        return len(files)
+    idx = manifest.get("files_index")
+    return int(idx.get("count") or 0) if isinstance(idx, dict) else 0
+
+
+def manifest_file_shard_keys(manifest: Dict[str, Any], prefix: str) -> List[str]:
+    """S3 keys of the manifest's "files" shards under the vectors prefix ([] when inline)."""
+    idx = manifest.get("files_index")
+    if isinstance(manifest.get("files"), dict) or not isinstance(idx, dict):
+        return []
+    sub = str(idx.get("prefix") or f"{MANIFEST_FILES_DIRNAME}/")
+    return [f"{prefix.rstrip('/')}/{sub}{i:04d}.json" for i in range(int(idx.get("shards") or 0))]
@@ -0,0 +1,144 @@
+# services/agent_api/features/rag/quantized.py
+#
+# First-pass scan over quantized base vectors (scripts/rag_quant.py, VECTOR_QUANT=int8|binary).
+#
+# vectors.q.npy holds int8 codes (per-dimension scale) or sign bits for every base
+# vector. A query scans them with NumPy, keeps a shortlist of n_results * oversample
+# rows, and the caller re-scores that shortlist with the full-precision vectors from
+# Chroma (collection.get by id), so the returned distances are exact.
+#
+# Scores are dot products of the float query with the decoded codes: code * scale
+# (int8) or +-1 per sign bit (binary, through a per-byte lookup table). Ranking by
+# dot product is the same as l2 / cosine for the unit-length text-embedding-3 vectors.
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+QUANT_FILENAME = "vectors.q.npy"
+QUANT_INDEX_FILENAME = "vectors.q.json"
+
+# Shortlist size = n_results * oversample (binary codes are coarser)
+DEFAULT_OVERSAMPLE = {"int8": 4, "binary": 10}
+# Rows scored per block (bounds the float32 temporaries for int8)
+BLOCK_ROWS = 8192
+
+
+class QuantizedIndex:
+    def __init__(self, kind: str, dim: int, ids: List[str], keys: List[str], key_index: Any, codes: Any, scale: Any = None):
+        self.kind = kind
+        self.dim = dim
+        self.ids = ids
+        self.keys = keys
+        self.key_index = key_index      # numpy int32 [n]: row -> position in keys
+        self.codes = codes
+        self.scale = scale              # numpy float32 [dim] (int8 only)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _row_mask(self, where: Optional[Dict[str, Any]], key_field: str) -> Any:
+        # Only the filters this service builds on the runbook key: value / {"$in": [...]} / {"$nin": [...]}
+        import numpy as np
+
+        cond = (where or {}).get(key_field)
+        if cond is None:
+            return None
+        if not isinstance(cond, dict):
+            cond = {"$in": [cond]}
+        pos = {k: i for i, k in enumerate(self.keys)}
+        if "$in" in cond:
+            wanted = [pos[k] for k in cond["$in"] if k in pos]
+            return np.isin(self.key_index, np.asarray(wanted, dtype=np.int32))
+        if "$nin" in cond:
+            hidden = [pos[k] for k in cond["$nin"] if k in pos]
+            return ~np.isin(self.key_index, np.asarray(hidden, dtype=np.int32))
+        return None
+
+    def _scores(self, q: Any, rows: Any) -> Any:
+        """Lower is closer."""
+        import numpy as np
+
+        out = np.empty(rows.shape[0], dtype=np.float32)
+        if self.kind == "binary":
+            lut = binary_lut(q)
+            cols = np.arange(lut.shape[1])
+            for s in range(0, rows.shape[0], BLOCK_ROWS):
+                block = self.codes[rows[s : s + BLOCK_ROWS]]
+                out[s : s + BLOCK_ROWS] = -lut[block, cols].sum(axis=1)
+        else:
+            qs = (q * self.scale).astype(np.float32)
+            for s in range(0, rows.shape[0], BLOCK_ROWS):
+                block = self.codes[rows[s : s + BLOCK_ROWS]].astype(np.float32)
+                out[s : s + BLOCK_ROWS] = -(block @ qs)
+        return out
+
+    def shortlist(
+        self,
+        query_embedding: List[float],
+        n: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        key_field: str = "s3_key",
+    ) -> List[str]:
+        """Ids of the n best rows by quantized score (best first)."""
+        import numpy as np
+
+        q = np.asarray(query_embedding, dtype=np.float32)
+        if q.shape[0] != self.dim:
+            raise ValueError(f"query has {q.shape[0]} dims, quantized index has {self.dim}")
+        mask = self._row_mask(where, key_field)
+        rows = np.flatnonzero(mask) if mask is not None else np.arange(len(self.ids))
+        if rows.size == 0 or n <= 0:
+            return []
+
+        scores = self._scores(q, rows)
+        n = min(n, rows.size)
+        best = np.argpartition(scores, n - 1)[:n]
+        best = best[np.argsort(scores[best], kind="stable")]
+        return [self.ids[int(rows[i])] for i in best]
+
+
+def binary_lut(q: Any) -> Any:
+    """[256, dim/8]: dot product of each possible code byte (bits as +-1) with that byte's 8 query dims."""
+    import numpy as np
+
+    signs = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float32) * 2.0 - 1.0
+    qp = np.zeros(-(-q.shape[0] // 8) * 8, dtype=np.float32)
+    qp[: q.shape[0]] = q
+    return signs @ qp.reshape(-1, 8).T
+
+
+def load_quantized(local_dir: str) -> Optional[QuantizedIndex]:
+    idx_path = os.path.join(local_dir, QUANT_INDEX_FILENAME)
+    data_path = os.path.join(local_dir, QUANT_FILENAME)
+    if not (os.path.isfile(idx_path) and os.path.isfile(data_path)):
+        return None
+
+    import numpy as np  # lazy: keep cold start light for non-RAG routes
+
+    with open(idx_path, "r", encoding="utf-8") as f:
+        idx = json.load(f)
+    codes = np.load(data_path)
+    ids = list(idx.get("ids") or [])
+    if codes.shape[0] != len(ids):
+        raise RuntimeError(f"{QUANT_FILENAME}: {codes.shape[0]} rows for {len(ids)} ids")
+
+    kind = str(idx.get("kind") or "int8")
+    scale = None
+    if kind == "int8":
+        scale = np.asarray(idx.get("scale") or [], dtype=np.float32)
+        if scale.shape[0] != codes.shape[1]:
+            raise RuntimeError(f"{QUANT_INDEX_FILENAME}: scale has {scale.shape[0]} dims, codes have {codes.shape[1]}")
+
+    return QuantizedIndex(
+        kind=kind,
+        dim=int(idx.get("dim") or codes.shape[1]),
+        ids=ids,
+        keys=list(idx.get("keys") or []),
+        key_index=np.asarray(idx.get("key_index") or [], dtype=np.int32),
+        codes=codes,
+        scale=scale,
+    )
@@ -0,0 +1,48 @@
+# services/agent_api/features/rag/related.py
+#
+# Related-runbooks graph precomputed at ingestion (scripts/rag_doc_table.py:
+# top-k runbooks by centroid cosine similarity), read from
+# <VECTORS_PREFIX>/related.json of every shard. Lookups are dict reads; no
+# vector query is made at request time.
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+RELATED_FILENAME = "related.json"
+
+
+class RelatedGraph:
+    def __init__(self) -> None:
+        self._by_key: Dict[str, List[Dict[str, Any]]] = {}
+        self._key_by_file: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def add_shard(self, data: Any, shard: Optional[str] = None) -> None:
+        docs = data.get("docs") if isinstance(data, dict) else None
+        if not isinstance(docs, dict):
+            return
+        for key, doc in docs.items():
+            if not isinstance(doc, dict):
+                continue
+            related = []
+            for r in doc.get("related") or []:
+                if isinstance(r, dict) and r.get("key"):
+                    item = {"file": r.get("file"), "s3_key": r.get("key"), "score": r.get("score")}
+                    if shard:
+                        item["shard"] = shard
+                    related.append(item)
+            self._by_key[str(key)] = related
+            if doc.get("file"):
+                # Bare file names can repeat across folders/shards; the first one wins
+                self._key_by_file.setdefault(str(doc["file"]), str(key))
+
+    def resolve(self, file_or_key: str) -> Optional[str]:
+        if file_or_key in self._by_key:
+            return file_or_key
+        return self._key_by_file.get(file_or_key)
+
+    def for_key(self, key: str, limit: int = 5) -> List[Dict[str, Any]]:
+        return list(self._by_key.get(key) or [])[: max(0, limit)]
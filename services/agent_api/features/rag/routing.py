@@ -0,0 +1,113 @@
+# services/agent_api/features/rag/routing.py
+#
+# Coarse document-level routing (IVF-style) before chunk search.
+#
+# scripts/build_chroma.py writes one L2-normalized centroid per runbook
+# (documents.json + centroids.npy next to the Chroma store). We rank runbooks
+# by centroid similarity and restrict the chunk query to the top-M files.
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set
+
+DOCUMENTS_FILENAME = "documents.json"
+CENTROIDS_FILENAME = "centroids.npy"
+
+
+@dataclass
+class DocumentTable:
+    key_field: str          # chunk metadata field that holds the document key (e.g. "s3_key")
+    keys: List[str]
+    files: List[Optional[str]]
+    centroids: Any          # numpy float32 [len(keys), dim], unit rows
+
+
+def load_document_table(local_dir: str) -> Optional[DocumentTable]:
+    meta_path = os.path.join(local_dir, DOCUMENTS_FILENAME)
+    vec_path = os.path.join(local_dir, CENTROIDS_FILENAME)
+    if not (os.path.isfile(meta_path) and os.path.isfile(vec_path)):
+        return None
+
+    import numpy as np  # lazy: keep cold start light for non-RAG routes
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    docs = data.get("docs") if isinstance(data, dict) else None
+    rows = np.load(vec_path)
+    if not isinstance(docs, list) or len(docs) != rows.shape[0] or not docs:
+        return None
+
+    return DocumentTable(
+        key_field=str(data.get("key_field") or "s3_key"),
+        keys=[str(d.get("key")) for d in docs],
+        files=[d.get("file") for d in docs],
+        centroids=rows.astype(np.float32, copy=False),
+    )
+
+
+def route_documents(table: DocumentTable, query_embedding: List[float], top_m: int) -> List[str]:
+    """Return the keys of the top_m documents by cosine similarity to the query."""
+    import numpy as np
+
+    q = np.asarray(query_embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(q))
+    if norm > 0:
+        q = q / norm
+
+    scores = table.centroids @ q
+    m = min(top_m, scores.shape[0])
+    # argpartition is O(n); only the shortlisted m are fully sorted
+    idx = np.argpartition(-scores, m - 1)[:m]
+    idx = idx[np.argsort(-scores[idx])]
+    return [table.keys[i] for i in idx]
+
+
+def routing_where(table: DocumentTable, keys: List[str]) -> Dict[str, Any]:
+    if len(keys) == 1:
+        return {table.key_field: keys[0]}
+    return {table.key_field: {"$in": keys}}
+
+
+def merge_document_tables(
+    tables: List[Optional[DocumentTable]],
+    tombstones: Optional[List[Set[str]]] = None,
+) -> Optional[DocumentTable]:
+    """
+    Combine the base table with delta segment tables, oldest first. tombstones[i] (the
+    runbooks layer i changed or removed) drops those keys from the older layers before
+    tables[i] is laid on top, so a changed runbook keeps the row of the segment that
+    re-indexed it.
+    """
+    import numpy as np
+
+    tombstones = tombstones or []
+    present = [t for t in tables if t is not None]
+    if not present:
+        return None
+    if len(present) == 1 and not any(tombstones):
+        return present[0]
+
+    rows: Dict[str, Any] = {}
+    files: Dict[str, Optional[str]] = {}
+    for i, t in enumerate(tables):
+        for key in tombstones[i] if i < len(tombstones) else ():
+            rows.pop(key, None)
+            files.pop(key, None)
+        if t is None:
+            continue
+        for j, key in enumerate(t.keys):
+            rows[key] = t.centroids[j]
+            files[key] = t.files[j]
+    keys = list(rows)
+    if not keys:
+        return None
+
+    return DocumentTable(
+        key_field=present[0].key_field,
+        keys=keys,
+        files=[files[k] for k in keys],
+        centroids=np.stack([rows[k] for k in keys]).astype(np.float32, copy=False),
+    )
@@ -0,0 +1,137 @@
+# services/agent_api/features/rag/segments.py
+#
+# Append-only delta segments (see scripts/rag_segments.py for the publishing side).
+#
+# `build_chroma.py --delta` publishes small immutable segments next to the base
+# Chroma store instead of re-uploading it:
+#
+#   <VECTORS_PREFIX>/segments/<id>/vectors.npy + records.json (+ parents.json, documents.json)
+#
+# and lists them in manifest.json as "segments": [{"id", "seq", "prefix", "tombstones", ...}].
+# Segments are small, so they are searched brute force with NumPy. A hit from the
+# base (or an older segment) is dropped when a newer segment tombstones its s3_key.
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from features.rag.hierarchy import load_parents
+
+RECORDS_FILENAME = "records.json"
+VECTORS_FILENAME = "vectors.npy"
+
+
+@dataclass
+class DeltaSegment:
+    id: str
+    seq: int
+    tombstones: Set[str]
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    vectors: Any                                  # numpy float32 [n, dim]
+    parents: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    hidden: Set[str] = field(default_factory=set)  # s3_keys tombstoned by newer segments
+
+
+def manifest_segments(manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+    segs = manifest.get("segments")
+    if not isinstance(segs, list):
+        return []
+    return sorted([s for s in segs if isinstance(s, dict) and s.get("id")], key=lambda s: int(s.get("seq") or 0))
+
+
+def load_segment(local_dir: str, entry: Dict[str, Any]) -> DeltaSegment:
+    import numpy as np  # lazy: keep cold start light for non-RAG routes
+
+    with open(os.path.join(local_dir, RECORDS_FILENAME), "r", encoding="utf-8") as f:
+        rec = json.load(f)
+    vectors = np.load(os.path.join(local_dir, VECTORS_FILENAME)).astype(np.float32, copy=False)
+    ids = list(rec.get("ids") or [])
+    if vectors.shape[0] != len(ids):
+        raise RuntimeError(f"segment {entry.get('id')}: {vectors.shape[0]} vectors for {len(ids)} ids")
+
+    return DeltaSegment(
+        id=str(entry["id"]),
+        seq=int(entry.get("seq") or 0),
+        tombstones={str(k) for k in entry.get("tombstones") or []},
+        ids=ids,
+        documents=list(rec.get("documents") or [""] * len(ids)),
+        metadatas=list(rec.get("metadatas") or [{}] * len(ids)),
+        vectors=vectors,
+        parents=load_parents(local_dir),
+    )
+
+
+def link_tombstones(segments: List[DeltaSegment]) -> Set[str]:
+    """
+    segments are in seq order. Sets each segment's `hidden` keys (tombstoned by a
+    newer segment) and returns the keys hidden from the base store (any tombstone).
+    """
+    newer: Set[str] = set()
+    for seg in reversed(segments):
+        seg.hidden = set(newer)
+        newer |= seg.tombstones
+    return newer
+
+
+def _matches(meta: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    # Only the filters this service builds: {field: value} and {field: {"$in": [...]}}
+    for k, cond in (where or {}).items():
+        v = meta.get(k)
+        if isinstance(cond, dict):
+            if "$in" in cond and v not in cond["$in"]:
+                return False
+        elif v != cond:
+            return False
+    return True
+
+
+def distances(data: Any, query_embedding: List[float], space: str = "l2") -> Any:
+    """Exact distances of one query to the rows of data, in Chroma's convention for the space."""
+    import numpy as np
+
+    q = np.asarray(query_embedding, dtype=np.float32)
+    if space == "cosine":
+        d = data / np.maximum(np.linalg.norm(data, axis=1, keepdims=True), 1e-12)
+        return 1.0 - d @ (q / max(float(np.linalg.norm(q)), 1e-12))
+    if space == "ip":
+        return 1.0 - data @ q
+    diff = data - q  # l2 (squared), Chroma default
+    return np.einsum("ij,ij->i", diff, diff)
+
+
+def query_segment(
+    seg: DeltaSegment,
+    query_embedding: List[float],
+    n_results: int,
+    *,
+    space: str = "l2",
+    key_field: str = "s3_key",
+    where: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Exact search over one segment; distances use the same space as the Chroma collection."""
+    import numpy as np
+
+    if not seg.ids or n_results <= 0:
+        return []
+
+    keep = [
+        i for i, m in enumerate(seg.metadatas)
+        if (m or {}).get(key_field) not in seg.hidden and _matches(m or {}, where)
+    ]
+    if not keep:
+        return []
+
+    dist = distances(seg.vectors[keep], query_embedding, space)
+
+    n = min(n_results, dist.shape[0])
+    idx = np.argpartition(dist, n - 1)[:n]
+    idx = idx[np.argsort(dist[idx])]
+    return [
+        {"text": seg.documents[keep[i]], "meta": seg.metadatas[keep[i]], "distance": float(dist[i])}
+        for i in idx
+    ]
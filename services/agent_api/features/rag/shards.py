@@ -0,0 +1,305 @@
+# services/agent_api/features/rag/shards.py
+#
+# Sharded retrieval: several Chroma stores (per env, team or runbook category),
+# each with its own S3 prefix + collection.
+#
+# - Shards are loaded lazily (download + open on first use) and kept in an
+#   LRU cache bounded by a memory budget (on-disk size of the downloaded store
+#   is used as the estimate; HNSW segments are loaded fully into memory).
+# - Queries fan out to the relevant shards on a thread pool and the hits are
+#   merged by distance.
+#
+# - A shard whose published version moved (features/rag/versions.py) is
+#   reloaded in place: the new version loads first, then the old one is closed.
+# - get()/reload() hand out a shard acquired; callers release() it when done
+#   (after the query and the text hydration). Evicted or replaced shards leave
+#   the cache at once but are closed only when their last user releases them.
+#
+# The loader that actually downloads/opens a store lives in app.py; this module
+# only knows about configs, caching and merging.
+
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+@dataclass(frozen=True)
+class ShardConfig:
+    name: str
+    bucket: str
+    prefix: str
+    collection: str
+    local_dir: str
+    tags: Tuple[str, ...] = ()
+
+
+@dataclass
+class LoadedShard:
+    config: ShardConfig                                   # local_dir: this version's directory
+    client: Any
+    collection: Any
+    parents: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    doc_table: Any = None
+    manifest: Dict[str, Any] = field(default_factory=dict)
+    search_ef: Optional[int] = None
+    segments: List[Any] = field(default_factory=list)     # features.rag.segments.DeltaSegment, seq order
+    base_hidden: Set[str] = field(default_factory=set)    # s3_keys tombstoned by any segment
+    texts: Any = None                                     # features.rag.textstore.ChunkTextIndex (external texts)
+    quant: Any = None                                     # features.rag.quantized.QuantizedIndex (VECTOR_QUANT builds)
+    count: int = 0                                        # base collection vectors at load time
+    version: Optional[str] = None                         # published version (None: in-place store)
+    size_bytes: int = 0
+    load_ms: int = 0
+    loaded_at: float = 0.0
+    users: int = 0                                        # acquired by get()/reload(), not yet released
+    retired: bool = False                                 # out of the cache; closed when users drops to 0
+
+
+def dir_size_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+def parse_shard_configs(raw: str, *, default: ShardConfig, local_root: str) -> List[ShardConfig]:
+    """
+    RAG_SHARDS is a JSON list; every field except "name" falls back to the default shard:
+      [{"name": "sre", "prefix": "knowledge/vectors/dev/sre/", "collection": "runbooks_sre",
+        "tags": ["team:sre"]}, ...]
+    Empty/invalid -> [default] (single-collection behaviour).
+    """
+    raw = (raw or "").strip()
+    if not raw:
+        return [default]
+    try:
+        items = json.loads(raw)
+    except Exception as e:
+        print(f"RAG_SHARDS ignored (invalid JSON): {e}")
+        return [default]
+    if not isinstance(items, list):
+        return [default]
+
+    out: List[ShardConfig] = []
+    seen = set()
+    for it in items:
+        if not isinstance(it, dict) or not str(it.get("name") or "").strip():
+            continue
+        name = str(it["name"]).strip()
+        if name in seen:
+            continue
+        seen.add(name)
+        tags = it.get("tags") if isinstance(it.get("tags"), list) else []
+        out.append(
+            ShardConfig(
+                name=name,
+                bucket=str(it.get("bucket") or default.bucket).strip(),
+                prefix=str(it.get("prefix") or default.prefix).strip().lstrip("/"),
+                collection=str(it.get("collection") or default.collection).strip(),
+                local_dir=os.path.join(local_root, name),
+                tags=tuple(str(t).strip() for t in tags if str(t).strip()),
+            )
+        )
+    return out or [default]
+
+
+def select_shards(configs: List[ShardConfig], wanted: Optional[Iterable[str]]) -> List[ShardConfig]:
+    """Match requested names/tags; no selector (or no match) means all shards."""
+    wanted_set = {str(w).strip() for w in (wanted or []) if str(w).strip()}
+    if not wanted_set:
+        return list(configs)
+    picked = [c for c in configs if c.name in wanted_set or wanted_set.intersection(c.tags)]
+    return picked or list(configs)
+
+
+class ShardCache:
+    """
+    LRU of loaded shards under a byte budget. The most recently used shard is
+    never evicted, so a single oversized shard still works. Every shard returned
+    by get()/reload() must be passed to release() exactly once.
+    """
+
+    def __init__(self, loader: Callable[[ShardConfig], LoadedShard], budget_bytes: int):
+        self._loader = loader
+        self._budget = max(0, budget_bytes)
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._loaded: "OrderedDict[str, LoadedShard]" = OrderedDict()
+
+    def peek(self, name: str) -> Optional[LoadedShard]:
+        with self._lock:
+            return self._loaded.get(name)
+
+    def loaded(self) -> List[LoadedShard]:
+        with self._lock:
+            return list(self._loaded.values())
+
+    def get(self, cfg: ShardConfig) -> LoadedShard:
+        """The loaded shard (loading it on a miss), acquired: release() it when done."""
+        with self._lock:
+            hit = self._acquire_cached(cfg.name)
+            if hit is not None:
+                return hit
+            load_lock = self._load_locks.setdefault(cfg.name, threading.Lock())
+
+        # One loader per shard; concurrent callers for the same shard wait here
+        with load_lock:
+            with self._lock:
+                hit = self._acquire_cached(cfg.name)
+                if hit is not None:
+                    return hit
+
+            shard = self._load(cfg)
+            closable = self._insert(shard)
+
+        for old in closable:
+            self._close(old)
+        return shard
+
+    def reload(self, cfg: ShardConfig, stale: LoadedShard) -> LoadedShard:
+        """
+        Replace `stale` with a fresh load (e.g. a new published version) and return it acquired;
+        the caller still releases `stale`, which is closed once no request uses it. Concurrent
+        callers share one reload; if the loader fails, `stale` stays cached and the error propagates.
+        """
+        with self._lock:
+            load_lock = self._load_locks.setdefault(cfg.name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                hit = self._loaded.get(cfg.name)
+                if hit is not None and hit is not stale:
+                    return self._acquire_cached(cfg.name)
+
+            shard = self._load(cfg)
+            closable = self._insert(shard, replaces=stale)
+
+        for old in closable:
+            self._close(old)
+        return shard
+
+    def release(self, shard: LoadedShard) -> None:
+        with self._lock:
+            shard.users -= 1
+            close = shard.retired and shard.users <= 0
+        if close:
+            self._close(shard)
+
+    def _acquire_cached(self, name: str) -> Optional[LoadedShard]:
+        # Caller holds self._lock
+        hit = self._loaded.get(name)
+        if hit is not None:
+            self._loaded.move_to_end(name)
+            hit.users += 1
+        return hit
+
+    def _insert(self, shard: LoadedShard, replaces: Optional[LoadedShard] = None) -> List[LoadedShard]:
+        """Cache a fresh load (acquired for the caller); returns retired shards nobody is using."""
+        with self._lock:
+            shard.users += 1
+            self._loaded[shard.config.name] = shard
+            self._loaded.move_to_end(shard.config.name)
+            retired = self._evict_over_budget()
+            if replaces is not None and not replaces.retired:
+                retired.append(replaces)
+            for old in retired:
+                old.retired = True
+            return [old for old in retired if old.users <= 0]
+
+    def _close(self, shard: LoadedShard) -> None:
+        with self._lock:
+            # A reload of the same version can reuse the directory (and Chroma's cached system)
+            shared = any(s.config.local_dir == shard.config.local_dir for s in self._loaded.values())
+        _close_shard(shard, remove_files=not shared)
+
+    def _load(self, cfg: ShardConfig) -> LoadedShard:
+        t0 = time.time()
+        shard = self._loader(cfg)
+        shard.load_ms = int((time.time() - t0) * 1000)
+        shard.loaded_at = time.time()
+        if not shard.size_bytes:
+            shard.size_bytes = dir_size_bytes(shard.config.local_dir)
+        return shard
+
+    def _evict_over_budget(self) -> List[LoadedShard]:
+        evicted: List[LoadedShard] = []
+        if not self._budget:
+            return evicted
+        total = sum(s.size_bytes for s in self._loaded.values())
+        while total > self._budget and len(self._loaded) > 1:
+            _, old = self._loaded.popitem(last=False)
+            total -= old.size_bytes
+            evicted.append(old)
+        return evicted
+
+
+def _close_shard(shard: LoadedShard, remove_files: bool = True) -> None:
+    """Best-effort release of a Chroma client + its /tmp copy (internals vary by version)."""
+    name = shard.config.name
+    label = f"{name}@{shard.version}" if shard.version else name
+    if not remove_files:
+        print(f"Shard evicted: {label} (directory reused by the loaded copy)")
+        return
+    try:
+        system = getattr(shard.client, "_system", None)
+        if system is not None:
+            system.stop()
+        from chromadb.api.client import SharedSystemClient  # type: ignore
+
+        cache = getattr(SharedSystemClient, "_identifier_to_system", None)
+        if isinstance(cache, dict):
+            cache.pop(shard.config.local_dir, None)
+    except Exception as e:
+        print(f"Shard close skipped ({name}): {e}")
+    shutil.rmtree(shard.config.local_dir, ignore_errors=True)
+    print(f"Shard evicted: {label} ({shard.size_bytes} bytes)")
+
+
+def fan_out(
+    pool: Optional[ThreadPoolExecutor],
+    shards: List[ShardConfig],
+    fn: Callable[[ShardConfig], List[Dict[str, Any]]],
+) -> List[List[Dict[str, Any]]]:
+    """
+    Run fn per shard (inline when there is only one) and collect hit lists in
+    shard order. A failing shard is logged and skipped; if every shard fails the
+    first error is raised.
+    """
+    if len(shards) == 1:
+        return [fn(shards[0])]
+
+    futures = [(s, pool.submit(fn, s)) for s in shards]
+    results: List[List[Dict[str, Any]]] = []
+    first_error: Optional[BaseException] = None
+    for s, f in futures:
+        try:
+            results.append(f.result())
+        except Exception as e:
+            print(f"Shard query failed ({s.name}): {e}")
+            first_error = first_error or e
+    if not results and first_error is not None:
+        raise first_error
+    return results
+
+
+def merge_by_distance(hit_lists: List[List[Dict[str, Any]]], top_k: int) -> List[Dict[str, Any]]:
+    """Each list is already sorted by distance; k-way merge and keep the best top_k."""
+    def _dist(h: Dict[str, Any]) -> float:
+        d = h.get("distance")
+        return float(d) if d is not None else float("inf")
+
+    merged = heapq.merge(*hit_lists, key=_dist)
+    return [h for _, h in zip(range(top_k), merged)]
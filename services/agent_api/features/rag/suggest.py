@@ -0,0 +1,147 @@
+# services/agent_api/features/rag/suggest.py
+#
+# In-memory typeahead index for GET /runbooks/suggest.
+#
+# Sources (loaded once per container, see app._get_suggest_index):
+#   question  predefined questions (agent-config/questions.json)
+#   popular   curated past questions (agent-config/popular_questions.json) and
+#             questions asked on this container (/runbooks/ask)
+#   title     runbook titles        } from <VECTORS_PREFIX>/suggest.json written by
+#   heading   runbook section titles} scripts/build_chroma.py (no vector store download)
+#
+# Every entry is indexed under its normalized text and under each suffix that
+# starts at a content word, so "cache" matches "How do I invalidate CloudFront
+# cache ...". Keys live in one sorted list; a lookup is a bisect plus a short
+# scan, no vector index and no OpenAI call.
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import math
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+KIND_WEIGHT = {"popular": 3.0, "question": 2.5, "title": 2.0, "heading": 1.0}
+
+# Suffixes starting at these words are not indexed (the full-text key still covers them)
+_STOPWORDS = {
+    "a", "an", "and", "are", "at", "be", "can", "do", "does", "for", "how", "i", "in", "is", "it", "my",
+    "of", "on", "or", "should", "the", "to", "vs", "we", "what", "when", "which", "why", "with",
+}
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+MAX_KEY_CHARS = 64
+MAX_TEXT_CHARS = 200
+MAX_SCAN = 2000
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+@dataclass
+class SuggestEntry:
+    text: str
+    norm: str
+    kind: str
+    file: Optional[str] = None
+    count: int = 0
+    asked: int = 0  # part of count that came from record_question()
+
+
+class SuggestIndex:
+    def __init__(self, popular_min_count: int = 3):
+        # Asked questions are user input: only surface them once several requests asked them
+        self.popular_min_count = max(1, popular_min_count)
+        self._lock = threading.Lock()
+        self._entries: List[SuggestEntry] = []
+        self._by_norm: Dict[str, int] = {}
+        self._keys: List[Tuple[str, int]] = []
+        self._sorted = True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _index_keys(norm: str) -> List[str]:
+        words = norm.split()
+        keys = [norm[:MAX_KEY_CHARS]]
+        for i in range(1, len(words)):
+            if words[i] not in _STOPWORDS:
+                keys.append(" ".join(words[i:])[:MAX_KEY_CHARS])
+        return keys
+
+    def add(self, text: str, kind: str, *, file: Optional[str] = None, count: int = 0, asked: int = 0) -> None:
+        text = " ".join(str(text or "").split())
+        norm = normalize(text)
+        if not norm or len(text) > MAX_TEXT_CHARS or kind not in KIND_WEIGHT:
+            return
+        with self._lock:
+            i = self._by_norm.get(norm)
+            if i is not None:
+                e = self._entries[i]
+                e.count += count + asked
+                e.asked += asked
+                if KIND_WEIGHT[kind] > KIND_WEIGHT[e.kind]:
+                    e.kind = kind
+                e.file = e.file or file
+                return
+            i = len(self._entries)
+            self._entries.append(SuggestEntry(text=text, norm=norm, kind=kind, file=file, count=count + asked, asked=asked))
+            self._by_norm[norm] = i
+            self._keys.extend((k, i) for k in self._index_keys(norm))
+            self._sorted = False
+
+    def record_question(self, question: str) -> None:
+        self.add(question, "popular", asked=1)
+
+    def recorded(self) -> Dict[str, int]:
+        """Asked-question counts, carried over when the index is rebuilt."""
+        with self._lock:
+            return {e.text: e.asked for e in self._entries if e.asked > 0}
+
+    def _visible(self, e: SuggestEntry) -> bool:
+        return e.kind != "popular" or e.count >= self.popular_min_count
+
+    def _score(self, e: SuggestEntry, starts: bool) -> float:
+        return KIND_WEIGHT[e.kind] + math.log1p(e.count) + (1.0 if starts else 0.0) - len(e.norm) / 500.0
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[Dict[str, Any]]:
+        p = normalize(prefix)
+        with self._lock:
+            if not self._sorted:
+                self._keys.sort()
+                self._sorted = True
+
+            hits: Dict[int, bool] = {}
+            if not p:
+                # Empty box: most asked / predefined questions
+                hits = {i: True for i, e in enumerate(self._entries) if e.kind in ("popular", "question")}
+            else:
+                probe = p[:MAX_KEY_CHARS]
+                j = bisect.bisect_left(self._keys, (probe,))
+                end = min(len(self._keys), j + MAX_SCAN)
+                while j < end and self._keys[j][0].startswith(probe):
+                    key, i = self._keys[j]
+                    e = self._entries[i]
+                    # Keys are truncated; long prefixes are confirmed against the full text
+                    if len(p) <= MAX_KEY_CHARS or (" " + e.norm).find(" " + p) >= 0:
+                        hits[i] = hits.get(i, False) or e.norm.startswith(p)
+                    j += 1
+
+            ranked = heapq.nsmallest(
+                max(0, limit),
+                ((-self._score(self._entries[i], starts), self._entries[i].norm, i)
+                 for i, starts in hits.items() if self._visible(self._entries[i])),
+            )
+            out: List[Dict[str, Any]] = []
+            for _, _, i in ranked:
+                e = self._entries[i]
+                item: Dict[str, Any] = {"text": e.text, "kind": e.kind}
+                if e.file:
+                    item["file"] = e.file
+                out.append(item)
+            return out
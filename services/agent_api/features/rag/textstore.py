@@ -0,0 +1,132 @@
+# services/agent_api/features/rag/textstore.py
+#
+# Lazy chunk texts (scripts/rag_text_store.py, CHUNK_TEXT_STORE=external).
+#
+# The shard download skips the data file (chunks-<hash>.bin, named after its content
+# so a rebuild never rewrites the bytes an older index points at; chunks.bin in older
+# stores); only chunks.idx.json ({id: [offset, length], "object": <data file>})
+# is kept on /tmp. After retrieval has picked the final contexts we read just their
+# frames with S3 range GETs (nearby frames share one request) and decompress them.
+# Recently fetched texts stay in a small per-shard LRU.
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from core import deadline
+from core.metrics import counter, histogram
+
+TEXT_INDEX_FILENAME = "chunks.idx.json"
+TEXT_DATA_FILENAME = "chunks.bin"
+TEXT_DATA_GLOB = "chunks*.bin"  # download exclude: every data file name
+
+# Frames closer than this are fetched in one range request
+COALESCE_GAP_BYTES = 32 * 1024
+MAX_PARALLEL_RANGES = 8
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _decompress(codec: str, frame: bytes) -> str:
+    if codec == "zstd":
+        import zstandard  # type: ignore  # only needed for zstd-built stores
+
+        raw = zstandard.ZstdDecompressor().decompress(frame)
+    else:
+        raw = zlib.decompress(frame)
+    return raw.decode("utf-8", errors="replace")
+
+
+def coalesce(spans: Iterable[Tuple[int, int]], gap: int = COALESCE_GAP_BYTES) -> List[Tuple[int, int]]:
+    """Merge (offset, length) spans into inclusive byte ranges [(start, end)]."""
+    out: List[Tuple[int, int]] = []
+    for off, length in sorted(spans):
+        end = off + length - 1
+        if out and off - out[-1][1] <= gap:
+            out[-1] = (out[-1][0], max(out[-1][1], end))
+        else:
+            out.append((off, end))
+    return out
+
+
+class ChunkTextIndex:
+    def __init__(self, codec: str, offsets: Dict[str, List[int]], object_key: str, cache_size: int = 512):
+        self.codec = codec
+        self.offsets = offsets
+        self.object_key = object_key
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetch_ms = histogram("rag.text.fetch_ms")
+        self._ranges = counter("rag.text.range_gets")
+        self._hits = counter("rag.text.cache_hits")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def fetch(self, ids: List[str], range_get: Callable[[str, int, int], bytes]) -> Dict[str, str]:
+        """{id: text} for ids in the store; range_get(object_key, start, end_inclusive) -> bytes."""
+        out: Dict[str, str] = {}
+        wanted: Dict[str, Tuple[int, int]] = {}
+        with self._lock:
+            for cid in ids:
+                if cid in self._cache:
+                    self._cache.move_to_end(cid)
+                    out[cid] = self._cache[cid]
+                    self._hits.inc()
+                elif cid in self.offsets:
+                    off, length = self.offsets[cid]
+                    wanted[cid] = (int(off), int(length))
+        if not wanted:
+            return out
+
+        t0 = time.perf_counter()
+        ranges = coalesce(wanted.values())
+        self._ranges.inc(len(ranges))
+        get = deadline.run_in_context(lambda r: (r[0], range_get(self.object_key, r[0], r[1])))
+        if len(ranges) == 1:
+            blobs = [get(ranges[0])]
+        else:
+            blobs = list(_get_pool().map(get, ranges))
+
+        fetched: Dict[str, str] = {}
+        for cid, (off, length) in wanted.items():
+            for start, blob in blobs:
+                if start <= off and off + length <= start + len(blob):
+                    fetched[cid] = _decompress(self.codec, blob[off - start : off - start + length])
+                    break
+        out.update(fetched)
+        with self._lock:
+            self._cache.update(fetched)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._fetch_ms.observe((time.perf_counter() - t0) * 1000.0)
+        return out
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_RANGES, thread_name_prefix="rag-text")
+    return _pool
+
+
+def load_text_index(local_dir: str, object_prefix: str) -> Optional[ChunkTextIndex]:
+    """object_prefix: S3 prefix of the shard (the data file is <prefix>/<index "object">)."""
+    path = os.path.join(local_dir, TEXT_INDEX_FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    offsets = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(offsets, dict):
+        return None
+    name = str(data.get("object") or TEXT_DATA_FILENAME)
+    return ChunkTextIndex(str(data.get("codec") or "zlib"), offsets, f"{object_prefix.rstrip('/')}/{name}")
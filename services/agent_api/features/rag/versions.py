@@ -0,0 +1,74 @@
+# services/agent_api/features/rag/versions.py
+#
+# Versioned stores (scripts/rag_versions.py): every build is published under
+# <VECTORS_PREFIX>/versions/<version>/ and <VECTORS_PREFIX>/current.json names
+# the live one. A shard resolves the pointer before loading and then reads
+# only that version's files, so it never mixes two builds; re-checking the
+# pointer every RAG_VERSION_CHECK_SEC lets a warm container pick up a new
+# build (or a rollback) without a redeploy. Without current.json the store
+# is read in place, as before versioning.
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from features.rag.shards import ShardConfig
+
+POINTER_FILENAME = "current.json"
+VERSIONS_DIRNAME = "versions"
+
+
+@dataclass(frozen=True)
+class Published:
+    version: Optional[str]  # None: in-place layout (no current.json)
+    prefix: str             # where the live store's files are
+
+
+def published_from_pointer(root: str, pointer: Any) -> Published:
+    root = root.rstrip("/") + "/"
+    if not pointer:
+        return Published(None, root)
+    version = str(pointer.get("version") or "") if isinstance(pointer, dict) else ""
+    if not version or "/" in version or version.startswith("."):
+        raise ValueError(f"invalid {POINTER_FILENAME} under {root}: version={version!r}")
+    return Published(version, f"{root}{VERSIONS_DIRNAME}/{version}/")
+
+
+def versioned_local_dir(local_dir: str, version: Optional[str]) -> str:
+    # One directory per version, so the outgoing store can be closed (and removed) after the new one loads
+    return os.path.join(local_dir, version or "live")
+
+
+class PointerCache:
+    """
+    Per-shard current.json, re-read once it is older than max_age seconds. fetch returns the
+    parsed pointer or None when there is none; if it raises, the last known value is kept
+    (a transient S3 error must not switch a shard to another layout).
+    """
+
+    def __init__(self, fetch: Callable[[ShardConfig], Optional[Dict[str, Any]]], max_age: float):
+        self._fetch = fetch
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, Published]] = {}
+
+    def get(self, cfg: ShardConfig, max_age: Optional[float] = None) -> Published:
+        max_age = self._max_age if max_age is None else max_age
+        with self._lock:
+            hit = self._cache.get(cfg.name)
+        if hit is not None and time.time() - hit[0] < max_age:
+            return hit[1]
+        try:
+            published = published_from_pointer(cfg.prefix, self._fetch(cfg))
+        except Exception as e:
+            if hit is None:
+                raise
+            print(f"{POINTER_FILENAME} check failed ({cfg.name}), keeping {hit[1].version or 'in-place'}: {e}")
+            published = hit[1]
+        with self._lock:
+            self._cache[cfg.name] = (time.time(), published)
+        return published
@@ -27,6 +27,7 @@ import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Tuple
 
+from core import deadline
 from core.response import json_response
 
 # =====================
@@ -123,6 +124,7 @@ def _is_relevant(text: str) -> bool:
 
 def _http_get_text(url: str, timeout_sec: int = 10) -> str:
     req = urllib.request.Request(url, headers=_DEFAULT_HTTP_HEADERS)
+    timeout_sec = deadline.timeout(timeout_sec, f"GET {url}")
     try:
         with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
             return resp.read().decode("utf-8", errors="ignore")
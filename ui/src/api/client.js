@@ -12,6 +12,15 @@ function buildUrl(path) {
   return `${API_BASE}${path}`;
 }
 
+/**
+ * One key per logical POST, reused by every retry of it, so the API can
+ * replay the first result instead of running the LLM call again.
+ */
+export function newIdempotencyKey() {
+  if (globalThis.crypto?.randomUUID) return globalThis.crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 function sleep(ms) {
   return new Promise((r) => setTimeout(r, ms));
 }
@@ -88,7 +97,7 @@ export async function apiGet(path) {
   );
 }
 
-export async function apiPost(path, body) {
+export async function apiPost(path, body, { idempotencyKey } = {}) {
   const url = buildUrl(path);
   return requestWithRetry(
     url,
@@ -97,6 +106,7 @@ export async function apiPost(path, body) {
       headers: {
         "Content-Type": "application/json",
         Accept: "application/json",
+        "Idempotency-Key": idempotencyKey || newIdempotencyKey(),
       },
       body: JSON.stringify(body ?? {}),
     },
@@ -1,5 +1,6 @@
 // ui/src/components/AskRunbooks.jsx
-import React, { useMemo, useState } from "react";
+import React, { useEffect, useMemo, useState } from "react";
+import { apiGet, newIdempotencyKey } from "../api/client";
 
 /**
  * POST JSON with a single "soft retry" when first response is likely
@@ -17,12 +18,16 @@ async function postJsonWithSoftRetry(
     onRetry = null,
   } = {}
 ) {
+  // One key for the request and its retry: a retry replays a completed answer
+  const idempotencyKey = newIdempotencyKey();
+
   async function attempt() {
     const res = await fetch(url, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
         Accept: "application/json",
+        "Idempotency-Key": idempotencyKey,
       },
       body: JSON.stringify(body ?? {}),
     });
@@ -103,6 +108,30 @@ export default function AskRunbooks() {
   const [sources, setSources] = useState([]);
   const [raw, setRaw] = useState(null);
   const [showRaw, setShowRaw] = useState(false);
+  const [suggestions, setSuggestions] = useState([]);
+
+  // Typeahead: cheap server-side prefix lookup, debounced
+  useEffect(() => {
+    const prefix = question.trim();
+    if (prefix.length < 2 || loading) {
+      setSuggestions([]);
+      return undefined;
+    }
+    let cancelled = false;
+    const t = setTimeout(async () => {
+      try {
+        const json = await apiGet(`/runbooks/suggest?prefix=${encodeURIComponent(prefix)}&limit=6`);
+        const items = Array.isArray(json?.suggestions) ? json.suggestions : [];
+        if (!cancelled) setSuggestions(items.filter((s) => s.text !== prefix));
+      } catch {
+        if (!cancelled) setSuggestions([]);
+      }
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(t);
+    };
+  }, [question, loading]);
 
   const canAsk = useMemo(
     () => question.trim().length > 0 && !loading,
@@ -209,6 +238,32 @@ export default function AskRunbooks() {
         }}
       />
 
+      {suggestions.length > 0 && (
+        <div style={{ display: "flex", flexWrap: "wrap", gap: 6, marginTop: 6 }}>
+          {suggestions.map((s) => (
+            <button
+              key={`${s.kind}:${s.text}`}
+              type="button"
+              onClick={() => {
+                setQuestion(s.text);
+                setSuggestions([]);
+              }}
+              title={s.file ? `${s.kind} · ${s.file}` : s.kind}
+              style={{
+                padding: "0.25rem 0.6rem",
+                borderRadius: 999,
+                border: "1px solid #ddd",
+                background: "#fafafa",
+                fontSize: 13,
+                cursor: "pointer",
+              }}
+            >
+              {s.text}
+            </button>
+          ))}
+        </div>
+      )}
+
       <div style={{ display: "flex", gap: 12, alignItems: "center", marginTop: 12 }}>
         <label style={{ display: "flex", gap: 8, alignItems: "center" }}>
           Top K:
@@ -272,6 +327,11 @@ export default function AskRunbooks() {
                       <span style={{ opacity: 0.8 }}> (chunk {s.chunk})</span>
                     ) : null}
                     {s.s3_key ? <span style={{ opacity: 0.7 }}> — {s.s3_key}</span> : null}
+                    {Array.isArray(s.related) && s.related.length > 0 ? (
+                      <div style={{ fontSize: 13, opacity: 0.75 }}>
+                        Related: {s.related.map((r) => r.file || r.s3_key).join(", ")}
+                      </div>
+                    ) : null}
                   </li>
                 ))}
               </ul>
@@ -1,6 +1,6 @@
 // ui/src/pages/Mcp.jsx
 import React, { useMemo, useRef, useState } from "react";
-import { apiPost } from "../api/client";
+import { apiPost, newIdempotencyKey } from "../api/client";
 import { MCP_SCENARIOS } from "../data/mcpScenarios";
 
 function pretty(obj) {
@@ -38,10 +38,13 @@ async function postMcpWithSoftRetry(
     retryOnStatuses = [502, 503, 504],
   } = {}
 ) {
+  // Same key for both attempts so the API can replay a run that already finished
+  const idempotencyKey = newIdempotencyKey();
+
   // Attempt #1 using your existing client
   try {
     onStatus("Running…");
-    const res = await apiPost("/api/mcp/run", payload);
+    const res = await apiPost("/api/mcp/run", payload, { idempotencyKey });
     return { ok: true, data: res, meta: { retried: false, via: "apiPost" } };
   } catch (e1) {
     const msg1 = String(e1?.message || e1 || "");
@@ -64,7 +67,11 @@ async function postMcpWithSoftRetry(
     // Attempt #2 — use fetch directly so we can detect HTML and show a better error
     const res2 = await fetch("/api/mcp/run", {
       method: "POST",
-      headers: { "Content-Type": "application/json", Accept: "application/json" },
+      headers: {
+        "Content-Type": "application/json",
+        Accept: "application/json",
+        "Idempotency-Key": idempotencyKey,
+      },
       body: JSON.stringify(payload ?? {}),
     });
 
@@ -1,4 +1,5 @@
 import React, { useMemo, useState } from "react";
+import { newIdempotencyKey } from "../api/client";
 
 const card = {
   padding: 14,
@@ -274,6 +275,8 @@ export default function Runbooks() {
     const timeoutMs = Math.min(60000, Math.max(5000, Number(opts.timeoutMs || 25000)));
 
     let lastErr = null;
+    // Reused by every attempt so the API replays an answer that already completed
+    const idempotencyKey = newIdempotencyKey();
 
     for (let attempt = 1; attempt <= attempts; attempt++) {
       const controller = new AbortController();
@@ -288,7 +291,11 @@ export default function Runbooks() {
 
         const res = await fetch(url, {
           method: "POST",
-          headers: { "Content-Type": "application/json", ...(opts.headers || {}) },
+          headers: {
+            "Content-Type": "application/json",
+            "Idempotency-Key": idempotencyKey,
+            ...(opts.headers || {}),
+          },
           body: JSON.stringify(payload),
           signal: controller.signal,
         });